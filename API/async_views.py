@@ -0,0 +1,80 @@
+"""
+Async variants of the read endpoints for ASGI deployments, used instead of
+the views in API.views when the ASYNC_API setting is on.
+
+GET is answered with the async cache and ORM APIs and returns the same
+bytes and headers as the DRF views; other methods, HEAD included, are
+passed to the DRF view in a thread. Reads skip DRF's authentication, none of them needs
+a user, so a bad token is not rejected on a read.
+"""
+from functools import wraps
+from typing import Any, Awaitable, Callable, Dict
+from asgiref.sync import sync_to_async
+from django.http import Http404, HttpRequest, HttpResponse
+from django.utils.cache import patch_vary_headers
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import exceptions, status
+from CaffeRatings import caching
+from . import payloads, views
+from .conditional import versioned
+from .pagination import get_cursor, get_page_size, next_link
+from .renderers import FastJSONRenderer
+
+
+def _json(data: Any, code: int, allow: str) -> HttpResponse:
+    renderer = FastJSONRenderer()
+    response = HttpResponse(renderer.render(data), status=code, content_type=renderer.media_type)
+    # what DRF's finalize_response adds
+    response['Allow'] = allow
+    patch_vary_headers(response, ['Accept'])
+    return response
+
+
+def read_only(sync_view: Callable) -> Callable:
+    """
+    Answers GET with the decorated coroutine, which returns a page
+    payload, and everything else with sync_view.
+    """
+    allow = ', '.join(sync_view.cls().allowed_methods)
+
+    def decorator(read: Callable[..., Awaitable[Dict[str, Any]]]) -> Callable:
+        @wraps(read)
+        async def view(request: HttpRequest, *args, **kwargs) -> HttpResponse:
+            if request.method != 'GET':
+                return await sync_to_async(sync_view)(request, *args, **kwargs)
+            try:
+                page = await read(request, *args, **kwargs)
+            except (Http404, exceptions.APIException) as exc:
+                # same body and status as DRF's exception handler
+                if isinstance(exc, Http404):
+                    exc = exceptions.NotFound(*exc.args)
+                return _json({'detail': exc.detail}, exc.status_code, allow)
+
+            response = _json(page['results'], status.HTTP_200_OK, allow)
+            link = next_link(request, page)
+            if link:
+                response['Link'] = link
+            return response
+        return view
+    return decorator
+
+
+@csrf_exempt
+@versioned('ratings', lambda city, cafe_name: [caching.cafe_generation(city, cafe_name)])
+@read_only(views.getRating)
+async def getRating(request: HttpRequest, city: str, cafe_name: str) -> Dict[str, Any]:
+    return await payloads.ratings(city, cafe_name, get_cursor(request), get_page_size(request)).aget()
+
+
+@csrf_exempt
+@versioned('cafes', lambda city: [caching.city_generation(city)])
+@read_only(views.getOrCreateCafes)
+async def getOrCreateCafes(request: HttpRequest, city: str) -> Dict[str, Any]:
+    return await payloads.cafes(city, get_cursor(request), get_page_size(request)).aget()
+
+
+@csrf_exempt
+@versioned('cities', lambda: [caching.CITIES_GENERATION])
+@read_only(views.getCities)
+async def getCities(request: HttpRequest) -> Dict[str, Any]:
+    return await payloads.cities(get_cursor(request), get_page_size(request)).aget()
@@ -0,0 +1,85 @@
+"""
+JWT authentication of the API.
+
+Access tokens are verified once per request, by DRF's authentication step;
+permissions read the claims from request.auth. Verified tokens are kept in a
+bounded in-process LRU cache keyed by the raw token until their exp claim,
+so a burst of requests with the same token pays for one HMAC check. Restart
+the workers after rotating SIGNING_KEY.
+
+    JWT_VERIFIED_CACHE_SIZE = 1024    # 0 turns the cache off
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+from django.conf import settings
+from rest_framework_simplejwt import authentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.tokens import Token
+from CaffeReviewer import instrumentation, metrics
+
+
+DEFAULT_CACHE_SIZE = 1024
+
+
+class VerifiedTokenCache:
+    def __init__(self) -> None:
+        self._entries: 'OrderedDict[bytes, Tuple[float, Token]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, raw_token: bytes) -> Optional[Token]:
+        with self._lock:
+            entry = self._entries.get(raw_token)
+            if entry is None:
+                return None
+            expires, token = entry
+            if expires <= time.time():
+                # expired tokens are verified again, which rejects them
+                del self._entries[raw_token]
+                return None
+            self._entries.move_to_end(raw_token)
+            return token
+
+    def set(self, raw_token: bytes, token: Token) -> None:
+        max_size = getattr(settings, 'JWT_VERIFIED_CACHE_SIZE', DEFAULT_CACHE_SIZE)
+        expires = token.get('exp')
+        if max_size <= 0 or expires is None:
+            return
+        with self._lock:
+            self._entries[raw_token] = (expires, token)
+            self._entries.move_to_end(raw_token)
+            while len(self._entries) > max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+verified_tokens = VerifiedTokenCache()
+
+
+class JWTAuthentication(authentication.JWTAuthentication):
+    """
+    simplejwt authentication that skips verifying recently verified tokens
+    and counts validations for /_internal/metrics.
+    """
+    def get_validated_token(self, raw_token: bytes) -> Token:
+        token = verified_tokens.get(raw_token)
+        if token is not None:
+            instrumentation.increment('jwt_validations', 'cached')
+            metrics.maybe_flush()
+            return token
+
+        try:
+            token = super().get_validated_token(raw_token)
+        except InvalidToken:
+            instrumentation.increment('jwt_validations', 'invalid')
+            raise
+        else:
+            instrumentation.increment('jwt_validations', 'valid')
+        finally:
+            metrics.maybe_flush()
+        verified_tokens.set(raw_token, token)
+        return token
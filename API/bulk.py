@@ -0,0 +1,118 @@
+"""
+Bulk cafe import: validates a whole batch, creates missing cities once,
+inserts cafes with bulk_create in chunks and reports a result per row.
+Valid rows are kept when others fail.
+"""
+from typing import Any, Dict, Iterable, List, Set, Tuple
+from django.db import IntegrityError, transaction
+from CaffeRatings import caching
+from CaffeRatings.models import CAFE_SLUG_LENGTH, CITY_SLUG_LENGTH, Cafe, City, base_slug
+from .serializers import CafeImportSerializer
+
+
+MAX_ROWS = 5000
+CHUNK_SIZE = 500
+
+
+def _error(index: int, errors: Any) -> Dict[str, Any]:
+    return {'index': index, 'status': 'error', 'errors': errors}
+
+
+def _city_slug(name: str) -> str:
+    return base_slug(name, CITY_SLUG_LENGTH)
+
+
+def _cafe_slug(name: str) -> str:
+    return base_slug(name, CAFE_SLUG_LENGTH)
+
+
+def _resolve_cities(names: Set[str]) -> Dict[str, City]:
+    # keyed by slug, "Krakow" and "krakow" are the same city
+    slugs = {_city_slug(name): name for name in names}
+    cities = {city.slug: city for city in City.objects.filter(slug__in=slugs)}
+    missing = slugs.keys() - cities.keys()
+    if missing:
+        # concurrent imports may create the same city, the second insert is ignored
+        City.objects.bulk_create([City(name=slugs[slug], slug=slug) for slug in missing], ignore_conflicts=True)
+        cities.update({city.slug: city for city in City.objects.filter(slug__in=missing)})
+        caching.invalidate_cities()
+    return cities
+
+
+def _existing_pairs(rows: List[Tuple[int, Dict[str, Any]]], cities: Dict[str, City]) -> Set[Tuple[str, int]]:
+    existing = set()
+    for start in range(0, len(rows), CHUNK_SIZE):
+        chunk = rows[start:start + CHUNK_SIZE]
+        slugs = {_cafe_slug(data['name']) for _, data in chunk}
+        city_ids = {cities[_city_slug(data['city'])].pk for _, data in chunk}
+        existing.update(
+            Cafe.objects.filter(slug__in=slugs, city_id__in=city_ids).values_list('slug', 'city_id')
+        )
+    return existing
+
+
+def _insert(chunk: List[Tuple[int, Cafe]]) -> Dict[int, Dict[str, Any]]:
+    try:
+        with transaction.atomic():
+            Cafe.objects.bulk_create([cafe for _, cafe in chunk])
+        return {index: {'index': index, 'status': 'created'} for index, _ in chunk}
+    except IntegrityError:
+        pass
+
+    # a concurrent writer won a race on some row, find out which one by one
+    results = {}
+    for index, cafe in chunk:
+        try:
+            with transaction.atomic():
+                Cafe.objects.bulk_create([cafe])
+            results[index] = {'index': index, 'status': 'created'}
+        except IntegrityError:
+            results[index] = _error(index, {'non_field_errors': ['Cafe with this name already exists in this city.']})
+    return results
+
+
+def import_cafes(rows: Iterable[Any]) -> List[Dict[str, Any]]:
+    rows = list(rows)
+    results: Dict[int, Dict[str, Any]] = {}
+
+    valid = []
+    for index, row in enumerate(rows):
+        if not isinstance(row, dict):
+            results[index] = _error(index, {'non_field_errors': ['Expected an object.']})
+            continue
+        serializer = CafeImportSerializer(data=row)
+        if serializer.is_valid():
+            valid.append((index, serializer.validated_data))
+        else:
+            results[index] = _error(index, serializer.errors)
+
+    cities = _resolve_cities({data['city'] for _, data in valid})
+    existing = _existing_pairs(valid, cities)
+
+    pending = []
+    for index, data in valid:
+        city = cities[_city_slug(data['city'])]
+        pair = (_cafe_slug(data['name']), city.pk)
+        if pair in existing:
+            results[index] = _error(index, {'non_field_errors': ['Cafe with this name already exists in this city.']})
+            continue
+        existing.add(pair)
+        pending.append((index, Cafe(
+            name=data['name'],
+            slug=pair[0],
+            location=data['location'],
+            image=data.get('image'),
+            city=city,
+            approved=data['approved'],
+        )))
+
+    for start in range(0, len(pending), CHUNK_SIZE):
+        results.update(_insert(pending[start:start + CHUNK_SIZE]))
+
+    # bulk_create skips the cafe signals, so caches are invalidated here once
+    # per city; approved_cafes and display are recounted by bulk_create itself
+    created = [cafe for index, cafe in pending if results[index]['status'] == 'created']
+    for slug in {cafe.city.slug for cafe in created}:
+        caching.invalidate_city(slug)
+
+    return [results[index] for index in range(len(rows))]
@@ -0,0 +1,62 @@
+"""
+Conditional GET support for the cached read endpoints.
+
+ETag and Last-Modified come from the generation counters the payloads are
+cached under, so a matching If-None-Match / If-Modified-Since is answered
+with 304 before any queryset is evaluated or any payload is built.
+"""
+import hashlib
+from datetime import datetime, timezone
+from functools import wraps
+from typing import Callable, List, Optional, Tuple
+from asgiref.sync import iscoroutinefunction
+from django.http import HttpRequest, HttpResponse
+from django.views.decorators.http import condition
+from CaffeRatings import caching
+
+
+def _versions(request: HttpRequest, generation_keys: List[str]) -> Tuple[Tuple[int, ...], float]:
+    # etag and last_modified callbacks share one cache lookup
+    if not hasattr(request, '_data_versions'):
+        request._data_versions = caching.get_versions(generation_keys)
+    return request._data_versions
+
+
+def versioned(prefix: str, generation_keys: Callable[..., List[str]]) -> Callable:
+    """
+    Decorates a view with strong ETag / Last-Modified handling for GET and
+    HEAD. generation_keys receives the view's URL arguments. Async views
+    read the versions with the async cache API before the checks run.
+    """
+    def etag(request: HttpRequest, *args, **kwargs) -> Optional[str]:
+        if request.method not in ('GET', 'HEAD'):
+            return None
+        generations, _ = _versions(request, generation_keys(*args, **kwargs))
+        # pages and renderers have distinct bodies, so they get distinct tags
+        variant = hashlib.md5(
+            f"{request.get_full_path()}|{request.META.get('HTTP_ACCEPT', '')}".encode(),
+            usedforsecurity=False,
+        ).hexdigest()[:12]
+        return f'{prefix}-{"-".join(map(str, generations))}-{variant}'
+
+    def last_modified(request: HttpRequest, *args, **kwargs) -> Optional[datetime]:
+        if request.method not in ('GET', 'HEAD'):
+            return None
+        _, modified = _versions(request, generation_keys(*args, **kwargs))
+        return datetime.fromtimestamp(modified, tz=timezone.utc)
+
+    conditional = condition(etag_func=etag, last_modified_func=last_modified)
+
+    def decorator(view: Callable) -> Callable:
+        checked = conditional(view)
+        if not iscoroutinefunction(view):
+            return checked
+
+        @wraps(view)
+        async def inner(request: HttpRequest, *args, **kwargs) -> HttpResponse:
+            if request.method in ('GET', 'HEAD') and not hasattr(request, '_data_versions'):
+                request._data_versions = await caching.aget_versions(generation_keys(*args, **kwargs))
+            return await checked(request, *args, **kwargs)
+        return inner
+
+    return decorator
@@ -0,0 +1,90 @@
+"""
+Keyset (cursor) pagination for the function based list views.
+
+Pages are read with `WHERE pk > cursor ORDER BY pk LIMIT n`, which stays
+on the primary key index however deep the page is. Response bodies keep
+their original shape; the next page is announced in a Link header.
+"""
+from base64 import b64decode, b64encode
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlencode
+from django.conf import settings
+from django.db.models import QuerySet
+from django.http import HttpRequest
+from rest_framework.exceptions import NotFound
+from rest_framework.request import Request
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+CURSOR_QUERY_PARAM = 'cursor'
+PAGE_SIZE_QUERY_PARAM = 'page_size'
+MAX_PAGE_SIZE = 100
+
+
+def encode_cursor(position: int) -> str:
+    return b64encode(urlencode({'p': position}).encode('ascii')).decode('ascii')
+
+
+def decode_cursor(cursor: str) -> int:
+    try:
+        return int(parse_qs(b64decode(cursor.encode('ascii')).decode('ascii'), strict_parsing=True)['p'][0])
+    except (TypeError, ValueError, KeyError, UnicodeError):
+        raise NotFound('Invalid cursor')
+
+
+def get_cursor(request: HttpRequest) -> Optional[int]:
+    # request.GET, the async views pass plain Django requests
+    cursor = request.GET.get(CURSOR_QUERY_PARAM)
+    if not cursor:
+        return None
+    return decode_cursor(cursor)
+
+
+def get_page_size(request: HttpRequest) -> int:
+    default = settings.REST_FRAMEWORK['PAGE_SIZE']
+    try:
+        page_size = int(request.GET.get(PAGE_SIZE_QUERY_PARAM, default))
+    except ValueError:
+        return default
+    return min(max(page_size, 1), MAX_PAGE_SIZE)
+
+
+def paginate(queryset: QuerySet, after: Optional[int], page_size: int) -> Tuple[List[Any], Optional[int]]:
+    """
+    Returns the rows after the given primary key and the cursor position
+    of the next page, or None on the last page. Rows are model instances,
+    or dicts for a .values() queryset, which has to include 'pk'.
+    """
+    if after is not None:
+        queryset = queryset.filter(pk__gt=after)
+    # one extra row tells whether there is a next page
+    return _split(list(queryset.order_by('pk')[:page_size + 1]), page_size)
+
+
+async def apaginate(queryset: QuerySet, after: Optional[int], page_size: int) -> Tuple[List[Any], Optional[int]]:
+    if after is not None:
+        queryset = queryset.filter(pk__gt=after)
+    return _split([row async for row in queryset.order_by('pk')[:page_size + 1]], page_size)
+
+
+def _split(rows: List[Any], page_size: int) -> Tuple[List[Any], Optional[int]]:
+    if len(rows) > page_size:
+        last = rows[page_size - 1]
+        return rows[:page_size], last['pk'] if isinstance(last, dict) else last.pk
+    return rows, None
+
+
+def next_link(request: HttpRequest, page: Dict[str, Any]) -> Optional[str]:
+    if page['next'] is None:
+        return None
+    url = replace_query_param(request.build_absolute_uri(), CURSOR_QUERY_PARAM, encode_cursor(page['next']))
+    return f'<{url}>; rel="next"'
+
+
+def paginated_response(request: Request, page: Dict[str, Any], **kwargs) -> Response:
+    response = Response(page['results'], **kwargs)
+    link = next_link(request, page)
+    if link:
+        response['Link'] = link
+    return response
@@ -0,0 +1,159 @@
+"""
+Cached payloads of the public read endpoints, shared by the views and the
+warm_cache management command.
+
+List payloads are cached per page as {'results': body, 'next': cursor position}.
+City and cafe names from the URL are matched through their slugs.
+"""
+from typing import Any, Awaitable, Callable, Dict, List, NamedTuple, Optional, Tuple
+from django.conf import settings
+from django.db.models import QuerySet
+from django.http import Http404
+from CaffeRatings import caching
+from CaffeReviewer import instrumentation
+from CaffeRatings.models import Cafe, CafeCategoryScore, Rating, City
+from CaffeRatings.slugs import normalize
+from .pagination import apaginate, paginate
+from .serializers import CAFE_VALUES, CITY_VALUES, RATING_VALUES, CafeCategoryScoreSerializer
+
+
+def _page_size() -> int:
+    return settings.REST_FRAMEWORK['PAGE_SIZE']
+
+
+def _serialize(serializer_class: type, instances: List[Any]) -> List[Any]:
+    # instances are loaded already, so only the serializer is timed
+    with instrumentation.timed_serialization():
+        return serializer_class(instances, many=True).data
+
+
+def _values_page(
+    queryset: QuerySet, fields: Tuple[str, ...], after: Optional[int], page_size: int
+) -> Tuple[List[Dict[str, Any]], Optional[int]]:
+    """
+    Read-only fast path of the list payloads: a page of plain dicts with the
+    keys of the model serializer, without model instances or serializer
+    fields per row.
+    """
+    page, next_position = paginate(queryset.values('pk', *fields), after, page_size)
+    return _strip_pk(page, fields), next_position
+
+
+async def _avalues_page(
+    queryset: QuerySet, fields: Tuple[str, ...], after: Optional[int], page_size: int
+) -> Tuple[List[Dict[str, Any]], Optional[int]]:
+    page, next_position = await apaginate(queryset.values('pk', *fields), after, page_size)
+    return _strip_pk(page, fields), next_position
+
+
+def _strip_pk(page: List[Dict[str, Any]], fields: Tuple[str, ...]) -> List[Dict[str, Any]]:
+    with instrumentation.timed_serialization():
+        return [{field: row[field] for field in fields} for row in page]
+
+
+class Payload(NamedTuple):
+    prefix: str
+    parts: List[Any]
+    generation_keys: List[str]
+    build: Callable[[], Any]
+    serve_stale: bool = False
+    # async counterpart of build, used by the async views
+    abuild: Optional[Callable[[], Awaitable[Any]]] = None
+
+    @property
+    def key(self) -> str:
+        return caching.make_key(self.prefix, *self.parts)
+
+    def get(self) -> Any:
+        return caching.get_or_compute(
+            self.prefix, self.parts, self.generation_keys, self.build, serve_stale=self.serve_stale
+        )
+
+    async def aget(self) -> Any:
+        return await caching.aget_or_compute(
+            self.prefix, self.parts, self.generation_keys, self.abuild, serve_stale=self.serve_stale
+        )
+
+    def refresh(self) -> Any:
+        return caching.store(self.prefix, self.parts, self.generation_keys, self.build)
+
+
+def ratings(city: str, cafe_name: str, after: Optional[int] = None, page_size: Optional[int] = None) -> Payload:
+    page_size = page_size or _page_size()
+
+    # validation = get_object_or_404(City, name=city)
+
+    # cafe = get_object_or_404(Cafe, name=cafe_name, city=validation)
+    # ratings = Rating.objects.filter(cafe=cafe)
+    ratings = Rating.objects.filter(cafe__slug=normalize(cafe_name), cafe__city__slug=normalize(city))
+
+    def result(page: List[Dict[str, Any]], next_position: Optional[int]) -> dict:
+        if not page and after is None:
+            raise Http404('No match for provided details')
+        return {'results': {'ratings': page}, 'next': next_position}
+
+    def build() -> dict:
+        return result(*_values_page(ratings, RATING_VALUES, after, page_size))
+
+    async def abuild() -> dict:
+        return result(*await _avalues_page(ratings, RATING_VALUES, after, page_size))
+
+    # invalidated by any write to the cafe or its ratings
+    return Payload(
+        'ratings', [city, cafe_name, after, page_size], [caching.cafe_generation(city, cafe_name)], build,
+        abuild=abuild,
+    )
+
+
+def scores(city: str, cafe_name: str) -> Payload:
+    def build() -> dict:
+        # per category breakdown read from maintained aggregates, one query
+        scores = CafeCategoryScore.objects.select_related('category').filter(
+            cafe__slug=normalize(cafe_name), cafe__city__slug=normalize(city), rating_count__gt=0
+        ).order_by('category__name')
+
+        data = _serialize(CafeCategoryScoreSerializer, list(scores))
+        if not data:
+            raise Http404('No match for provided details')
+        return {'scores': data}
+
+    return Payload('scores', [city, cafe_name], [caching.cafe_generation(city, cafe_name)], build)
+
+
+def cafes(city: str, after: Optional[int] = None, page_size: Optional[int] = None) -> Payload:
+    page_size = page_size or _page_size()
+
+    # average_rating is an annotation, .values() reads it like a field
+    cafes = Cafe.objects.filter(city__slug=normalize(city)).with_average_rating()
+
+    def result(page: List[Dict[str, Any]], next_position: Optional[int]) -> dict:
+        if not page and after is None:
+            raise Http404('No cafes found')
+        return {'results': page, 'next': next_position}
+
+    def build() -> dict:
+        return result(*_values_page(cafes, CAFE_VALUES, after, page_size))
+
+    async def abuild() -> dict:
+        return result(*await _avalues_page(cafes, CAFE_VALUES, after, page_size))
+
+    # invalidated by any write to the city, its cafes or their ratings,
+    # the previous page may be served while one worker rebuilds it
+    return Payload(
+        'cafes', [city, after, page_size], [caching.city_generation(city)], build, settings.CAFE_LIST_SERVE_STALE,
+        abuild=abuild,
+    )
+
+
+def cities(after: Optional[int] = None, page_size: Optional[int] = None) -> Payload:
+    page_size = page_size or _page_size()
+
+    def build() -> dict:
+        page, next_position = _values_page(City.objects.all(), CITY_VALUES, after, page_size)
+        return {'results': {'Cities': page}, 'next': next_position}
+
+    async def abuild() -> dict:
+        page, next_position = await _avalues_page(City.objects.all(), CITY_VALUES, after, page_size)
+        return {'results': {'Cities': page}, 'next': next_position}
+
+    return Payload('cities', [after, page_size], [caching.CITIES_GENERATION], build, abuild=abuild)
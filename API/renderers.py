@@ -0,0 +1,50 @@
+"""
+JSON renderer backed by orjson when it is installed.
+
+Writes the same bytes as rest_framework's JSONRenderer with the default
+UNICODE_JSON, COMPACT_JSON and STRICT_JSON settings: compact separators,
+non-ASCII characters as UTF-8, U+2028 and U+2029 escaped. Datetimes and
+other types orjson would format its own way go through DRF's JSONEncoder.
+Indented output, other JSON settings and anything orjson refuses (non
+string keys, integers above 64 bits) are rendered by JSONRenderer itself.
+The differences left are floats below 1e-4, which orjson writes without
+an exponent, and NaN, which becomes null instead of an error; the API only
+serves averages rounded to two places.
+
+    REST_FRAMEWORK = {
+        'DEFAULT_RENDERER_CLASSES': ('API.renderers.FastJSONRenderer', ...),
+    }
+"""
+from typing import Any, Mapping, Optional
+from rest_framework.renderers import JSONRenderer
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class FastJSONRenderer(JSONRenderer):
+    def __init__(self) -> None:
+        self._encoder = self.encoder_class()
+
+    def render(
+        self, data: Any, accepted_media_type: Optional[str] = None, renderer_context: Optional[Mapping[str, Any]] = None
+    ) -> bytes:
+        if data is None:
+            return b''
+        if (
+            orjson is None
+            or self.ensure_ascii
+            or not self.compact
+            or not self.strict
+            or self.get_indent(accepted_media_type, renderer_context or {}) is not None
+        ):
+            return super().render(data, accepted_media_type, renderer_context)
+
+        try:
+            rendered = orjson.dumps(data, default=self._encoder.default, option=orjson.OPT_PASSTHROUGH_DATETIME)
+        except TypeError:
+            # orjson.JSONEncodeError, JSONRenderer renders it or raises its usual error
+            return super().render(data, accepted_media_type, renderer_context)
+        return rendered.replace('\u2028'.encode(), b'\\u2028').replace('\u2029'.encode(), b'\\u2029')
@@ -1,11 +1,20 @@
 # from django.contrib.auth.models import Group, User
-from typing import Dict, Any, Type
+from typing import Dict, Any, List, Type
 from rest_framework import serializers
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
 from django.contrib.auth.models import User
 from rest_framework_simplejwt.tokens import RefreshToken
 from rest_framework_simplejwt.exceptions import InvalidToken
-from CaffeRatings.models import Rating, Cafe, City
+from CaffeRatings import roles
+from CaffeRatings.models import Rating, Cafe, CafeCategoryScore, City
+from CaffeRatings.slugs import normalize
+
+
+def validate_sluggable(value: str) -> str:
+    # names are looked up by their slug, one without letters or digits is unreachable
+    if not normalize(value):
+        raise serializers.ValidationError('Needs at least one letter or digit.')
+    return value
 
 
 class RatingSerializer(serializers.ModelSerializer):
@@ -29,10 +38,30 @@ class CafeSerializer(serializers.ModelSerializer):
         return average
 
 
+# keys and order of RatingSerializer, CafeSerializer and CitySerializer, the
+# list payloads read these with .values() instead of serializing instances
+RATING_VALUES = ('id', 'icon', 'rating', 'category', 'author', 'cafe')
+CAFE_VALUES = ('name', 'location', 'average_rating', 'approved')
+CITY_VALUES = ('name',)
+
+
+class CafeCategoryScoreSerializer(serializers.ModelSerializer):
+    category = serializers.CharField(source='category.name')
+    average_rating = serializers.SerializerMethodField()
+
+    class Meta:
+        model = CafeCategoryScore
+        fields = ['category', 'average_rating', 'rating_count']
+
+    def get_average_rating(self, obj: CafeCategoryScore) -> float:
+        return round(obj.rating_average, 2)
+
+
 class CafeDetailSerializer(serializers.ModelSerializer):
     class Meta:
         model = Cafe
         fields = ['name', 'image', 'location', 'city', 'approved'] # could be just '__all__'
+        extra_kwargs = {'name': {'validators': [validate_sluggable]}}
 
     def validate(self, data: Dict[str, Any]) -> Dict[str, Any]:
         extra_fields = set(self.initial_data.keys()) - set(self.fields)
@@ -41,17 +70,46 @@ class CafeDetailSerializer(serializers.ModelSerializer):
         return data
     
 
+class CafeImportSerializer(serializers.Serializer):
+    # plain serializer, uniqueness is checked for the whole batch at once
+    name = serializers.CharField(max_length=Cafe._meta.get_field('name').max_length, validators=[validate_sluggable])
+    location = serializers.CharField(max_length=Cafe._meta.get_field('location').max_length)
+    image = serializers.CharField(
+        max_length=Cafe._meta.get_field('image').max_length, required=False, allow_null=True, allow_blank=True
+    )
+    city = serializers.CharField(max_length=City._meta.get_field('name').max_length, validators=[validate_sluggable])
+    approved = serializers.BooleanField(default=True)
+
+    def validate(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        extra_fields = set(self.initial_data.keys()) - set(self.fields)
+        if extra_fields:
+            raise serializers.ValidationError(f'Extra fields: {', '.join(extra_fields)} are not allowed.')
+        return data
+
+
+class CategoryScoreSubmissionSerializer(serializers.Serializer):
+    category = serializers.CharField()
+    rating = serializers.IntegerField(min_value=0, max_value=5)
+    icon = serializers.CharField(max_length=Rating._meta.get_field('icon').max_length, required=False, default='')
+
+
+class RatingSubmissionSerializer(serializers.Serializer):
+    ratings = CategoryScoreSubmissionSerializer(many=True, allow_empty=False, max_length=50)
+
+    def validate_ratings(self, ratings: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        categories = [rating['category'] for rating in ratings]
+        if len(set(categories)) != len(categories):
+            raise serializers.ValidationError('Each category can be rated only once per request.')
+        return ratings
+
+
 class GroupBasedTokenObtainPairSerializer(TokenObtainPairSerializer):    
     @classmethod
     def get_token(cls: Type[TokenObtainPairSerializer], user: User) -> Type[RefreshToken]:
         token = super().get_token(user)
 
-        if user.groups.filter(name='admin').exists(): 
-            token['custom_token_type'] = 'admin'
-        elif user.groups.filter(name='cafe_owner').exists():
-            token['custom_token_type'] = 'cafe_owner'
-        else:
-            token['custom_token_type'] = 'basic'
+        # admin, cafe_owner or basic, cached until the user's groups change
+        token['custom_token_type'] = roles.get_role(user)
 
         return token
 
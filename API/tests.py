@@ -1,12 +1,32 @@
-from django.test import TestCase
-from django.urls import reverse
+import json
+import os
+import tempfile
+import time
+from datetime import datetime, timezone
+from decimal import Decimal
+from typing import List
+from unittest import mock
+from asgiref.sync import async_to_sync
+from django.core.cache import cache
+from django.test import AsyncRequestFactory, RequestFactory, TestCase, override_settings
+from django.urls import resolve, reverse
+from django.utils.translation import gettext_lazy
 from rest_framework import status
+from rest_framework.exceptions import ErrorDetail
+from rest_framework.renderers import JSONRenderer
 from rest_framework.test import APIClient
 from django.contrib.auth.models import Group
+from django.db import IntegrityError, transaction
 from django.db.models import Avg, IntegerField
 from django.db.models.functions import Cast
 from CaffeRatings.models import Cafe, Rating, MineUser, Category, City
-from API.serializers import RatingSerializer, CafeSerializer
+from rest_framework_simplejwt.tokens import AccessToken, Token
+from API import async_views, views
+from API.authentication import VerifiedTokenCache, verified_tokens
+from API.renderers import FastJSONRenderer
+from API.serializers import RatingSerializer, CafeSerializer, CitySerializer
+from CaffeReviewer import instrumentation, metrics
+from CaffeReviewer.testing import QueryBudgetMixin
 
 
 class APITest(TestCase):
@@ -81,6 +101,48 @@ class APITest(TestCase):
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND, f'{response.data}')
         self.assertEqual(response.data['detail'], 'No match for provided details')
 
+    def test_get_scores(self):
+        Rating.objects.create(cafe=self.cafe, author=self.adminUser, category=self.category, rating=2, icon='star')
+        url = reverse('cafe-scores', args=[self.valid_city_name, self.valid_cafe_name])
+        response = self.client.get(url)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, {'scores': [{'category': 'Service', 'average_rating': 3.5, 'rating_count': 2}]})
+
+    def test_get_scores_invalid_cafe(self):
+        url = reverse('cafe-scores', args=[self.valid_city_name, self.invalid_cafe_name])
+        response = self.client.get(url)
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_rating_payload_invalidated_on_write(self):
+        url = reverse('cafe-ratings', args=[self.valid_city_name, self.valid_cafe_name])
+        self.assertEqual(len(self.client.get(url).data['ratings']), 1)
+
+        Rating.objects.create(cafe=self.cafe, author=self.adminUser, category=self.category, rating=1, icon='star')
+        self.assertEqual(len(self.client.get(url).data['ratings']), 2)
+
+        self.rating.delete()
+        self.assertEqual(len(self.client.get(url).data['ratings']), 1)
+
+    def test_cafe_list_invalidated_on_rating_and_rename(self):
+        url = reverse('city-cafes', args=[self.valid_city_name])
+        self.assertEqual(self.client.get(url).data[0]['average_rating'], 5)
+
+        Rating.objects.create(cafe=self.cafe, author=self.adminUser, category=self.category, rating=1, icon='star')
+        self.assertEqual(self.client.get(url).data[0]['average_rating'], 3)
+
+        self.city.name = 'Renamed City'
+        self.city.save()
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_cities_invalidated_on_city_write(self):
+        url = reverse('cities')
+        self.assertEqual(len(self.client.get(url).data['Cities']), 1)
+
+        City.objects.create(name='Another City')
+        self.assertEqual(len(self.client.get(url).data['Cities']), 2)
+
     def test_get_all_existing_cafes_in_city(self):
         url = reverse('city-cafes', args=[self.valid_city_name])
         response = self.client.get(url)
@@ -91,6 +153,247 @@ class APITest(TestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(response.data, serializer.data)
 
+    def test_lookups_by_slug(self):
+        url = reverse('cafe-ratings', args=['test city', 'TEST CAFE'])
+        self.assertEqual(len(self.client.get(url).data['ratings']), 1)
+
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.admin_token}')
+        response = self.client.post(reverse('city-cafes', args=['TEST CITY']), {'name': 'Slug Cafe', 'location': 'Here'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(City.objects.count(), 1)
+        self.assertEqual(Cafe.objects.get(name='Slug Cafe').city, self.city)
+
+    def test_cafe_list_cursor_pagination(self):
+        for name in ('Page Cafe 1', 'Page Cafe 2'):
+            Cafe.objects.create(name=name, location='Page St', city=self.city)
+        url = reverse('city-cafes', args=[self.valid_city_name])
+
+        response = self.client.get(url, {'page_size': 2})
+        self.assertEqual([cafe['name'] for cafe in response.data], ['Test Cafe', 'Page Cafe 1'])
+        next_url = response['Link'].split(';')[0].strip('<>')
+
+        response = self.client.get(next_url)
+        self.assertEqual([cafe['name'] for cafe in response.data], ['Page Cafe 2'])
+        self.assertFalse(response.has_header('Link'))
+
+        response = self.client.get(url, {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_list_payloads_match_serializers(self):
+        # the .values() fast path has to produce the serializers' bytes
+        Cafe.objects.create(name='Caf\u00e9 \u2028 line', location='\u017b\u00f3\u0142ta St', city=self.city, approved=False)
+        cafes = Cafe.objects.filter(city=self.city).with_average_rating().order_by('pk')
+        expected = {
+            reverse('cafe-ratings', args=[self.valid_city_name, self.valid_cafe_name]):
+                {'ratings': RatingSerializer(Rating.objects.filter(cafe=self.cafe), many=True).data},
+            reverse('city-cafes', args=[self.valid_city_name]): CafeSerializer(cafes, many=True).data,
+            reverse('cities'): {'Cities': CitySerializer(City.objects.all(), many=True).data},
+        }
+        for url, data in expected.items():
+            response = self.client.get(url)
+            self.assertEqual(response.content, JSONRenderer().render(data), url)
+            self.assertEqual(response['Content-Type'], 'application/json')
+
+        response = self.client.get(reverse('city-cafes', args=[self.valid_city_name]))
+        self.assertIn('Café \\u2028 line'.encode(), response.content)
+
+    def test_fast_json_renderer(self):
+        data = {
+            'text': 'Caf\u00e9 \u2028\u2029 "quoted" \\ </script>',
+            'numbers': [0, -1, 2 ** 63 - 1, 4.25, 0.1, 1e16, True, None],
+            'time': datetime(2024, 5, 1, 12, 30, 15, 123456, tzinfo=timezone.utc),
+            'decimal': Decimal('4.50'),
+            'lazy': gettext_lazy('Invalid cursor'),
+            'error': ErrorDetail('Invalid token.', code='invalid'),
+            'nested': ({'a': [1, 2]}, []),
+        }
+        for value in (data, {1: 'int key'}, [2 ** 70], 'plain', None):
+            self.assertEqual(FastJSONRenderer().render(value), JSONRenderer().render(value), value)
+        self.assertEqual(
+            FastJSONRenderer().render(data, 'application/json; indent=2'),
+            JSONRenderer().render(data, 'application/json; indent=2'),
+        )
+        with mock.patch('API.renderers.orjson', None):
+            self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+
+    def test_page_size_limits(self):
+        url = reverse('cities')
+        for index in range(3):
+            City.objects.create(name=f'Paged City {index}')
+
+        response = self.client.get(url, {'page_size': 0})
+        self.assertEqual(len(response.data['Cities']), 1)
+        self.assertIn('rel="next"', response['Link'])
+
+        response = self.client.get(url, {'page_size': 1000})
+        self.assertEqual(len(response.data['Cities']), 4)
+        self.assertFalse(response.has_header('Link'))
+
+    def test_conditional_get_etag(self):
+        url = reverse('cafe-ratings', args=[self.valid_city_name, self.valid_cafe_name])
+        etag = self.client.get(url)['ETag']
+        self.assertFalse(etag.startswith('W/'))
+
+        with self.assertNumQueries(0):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        # another page is another representation
+        response = self.client.get(url, {'page_size': 1}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        Rating.objects.create(cafe=self.cafe, author=self.adminUser, category=self.category, rating=1, icon='star')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_conditional_get_last_modified(self):
+        url = reverse('city-cafes', args=[self.valid_city_name])
+        last_modified = self.client.get(url)['Last-Modified']
+
+        with self.assertNumQueries(0):
+            response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE='Mon, 01 Jan 2001 00:00:00 GMT')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_async_reads_match_sync(self):
+        for index in range(3):
+            City.objects.create(name=f'Async City {index}')
+        ratings = reverse('cafe-ratings', args=[self.valid_city_name, self.valid_cafe_name])
+        cafes = reverse('city-cafes', args=[self.valid_city_name])
+        cases = [
+            ('getCities', reverse('cities'), {'page_size': 2}, ()),
+            ('getCities', reverse('cities'), {'cursor': 'bad'}, ()),
+            ('getOrCreateCafes', cafes, {}, (self.valid_city_name,)),
+            ('getOrCreateCafes', reverse('city-cafes', args=['Nowhere']), {}, ('Nowhere',)),
+            ('getRating', ratings, {}, (self.valid_city_name, self.valid_cafe_name)),
+            ('getRating', ratings, {}, (self.valid_city_name, self.invalid_cafe_name)),
+        ]
+        for name, url, query, args in cases:
+            with self.subTest(view=name, url=url, query=query):
+                cache.clear()
+                expected = getattr(views, name)(RequestFactory().get(url, query), *args).render()
+                response = async_to_sync(getattr(async_views, name))(AsyncRequestFactory().get(url, query), *args)
+                self.assertEqual(response.status_code, expected.status_code)
+                self.assertEqual(response.content, expected.content)
+                for header in ('Content-Type', 'Allow', 'Vary', 'Link', 'ETag', 'Last-Modified'):
+                    self.assertEqual(response.get(header), expected.get(header), header)
+
+                if response.has_header('ETag'):
+                    request = AsyncRequestFactory().get(url, query, headers={'If-None-Match': response['ETag']})
+                    response = async_to_sync(getattr(async_views, name))(request, *args)
+                    self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        # writes go to the DRF view
+        request = AsyncRequestFactory().post(cafes, {'name': 'Async'}, content_type='application/json')
+        response = async_to_sync(async_views.getOrCreateCafes)(request, self.valid_city_name)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    @override_settings(REQUEST_METRICS=True)
+    def test_request_metrics(self):
+        instrumentation.reset()
+        # middleware is loaded on the first request of a client
+        client = APIClient()
+        url = reverse('city-cafes', args=[self.valid_city_name])
+        client.get(url)
+        response = client.get(url)
+
+        timing = response['Server-Timing']
+        self.assertIn('db;dur=', timing)
+        self.assertIn('desc="0 queries"', timing)
+        self.assertIn('1 hits, 0 misses', timing)
+        histograms = instrumentation.get_histograms()['city-cafes']
+        self.assertEqual(histograms['duration_ms']['count'], 2)
+        self.assertEqual(histograms['cache_misses']['counts'][:2], [1, 1])
+        self.assertEqual(histograms['db_queries']['counts'][0], 1)
+
+    def test_request_metrics_disabled(self):
+        # the token check flushes too, due at once here
+        with tempfile.TemporaryDirectory() as directory, override_settings(METRICS_DIR=directory):
+            with mock.patch.object(metrics, '_last_flush', 0.0):
+                self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.basic_token}')
+                response = self.client.get(reverse('city-cafes', args=[self.valid_city_name]))
+            self.assertEqual(os.listdir(directory), [])
+        self.assertNotIn('Server-Timing', response)
+
+    def test_metrics_endpoint(self):
+        instrumentation.reset()
+        with tempfile.TemporaryDirectory() as directory, override_settings(REQUEST_METRICS=True, METRICS_DIR=directory):
+            # numbers of another worker process
+            other = {
+                'histograms': {'cities': {'duration_ms': {
+                    'buckets': list(instrumentation.DURATION_BUCKETS),
+                    'counts': [1] + [0] * len(instrumentation.DURATION_BUCKETS),
+                    'sum': 2.0,
+                    'count': 1,
+                }}},
+                'counters': {'jwt_validations': {'valid': 2}},
+            }
+            with open(os.path.join(directory, '1.json'), 'w') as file:
+                json.dump(other, file)
+
+            client = APIClient()
+            client.get(reverse('cities'))
+            client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.basic_token}')
+            client.get(reverse('cities'))
+            response = client.get(reverse('metrics'))
+
+        body = response.content.decode()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        self.assertIn('caffereviewer_request_duration_seconds_count{view="cities"} 3', body)
+        self.assertIn('caffereviewer_request_duration_seconds_bucket{view="cities",le="+Inf"} 3', body)
+        self.assertIn('caffereviewer_jwt_validations_total{result="valid"} 3', body)
+        self.assertIn('caffereviewer_request_db_queries_count{view="cities"} 2', body)
+        self.assertIn('caffereviewer_payload_cache_hit_ratio{prefix="cities"}', body)
+
+    def test_token_verified_once(self):
+        verified_tokens.clear()
+        url = reverse('modify-cafe', args=[self.valid_city_name, self.valid_cafe_name])
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.co_token}')
+
+        with mock.patch.object(Token, 'verify', autospec=True, side_effect=Token.verify) as verify:
+            for location in ('First St', 'Second St'):
+                response = self.client.patch(url, {'location': location}, format='json')
+                self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+            # the second request is served from the verified tokens
+            self.assertEqual(verify.call_count, 1)
+
+            verified_tokens.clear()
+            with override_settings(JWT_VERIFIED_CACHE_SIZE=0):
+                self.client.patch(url, {'location': 'Third St'}, format='json')
+                self.client.patch(url, {'location': 'Fourth St'}, format='json')
+            self.assertEqual(verify.call_count, 3)
+
+    def test_verified_token_cache(self):
+        cache = VerifiedTokenCache()
+        expired = AccessToken.for_user(self.user)
+        expired['exp'] = int(time.time()) - 1
+        cache.set(b'expired', expired)
+        self.assertIsNone(cache.get(b'expired'))
+
+        with override_settings(JWT_VERIFIED_CACHE_SIZE=2):
+            tokens = [AccessToken.for_user(self.user) for _ in range(3)]
+            cache.set(b'a', tokens[0])
+            cache.set(b'b', tokens[1])
+            self.assertIs(cache.get(b'a'), tokens[0])
+            # b is the least recently used
+            cache.set(b'c', tokens[2])
+        self.assertIsNone(cache.get(b'b'))
+        self.assertIs(cache.get(b'a'), tokens[0])
+        self.assertIs(cache.get(b'c'), tokens[2])
+
+    def test_metrics_endpoint_leaves_city_urls(self):
+        self.assertEqual(reverse('metrics'), '/_internal/metrics')
+        City.objects.create(name='Metrics')
+        self.assertEqual(resolve(reverse('city', args=['Metrics'])).url_name, 'city')
+
+    def test_metrics_endpoint_internal_only(self):
+        response = self.client.get(reverse('metrics'), REMOTE_ADDR='203.0.113.7')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
     def test_get_all_nonexisting_cafes_in_city(self):
         url = reverse('city-cafes', args=[self.invalidCity])
         response = self.client.get(url)
@@ -119,6 +422,36 @@ class APITest(TestCase):
         self.assertTrue(City.objects.filter(name=city).exists(), 'Failed creating city')
         self.assertEqual(City.objects.filter(name=city).count(), 1, 'No city in database after creation')
 
+    def test_non_latin_names(self):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.admin_token}')
+        response = self.client.post(reverse('city-cafes', args=['Москва']), {'name': 'Кофейня', 'location': 'Арбат'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(City.objects.get(name='Москва').slug, 'москва')
+
+        response = self.client.get(reverse('city-cafes', args=['МОСКВА']))
+        self.assertEqual([cafe['name'] for cafe in response.data], ['Кофейня'])
+        response = self.client.get(reverse('city', args=['Москва']))
+        self.assertContains(response, 'Кофейня')
+
+    def test_names_without_slug_rejected(self):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.admin_token}')
+        response = self.client.post(reverse('city-cafes', args=['!!!']), {'name': 'Cafe', 'location': 'here'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(City.objects.filter(name='!!!').exists())
+
+        url = reverse('city-cafes', args=[self.valid_city_name])
+        response = self.client.post(url, {'name': '!!!', 'location': 'here'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('name', response.data)
+
+        response = self.client.post(reverse('cafes-bulk'), [
+            {'name': 'Fine', 'location': 'here', 'city': '???'},
+            {'name': '...', 'location': 'here', 'city': self.valid_city_name},
+        ], format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('city', response.data['results'][0]['errors'])
+        self.assertIn('name', response.data['results'][1]['errors'])
+
     def test_create_duplicate(self):
         url = reverse('city-cafes', args=[self.valid_city_name])
         data = {'name': 'APICREATE3', 'location': 'API TEST'}
@@ -130,6 +463,104 @@ class APITest(TestCase):
         self.assertEqual(response1.status_code, status.HTTP_201_CREATED, f'Failed first creation request {response1.data}')
         self.assertEqual(response2.status_code, status.HTTP_400_BAD_REQUEST, 'Failed second creation (duplication) request')
 
+    def test_bulk_cafe_creation(self):
+        url = reverse('cafes-bulk')
+        data = [
+            {'name': 'BULK1', 'location': 'Bulk St', 'city': self.valid_city_name},
+            {'name': 'BULK2', 'location': 'Bulk St', 'city': 'Bulk City', 'approved': False},
+            {'name': 'BULK1', 'location': 'Duplicate in batch', 'city': self.valid_city_name},
+            {'name': self.valid_cafe_name, 'location': 'Already exists', 'city': self.valid_city_name},
+            {'location': 'No name', 'city': 'Bulk City'},
+        ]
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.admin_token}')
+        response = self.client.post(url, data, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        self.assertEqual((response.data['created'], response.data['failed']), (2, 3))
+        self.assertEqual(
+            [result['status'] for result in response.data['results']],
+            ['created', 'created', 'error', 'error', 'error'],
+        )
+        self.assertIn('name', response.data['results'][4]['errors'])
+        self.assertTrue(Cafe.objects.filter(name='BULK1', city=self.city).exists())
+        self.assertFalse(City.objects.get(name='Bulk City').display)
+        self.assertTrue(City.objects.get(name=self.valid_city_name).display)
+
+        # caches of the affected city were invalidated
+        response = self.client.get(reverse('city-cafes', args=[self.valid_city_name]))
+        self.assertIn('BULK1', [cafe['name'] for cafe in response.data])
+
+    def test_bulk_cafe_creation_ndjson(self):
+        url = reverse('cafes-bulk')
+        body = '{"name": "NDJSON1", "location": "Line 1", "city": "Stream City"}\n\n{"name": "NDJSON2", "location": "Line 2", "city": "Stream City"}\n'
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.co_token}')
+        response = self.client.post(url, body, content_type='application/x-ndjson')
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Cafe.objects.filter(city__name='Stream City').count(), 2)
+
+    def test_bulk_cafe_creation_forbidden(self):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.basic_token}')
+        response = self.client.post(reverse('cafes-bulk'), [], format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_submit_ratings(self):
+        Category.objects.create(name='Coffee')
+        url = reverse('cafe-ratings', args=[self.valid_city_name, self.valid_cafe_name])
+        self.assertEqual(len(self.client.get(url).data['ratings']), 1)
+
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.admin_token}')
+        data = {'ratings': [{'category': 'Service', 'rating': 3, 'icon': 'star'}, {'category': 'Coffee', 'rating': 4}]}
+        response = self.client.post(url, data, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED, f'{response.data}')
+        self.assertEqual(response.data, {'created': 2, 'updated': 0})
+        self.cafe.refresh_from_db()
+        self.assertEqual((self.cafe.rating_sum, self.cafe.rating_count), (12, 3))
+        self.assertEqual(len(self.client.get(url).data['ratings']), 3)
+
+    def test_submit_ratings_upsert(self):
+        url = reverse('cafe-ratings', args=[self.valid_city_name, self.valid_cafe_name])
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.basic_token}')
+        response = self.client.post(url, {'ratings': [{'category': 'Service', 'rating': 2}]}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED, f'{response.data}')
+        self.assertEqual(response.data, {'created': 0, 'updated': 1})
+        self.assertEqual(Rating.objects.get(pk=self.rating.pk).rating, 2)
+        self.cafe.refresh_from_db()
+        self.assertEqual((self.cafe.rating_sum, self.cafe.rating_count), (2, 1))
+        score = self.cafe.category_scores.get()
+        self.assertEqual((score.rating_sum, score.rating_count), (2, 1))
+
+    def test_category_names_are_unique(self):
+        # submissions name their categories, a second 'Service' would be ambiguous
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Category.objects.create(name='Service')
+
+    def test_submit_ratings_invalid(self):
+        url = reverse('cafe-ratings', args=[self.valid_city_name, self.valid_cafe_name])
+        self.assertEqual(
+            self.client.post(url, {'ratings': [{'category': 'Service', 'rating': 2}]}, format='json').status_code,
+            status.HTTP_401_UNAUTHORIZED,
+        )
+
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.basic_token}')
+        invalid = [
+            {'ratings': [{'category': 'Unknown', 'rating': 2}]},
+            {'ratings': [{'category': 'Service', 'rating': 6}]},
+            {'ratings': [{'category': 'Service', 'rating': 1}, {'category': 'Service', 'rating': 2}]},
+            {'ratings': []},
+        ]
+        for data in invalid:
+            response = self.client.post(url, data, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, f'{data}')
+        self.assertEqual(Rating.objects.get(pk=self.rating.pk).rating, 5)
+
+        missing = reverse('cafe-ratings', args=[self.valid_city_name, self.invalid_cafe_name])
+        response = self.client.post(missing, {'ratings': [{'category': 'Service', 'rating': 2}]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
     def test_invalid_cafe_creation(self):
         url = reverse('city-cafes', args=[self.valid_city_name])
         data = {'location': 'API TEST'}
@@ -314,3 +745,137 @@ class APITest(TestCase):
         response = self.client.delete(urlDELETE)
         self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT, 'DELETE')
         self.assertFalse(Cafe.objects.filter(name=name1).exists(), 'DELETE')
+
+
+class QueryBudgetTest(QueryBudgetMixin, TestCase):
+    urlconf = 'API.urls'
+    budgets = {
+        'cafe-ratings': 10,
+        'cafe-scores': 1,
+        'city-cafes': 10,
+        'modify-cafe': 9,
+        'cities': 1,
+        'cafes-bulk': 11,
+        'token_obtain_pair': 2,
+        'token_refresh': 1,
+        'token_verify': 0,
+    }
+
+    def setUp(self) -> None:
+        self.client = APIClient()
+        self.city = City.objects.create(name='Budget City')
+        self.cafe = Cafe.objects.create(name='Budget Cafe', location='here', city=self.city, approved=True)
+        self.password = 'budgetpassword'
+        self.admin = MineUser.objects.create_user(username='budgetadmin', password=self.password)
+        self.admin.groups.add(Group.objects.get_or_create(name='admin')[0])
+        tokens = self.client.post(
+            reverse('token_obtain_pair'), {'username': 'budgetadmin', 'password': self.password}, format='json'
+        ).data
+        self.access, self.refresh = tokens['access'], tokens['refresh']
+        self.created = 0
+
+    def authorize(self) -> None:
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.access}')
+
+    def add_users(self, count: int) -> List[MineUser]:
+        start = MineUser.objects.count()
+        return [MineUser.objects.create(username=f'budget{start + index}') for index in range(count)]
+
+    def add_ratings(self, cafe: Cafe, count: int) -> None:
+        category = Category.objects.get_or_create(name='Service')[0]
+        for user in self.add_users(count):
+            Rating.objects.create(cafe=cafe, author=user, category=category, rating=4, icon='star')
+
+    def add_categories(self, count: int) -> None:
+        start = Category.objects.count()
+        for index in range(count):
+            category = Category.objects.create(name=f'Budget {start + index}')
+            Rating.objects.create(cafe=self.cafe, author=self.admin, category=category, rating=3, icon='star')
+
+    def add_cafes(self, count: int) -> None:
+        start = Cafe.objects.count()
+        for index in range(count):
+            Cafe.objects.create(name=f'Cafe {start + index}', location='there', city=self.city, approved=True)
+
+    def add_cities(self, count: int) -> None:
+        start = City.objects.count()
+        for index in range(count):
+            city = City.objects.create(name=f'City {start + index}')
+            Cafe.objects.create(name='Cafe', location='there', city=city, approved=True)
+
+    def new_cafe(self) -> Cafe:
+        self.created += 1
+        return Cafe.objects.create(name=f'Doomed {self.created}', location='there', city=self.city, approved=True)
+
+    def test_cafe_ratings(self) -> None:
+        url = reverse('cafe-ratings', args=[self.city.name, self.cafe.name])
+        self.assertQueryBudget('cafe-ratings', lambda: self.client.get(url), lambda count: self.add_ratings(self.cafe, count))
+
+        # a submission rates every category
+        self.authorize()
+        ratings = []
+        def grow(count):
+            self.add_categories(count)
+            ratings[:] = [{'category': category.name, 'rating': 5, 'icon': 'star'} for category in Category.objects.all()]
+        self.assertQueryBudget('cafe-ratings', lambda: self.client.post(url, {'ratings': ratings}, format='json'), grow)
+
+    def test_cafe_scores(self) -> None:
+        url = reverse('cafe-scores', args=[self.city.name, self.cafe.name])
+        self.assertQueryBudget('cafe-scores', lambda: self.client.get(url), self.add_categories)
+
+    def test_city_cafes(self) -> None:
+        url = reverse('city-cafes', args=[self.city.name])
+        self.assertQueryBudget('city-cafes', lambda: self.client.get(url), self.add_cafes)
+
+        self.authorize()
+        def create():
+            self.created += 1
+            return self.client.post(url, {'name': f'Posted {self.created}', 'location': 'there'}, format='json')
+        self.assertQueryBudget('city-cafes', create, self.add_cafes)
+
+    def test_modify_cafe(self) -> None:
+        self.authorize()
+        url = reverse('modify-cafe', args=[self.city.name, self.cafe.name])
+        update = lambda: self.client.patch(url, {'location': 'moved'}, format='json')
+        self.assertQueryBudget('modify-cafe', update, lambda count: self.add_ratings(self.cafe, count))
+
+        # every delete removes a new cafe with as many ratings as the dataset size
+        doomed = []
+        def grow(count):
+            size = count + (Rating.objects.filter(cafe=doomed[-1]).count() if doomed else 0)
+            doomed.append(self.new_cafe())
+            self.add_ratings(doomed[-1], size)
+        delete = lambda: self.client.delete(reverse('modify-cafe', args=[self.city.name, doomed[-1].name]))
+        self.assertQueryBudget('modify-cafe', delete, grow)
+
+    def test_cities(self) -> None:
+        self.assertQueryBudget('cities', lambda: self.client.get(reverse('cities')), self.add_cities)
+
+    def test_cafes_bulk(self) -> None:
+        self.authorize()
+        rows = []
+        def grow(count):
+            rows.extend({'name': f'Bulk {len(rows) + index}', 'location': 'there', 'city': 'Bulk City'} for index in range(count))
+        def create():
+            for row in rows:
+                row['name'] += 'x'
+            return self.client.post(reverse('cafes-bulk'), rows, format='json')
+        self.assertQueryBudget('cafes-bulk', create, grow)
+
+    def test_tokens(self) -> None:
+        # the group checked last decides the token type
+        owner = MineUser.objects.create_user(username='budgetowner', password=self.password)
+        owner.groups.add(Group.objects.get_or_create(name='cafe_owner')[0])
+        credentials = {'username': 'budgetowner', 'password': self.password}
+        def add_groups(count):
+            start = Group.objects.count()
+            owner.groups.add(*[Group.objects.create(name=f'group {start + index}') for index in range(count)])
+        self.assertQueryBudget(
+            'token_obtain_pair', lambda: self.client.post(reverse('token_obtain_pair'), credentials, format='json'), add_groups
+        )
+        self.assertQueryBudget(
+            'token_refresh', lambda: self.client.post(reverse('token_refresh'), {'refresh': self.refresh}, format='json')
+        )
+        self.assertQueryBudget(
+            'token_verify', lambda: self.client.post(reverse('token_verify'), {'token': self.access}, format='json')
+        )
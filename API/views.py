@@ -3,64 +3,78 @@ from rest_framework import status
 from rest_framework.response import Response
 from rest_framework.request import Request
 from rest_framework_simplejwt.views import TokenObtainPairView
-from rest_framework.decorators import api_view, permission_classes, authentication_classes
-from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.decorators import api_view, permission_classes, authentication_classes, parser_classes
+from rest_framework.parsers import JSONParser
+from rest_framework.permissions import AllowAny, IsAuthenticated, IsAuthenticatedOrReadOnly
 from django.shortcuts import get_object_or_404
 from rest_framework.decorators import api_view
-from django.db.models import Avg, IntegerField
-from django.db.models.functions import Cast
 from django.core.exceptions import ObjectDoesNotExist
-from django.core.cache import cache
-from django.utils.text import slugify # making keys safe for other caches
-from CaffeRatings.models import Cafe, Rating, City
+from CaffeRatings import caching
+from CaffeRatings.models import Cafe, Category, City, Rating
+from CaffeRatings.slugs import normalize
 from .serializers import (
-    RatingSerializer,
-    CafeSerializer,
     CafeDetailSerializer,
-    CitySerializer,
     GroupBasedTokenObtainPairSerializer,
+    RatingSubmissionSerializer,
 )
+from . import payloads
+from .bulk import MAX_ROWS, import_cafes
+from .conditional import versioned
+from .pagination import get_cursor, get_page_size, paginated_response
+from .parsers import NDJSONParser
 from .permissions import CustomTokenPermission
 
 
-# cached in urls.py
-@api_view(['GET'])
-@permission_classes([AllowAny])
+@versioned('ratings', lambda city, cafe_name: [caching.cafe_generation(city, cafe_name)])
+@api_view(['GET', 'POST'])
+@permission_classes([IsAuthenticatedOrReadOnly])
 def getRating(request: Request, city: str, cafe_name: str) -> Response:
-    # validation = get_object_or_404(City, name=city)
-   
-    # cafe = get_object_or_404(Cafe, name=cafe_name, city=validation)    
-    # ratings = Rating.objects.filter(cafe=cafe)
-    ratings = Rating.objects.filter(cafe__name=cafe_name, cafe__city__name=city)
-    if not ratings.exists():
-        raise Http404('No match for provided details')
+    if request.method == 'GET':
+        page = payloads.ratings(city, cafe_name, get_cursor(request), get_page_size(request)).get()
+        return paginated_response(request, page)
+
+    cafe = get_object_or_404(Cafe.objects.select_related('city'), city__slug=normalize(city), slug=normalize(cafe_name))
+    serializer = RatingSubmissionSerializer(data=request.data)
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    ratings = serializer.validated_data['ratings']
+    categories = dict(
+        Category.objects.filter(name__in=[rating['category'] for rating in ratings]).values_list('name', 'id')
+    )
+    unknown = [rating['category'] for rating in ratings if rating['category'] not in categories]
+    if unknown:
+        return Response({'message': f'Unknown categories: {', '.join(unknown)}'}, status=status.HTTP_400_BAD_REQUEST)
 
-    serializer = RatingSerializer(ratings, many=True)
+    # one upsert for the whole submission, aggregates are updated once
+    created, updated = Rating.objects.submit(
+        request.user,
+        cafe,
+        {categories[rating['category']]: (rating['rating'], rating['icon']) for rating in ratings},
+    )
+    return Response({'created': created, 'updated': updated}, status=status.HTTP_201_CREATED)
 
-    return Response({'ratings': serializer.data})
 
+@versioned('scores', lambda city, cafe_name: [caching.cafe_generation(city, cafe_name)])
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def getScores(request: Request, city: str, cafe_name: str) -> Response:
+    return Response(payloads.scores(city, cafe_name).get())
 
+
+@versioned('cafes', lambda city: [caching.city_generation(city)])
 @api_view(['GET', 'POST'])
 @permission_classes([CustomTokenPermission])
 def getOrCreateCafes(request:Request, city: str) -> Response:
     if request.method == 'GET':
-        if cache.get(slugify(city)):
-            return Response(cache.get(slugify(city)))
-        
-        # annotating average_rating requires us to change its serializer
-        # by adding SerializerMethodField
-        cafes = Cafe.objects.filter(city__name=city).annotate(average_rating=Cast(Avg('rating__rating'), IntegerField()))
-        serializer = CafeSerializer(cafes, many=True)
-
-        if not cafes.exists():
-            raise Http404('No cafes found')
-        
-        cache.set(slugify(city), serializer.data, timeout=60*60)
-        return Response(serializer.data)
+        page = payloads.cafes(city, get_cursor(request), get_page_size(request)).get()
+        return paginated_response(request, page)
     
     elif request.method == 'POST':
+        if not normalize(city):
+            return Response({'message': 'Invalid City'}, status=status.HTTP_400_BAD_REQUEST)
         try:
-            api_city = City.objects.get(name=city)
+            api_city = City.objects.get(slug=normalize(city))
             # if cafe is first cafe in city
             # the city does not exists yet
             # so we need to create one
@@ -77,21 +91,42 @@ def getOrCreateCafes(request:Request, city: str) -> Response:
             
         serializer = CafeDetailSerializer(data=request.data)
         if serializer.is_valid():
-            cache.delete(slugify(city)) # deleting invalid data
             serializer.save()
             return Response(status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+@api_view(['POST'])
+@permission_classes([CustomTokenPermission])
+@parser_classes([JSONParser, NDJSONParser])
+def bulkCreateCafes(request: Request) -> Response:
+    # accepts a JSON array or an NDJSON stream of cafes, each with a city name
+    rows = request.data
+    if not isinstance(rows, list):
+        return Response({'message': 'Expected a JSON array or NDJSON stream of cafes.'}, status=status.HTTP_400_BAD_REQUEST)
+    if len(rows) > MAX_ROWS:
+        return Response({'message': f'At most {MAX_ROWS} cafes per request.'}, status=status.HTTP_400_BAD_REQUEST)
+
+    results = import_cafes(rows)
+    created = sum(result['status'] == 'created' for result in results)
+
+    if created == len(results):
+        code = status.HTTP_201_CREATED
+    elif created:
+        code = status.HTTP_207_MULTI_STATUS
+    else:
+        code = status.HTTP_400_BAD_REQUEST
+    return Response({'created': created, 'failed': len(results) - created, 'results': results}, status=code)
+
+
 @api_view(['DELETE', 'PUT', 'PATCH'])
 @permission_classes([IsAuthenticated, CustomTokenPermission])
 # @authentication_classes([])
 def modifyCafe(request: Request, city: str, cafe_name: str) -> Response:
-    cafe = Cafe.objects.select_related('city').filter(city__name=city, name=cafe_name).first()
+    cafe = Cafe.objects.select_related('city').filter(city__slug=normalize(city), slug=normalize(cafe_name)).first()
     if request.method == 'DELETE':
         if not cafe:
             return Response({'message': 'Invalid Cafe'}, status=status.HTTP_400_BAD_REQUEST)
-        cache.delete(slugify(city)) # deleting invalid data
         cafe.delete()
 
         return Response({'message': 'Cafe deleted successfully'}, status=status.HTTP_204_NO_CONTENT)
@@ -111,18 +146,17 @@ def modifyCafe(request: Request, city: str, cafe_name: str) -> Response:
     
     if serializer.is_valid():
         serializer.save()
-        cache.delete(slugify(city)) # deleting invalid data
         return Response(status=status.HTTP_204_NO_CONTENT)
     else:
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
     
 
+@versioned('cities', lambda: [caching.CITIES_GENERATION])
 @api_view(['GET'])
 @permission_classes([AllowAny])
 def getCities(request:Request) -> Response:
-    data = City.objects.all()
-    serializer = CitySerializer(data, many=True)
-    return Response({'Cities': serializer.data}, status=status.HTTP_200_OK)
+    page = payloads.cities(get_cursor(request), get_page_size(request)).get()
+    return paginated_response(request, page, status=status.HTTP_200_OK)
 
 
 class CustomTokenObtainPairView(TokenObtainPairView):
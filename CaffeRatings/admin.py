@@ -9,3 +9,4 @@ admin.site.register(Category)
 admin.site.register(Rating)
 admin.site.register(Comments)
 admin.site.register(City)
+admin.site.register(CafeCategoryScore)
@@ -0,0 +1,78 @@
+from typing import Dict, Hashable, List, Tuple
+from django.db import transaction
+from django.db.models import Count, Sum
+from .models import Cafe, CafeCategoryScore, Rating
+
+
+Totals = Tuple[int, int]
+Drift = Tuple[Hashable, Totals, Totals]
+
+
+def _compare(stored: Dict[Hashable, Totals], actual: Dict[Hashable, Totals]) -> List[Drift]:
+    drift = []
+    for key in stored.keys() | actual.keys():
+        expected = actual.get(key, (0, 0))
+        current = stored.get(key, (0, 0))
+        if current != expected:
+            drift.append((key, current, expected))
+    return sorted(drift)
+
+
+def find_rating_drift() -> List[Drift]:
+    """
+    Compares rating aggregates stored on Cafe with the Rating table.
+    Returns (cafe id, (stored sum, stored count), (actual sum, actual count))
+    for every cafe that does not match.
+    """
+    actual = {
+        row['cafe']: (row['total'], row['count'])
+        for row in Rating.objects.values('cafe').annotate(total=Sum('rating'), count=Count('id')).order_by()
+    }
+    stored = {
+        pk: (rating_sum, rating_count)
+        for pk, rating_sum, rating_count in Cafe.objects.values_list('pk', 'rating_sum', 'rating_count').iterator()
+    }
+    return _compare(stored, actual)
+
+
+def find_category_score_drift() -> List[Drift]:
+    """
+    Same as find_rating_drift for CafeCategoryScore, keyed by (cafe id, category id).
+    """
+    actual = {
+        (row['cafe'], row['category']): (row['total'], row['count'])
+        for row in Rating.objects.values('cafe', 'category').annotate(total=Sum('rating'), count=Count('id')).order_by()
+    }
+    stored = {
+        (cafe, category): (rating_sum, rating_count)
+        for cafe, category, rating_sum, rating_count in CafeCategoryScore.objects.values_list(
+            'cafe', 'category', 'rating_sum', 'rating_count'
+        ).iterator()
+    }
+    return _compare(stored, actual)
+
+
+def rebuild_rating_aggregates(batch_size: int = 500) -> Tuple[List[Drift], List[Drift]]:
+    """
+    Recomputes every drifted Cafe and CafeCategoryScore aggregate.
+    Returns the cafe and category score drift that was fixed.
+    """
+    with transaction.atomic():
+        cafe_drift = find_rating_drift()
+        cafes = [Cafe(pk=pk, rating_sum=total, rating_count=count) for pk, _, (total, count) in cafe_drift]
+        Cafe.objects.bulk_update(cafes, ['rating_sum', 'rating_count'], batch_size=batch_size)
+
+        score_drift = find_category_score_drift()
+        scores = [
+            CafeCategoryScore(cafe_id=cafe, category_id=category, rating_sum=total, rating_count=count)
+            for (cafe, category), _, (total, count) in score_drift
+        ]
+        # rows without ratings are kept with zero totals and skipped by readers
+        CafeCategoryScore.objects.bulk_create(
+            scores,
+            batch_size=batch_size,
+            update_conflicts=True,
+            unique_fields=['cafe', 'category'],
+            update_fields=['rating_sum', 'rating_count'],
+        )
+    return cafe_drift, score_drift
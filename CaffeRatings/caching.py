@@ -0,0 +1,412 @@
+"""
+Generation based cache invalidation with stampede protection.
+
+Every cached payload is tagged with one or more generation counters stored
+in the cache. Writes bump the counters instead of deleting payload keys, so
+everything cached for a city or a cafe is invalidated in O(1). The previous
+payload stays in place and can be served while a single worker rebuilds it.
+"""
+import asyncio
+import math
+import random
+import threading
+import time
+from collections import Counter
+from typing import Any, Awaitable, Callable, Dict, Iterable, Sequence, Tuple
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from CaffeReviewer import instrumentation, replicas
+from .slugs import normalize # the stored slugs, so keys match the rows they cache
+
+
+PAYLOAD_TIMEOUT = 60 * 60
+# how long an outdated payload may still be served while it is rebuilt
+STALE_TIMEOUT = 60 * 10
+LOCK_TIMEOUT = 30
+LOCK_WAIT = 2.0
+LOCK_POLL_INTERVAL = 0.05
+EARLY_REFRESH_BETA = 1.0
+# generation counters outlive every payload tagged with them; keys for
+# names nobody writes or reads anymore expire instead of piling up, and an
+# expired counter is seeded from the clock again (see _seed)
+GENERATION_TIMEOUT = PAYLOAD_TIMEOUT + STALE_TIMEOUT
+
+OUTCOMES = ('hit', 'early', 'recompute', 'stale', 'wait')
+# outcomes that did not have to build the payload
+HIT_OUTCOMES = ('hit', 'stale', 'wait')
+STATS_FLUSH_INTERVAL = 10
+
+_pending_stats: Counter = Counter()
+_stats_lock = threading.Lock()
+_last_flush = time.monotonic()
+
+CITIES_GENERATION = 'generation:cities'
+
+
+def city_generation(city: str) -> str:
+    return f'generation:city:{normalize(city)}'
+
+
+def cafe_generation(city: str, cafe_name: str) -> str:
+    return f'generation:cafe:{normalize(city)}:{normalize(cafe_name)}'
+
+
+def role_generation(user_id: int) -> str:
+    return f'generation:role:{user_id}'
+
+
+def make_key(prefix: str, *parts: Any) -> str:
+    return ':'.join([prefix, *(normalize(str(part)) for part in parts)])
+
+
+def _seed() -> int:
+    # counters start from the clock, so a counter that was evicted
+    # never hands out a generation that was used before
+    return int(time.time() * 1000)
+
+
+def get_generations(keys: Sequence[str]) -> Tuple[int, ...]:
+    generations = cache.get_many(keys)
+    missing = [key for key in keys if key not in generations]
+    if missing:
+        for key in missing:
+            cache.add(key, _seed(), timeout=GENERATION_TIMEOUT)
+        generations.update(cache.get_many(missing))
+    return tuple(generations.get(key, 0) for key in keys)
+
+
+def _modified_key(key: str) -> str:
+    return f'{key}:modified'
+
+
+def get_versions(keys: Sequence[str]) -> Tuple[Tuple[int, ...], float]:
+    """
+    Returns the generations of keys and the latest time (unix timestamp)
+    any of them was bumped, in a single cache round trip when all are set.
+    """
+    modified_keys = [_modified_key(key) for key in keys]
+    values = cache.get_many([*keys, *modified_keys])
+    missing = [key for key in [*keys, *modified_keys] if key not in values]
+    if missing:
+        now = time.time()
+        for key in missing:
+            cache.add(key, now if key in modified_keys else _seed(), timeout=GENERATION_TIMEOUT)
+        values.update(cache.get_many(missing))
+
+    generations = tuple(values.get(key, 0) for key in keys)
+    modified = max((values.get(key, 0) for key in modified_keys), default=0)
+    return generations, modified
+
+
+def _bump(keys: Iterable[str]) -> None:
+    for key in keys:
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, _seed(), timeout=GENERATION_TIMEOUT)
+        else:
+            # incr keeps the old expiry
+            cache.touch(key, GENERATION_TIMEOUT)
+    cache.set_many({_modified_key(key): time.time() for key in keys}, timeout=GENERATION_TIMEOUT)
+
+
+def bump_generations(*keys: str) -> None:
+    _bump(keys)
+    # bumped again after commit, otherwise a reader racing the transaction
+    # could cache pre-commit data under the new generation
+    if transaction.get_connection().in_atomic_block:
+        transaction.on_commit(lambda: _bump(keys))
+
+
+def invalidate_cities() -> None:
+    bump_generations(CITIES_GENERATION)
+
+
+def invalidate_city(city: str) -> None:
+    bump_generations(CITIES_GENERATION, city_generation(city))
+
+
+def invalidate_cafe(city: str, cafe_name: str) -> None:
+    bump_generations(city_generation(city), cafe_generation(city, cafe_name))
+
+
+def invalidate_roles(user_ids: Iterable[int]) -> None:
+    keys = [role_generation(user_id) for user_id in user_ids]
+    if keys:
+        bump_generations(*keys)
+
+
+def _empty_city_key(city: str) -> str:
+    return make_key('empty-city', city)
+
+
+def is_empty_city(city: str) -> bool:
+    """
+    True if the city was found to have no approved cafes under its current
+    generation, any cafe or city write invalidates the marker.
+    """
+    return cache.get(_empty_city_key(city)) == get_generations([city_generation(city)])
+
+
+def mark_empty_city(city: str) -> None:
+    cache.set(_empty_city_key(city), get_generations([city_generation(city)]), timeout=PAYLOAD_TIMEOUT)
+
+
+def _record(prefix: str, outcome: str) -> None:
+    global _last_flush
+    instrumentation.record_cache(outcome in HIT_OUTCOMES)
+    with _stats_lock:
+        _pending_stats[(prefix, outcome)] += 1
+        if time.monotonic() - _last_flush < STATS_FLUSH_INTERVAL:
+            return
+        _last_flush = time.monotonic()
+    flush_stats()
+
+
+def flush_stats() -> None:
+    """
+    Moves the counters buffered by this process into the shared cache.
+    """
+    with _stats_lock:
+        pending = dict(_pending_stats)
+        _pending_stats.clear()
+
+    for (prefix, outcome), count in pending.items():
+        key = f'stats:payloads:{prefix}:{outcome}'
+        try:
+            cache.incr(key, count)
+        except ValueError:
+            cache.set(key, count, timeout=None)
+
+
+def get_stats(prefixes: Iterable[str]) -> Dict[str, Dict[str, int]]:
+    flush_stats()
+    keys = {f'stats:payloads:{prefix}:{outcome}': (prefix, outcome) for prefix in prefixes for outcome in OUTCOMES}
+    values = cache.get_many(keys)
+    stats = {prefix: dict.fromkeys(OUTCOMES, 0) for prefix in prefixes}
+    for key, (prefix, outcome) in keys.items():
+        stats[prefix][outcome] = values.get(key, 0)
+    return stats
+
+
+def _is_fresh(envelope: Any, generations: Tuple[int, ...]) -> bool:
+    return isinstance(envelope, dict) and envelope['generations'] == generations and envelope['expires'] > time.time()
+
+
+def _refresh_early(envelope: Dict[str, Any]) -> bool:
+    # probabilistic early expiration (XFetch): the closer to expiry and the
+    # slower the payload is to build, the likelier one request rebuilds it
+    # ahead of time, so a hot key never expires for everybody at once
+    gap = envelope['delta'] * EARLY_REFRESH_BETA * -math.log(1.0 - random.random())
+    return time.time() + gap >= envelope['expires']
+
+
+def _envelope(generations: Tuple[int, ...], payload: Any, timeout: int, started: float) -> Dict[str, Any]:
+    return {
+        'generations': generations,
+        'payload': payload,
+        'expires': time.time() + timeout,
+        'delta': time.monotonic() - started,
+    }
+
+
+def _bumped_within(keys: Sequence[str], seconds: float) -> bool:
+    modified = cache.get_many([_modified_key(key) for key in keys])
+    return any(value > time.time() - seconds for value in modified.values())
+
+
+def _replica_safe(compute: Callable[[], Any], generation_keys: Sequence[str]) -> Callable[[], Any]:
+    # a replica may not have the write behind a recent bump yet, and its
+    # rows would stay cached under the new generation
+    if not replicas.enabled():
+        return compute
+
+    def checked() -> Any:
+        if _bumped_within(generation_keys, getattr(settings, 'REPLICA_LAG', 5)):
+            with replicas.primary():
+                return compute()
+        return compute()
+    return checked
+
+
+def _store(key: str, generations: Tuple[int, ...], compute: Callable[[], Any], timeout: int) -> Any:
+    started = time.monotonic()
+    payload = compute()
+    # kept past its soft expiry so it can still be served stale
+    cache.set(key, _envelope(generations, payload, timeout, started), timeout=timeout + STALE_TIMEOUT)
+    return payload
+
+
+def store(
+    prefix: str,
+    parts: Sequence[Any],
+    generation_keys: Sequence[str],
+    compute: Callable[[], Any],
+    timeout: int = PAYLOAD_TIMEOUT,
+) -> Any:
+    """
+    Computes and stores the payload unconditionally, e.g. to warm the cache.
+    """
+    compute = _replica_safe(compute, generation_keys)
+    return _store(make_key(prefix, *parts), get_generations(generation_keys), compute, timeout)
+
+
+def get_or_compute(
+    prefix: str,
+    parts: Sequence[Any],
+    generation_keys: Sequence[str],
+    compute: Callable[[], Any],
+    timeout: int = PAYLOAD_TIMEOUT,
+    serve_stale: bool = False,
+) -> Any:
+    """
+    Returns the payload cached for parts under the current generations,
+    computing and storing it when it is missing, outdated or picked for
+    early refresh. Exceptions raised by compute (e.g. Http404) are not cached.
+
+    Only one worker rebuilds a key at a time. The others serve the previous
+    payload if serve_stale is set, otherwise they wait for the rebuild.
+    """
+    compute = _replica_safe(compute, generation_keys)
+    key = make_key(prefix, *parts)
+    generations = get_generations(generation_keys)
+    envelope = cache.get(key)
+
+    fresh = _is_fresh(envelope, generations)
+    if fresh and not _refresh_early(envelope):
+        _record(prefix, 'hit')
+        return envelope['payload']
+
+    lock = f'lock:{key}'
+    if cache.add(lock, 1, timeout=LOCK_TIMEOUT):
+        try:
+            _record(prefix, 'early' if fresh else 'recompute')
+            return _store(key, generations, compute, timeout)
+        finally:
+            cache.delete(lock)
+
+    # somebody else is rebuilding this key
+    if fresh:
+        _record(prefix, 'hit')
+        return envelope['payload']
+    if serve_stale and isinstance(envelope, dict):
+        _record(prefix, 'stale')
+        return envelope['payload']
+
+    deadline = time.monotonic() + LOCK_WAIT
+    while time.monotonic() < deadline:
+        time.sleep(LOCK_POLL_INTERVAL)
+        envelope = cache.get(key)
+        if _is_fresh(envelope, generations):
+            _record(prefix, 'wait')
+            return envelope['payload']
+
+    # the rebuilding worker is too slow or died holding the lock
+    _record(prefix, 'recompute')
+    return _store(key, generations, compute, timeout)
+
+
+# async counterparts for the async views, same keys and envelopes
+
+
+async def aget_generations(keys: Sequence[str]) -> Tuple[int, ...]:
+    generations = await cache.aget_many(keys)
+    missing = [key for key in keys if key not in generations]
+    if missing:
+        for key in missing:
+            await cache.aadd(key, _seed(), timeout=GENERATION_TIMEOUT)
+        generations.update(await cache.aget_many(missing))
+    return tuple(generations.get(key, 0) for key in keys)
+
+
+async def aget_versions(keys: Sequence[str]) -> Tuple[Tuple[int, ...], float]:
+    modified_keys = [_modified_key(key) for key in keys]
+    values = await cache.aget_many([*keys, *modified_keys])
+    missing = [key for key in [*keys, *modified_keys] if key not in values]
+    if missing:
+        now = time.time()
+        for key in missing:
+            await cache.aadd(key, now if key in modified_keys else _seed(), timeout=GENERATION_TIMEOUT)
+        values.update(await cache.aget_many(missing))
+
+    generations = tuple(values.get(key, 0) for key in keys)
+    modified = max((values.get(key, 0) for key in modified_keys), default=0)
+    return generations, modified
+
+
+async def _abumped_within(keys: Sequence[str], seconds: float) -> bool:
+    modified = await cache.aget_many([_modified_key(key) for key in keys])
+    return any(value > time.time() - seconds for value in modified.values())
+
+
+def _areplica_safe(
+    compute: Callable[[], Awaitable[Any]], generation_keys: Sequence[str]
+) -> Callable[[], Awaitable[Any]]:
+    if not replicas.enabled():
+        return compute
+
+    async def checked() -> Any:
+        if await _abumped_within(generation_keys, getattr(settings, 'REPLICA_LAG', 5)):
+            with replicas.primary():
+                return await compute()
+        return await compute()
+    return checked
+
+
+async def _astore(
+    key: str, generations: Tuple[int, ...], compute: Callable[[], Awaitable[Any]], timeout: int
+) -> Any:
+    started = time.monotonic()
+    payload = await compute()
+    await cache.aset(key, _envelope(generations, payload, timeout, started), timeout=timeout + STALE_TIMEOUT)
+    return payload
+
+
+async def aget_or_compute(
+    prefix: str,
+    parts: Sequence[Any],
+    generation_keys: Sequence[str],
+    compute: Callable[[], Awaitable[Any]],
+    timeout: int = PAYLOAD_TIMEOUT,
+    serve_stale: bool = False,
+) -> Any:
+    """
+    get_or_compute for async callers, compute is a coroutine function.
+    Waiting for another worker's rebuild does not block the event loop.
+    """
+    compute = _areplica_safe(compute, generation_keys)
+    key = make_key(prefix, *parts)
+    generations = await aget_generations(generation_keys)
+    envelope = await cache.aget(key)
+
+    fresh = _is_fresh(envelope, generations)
+    if fresh and not _refresh_early(envelope):
+        _record(prefix, 'hit')
+        return envelope['payload']
+
+    lock = f'lock:{key}'
+    if await cache.aadd(lock, 1, timeout=LOCK_TIMEOUT):
+        try:
+            _record(prefix, 'early' if fresh else 'recompute')
+            return await _astore(key, generations, compute, timeout)
+        finally:
+            await cache.adelete(lock)
+
+    if fresh:
+        _record(prefix, 'hit')
+        return envelope['payload']
+    if serve_stale and isinstance(envelope, dict):
+        _record(prefix, 'stale')
+        return envelope['payload']
+
+    deadline = time.monotonic() + LOCK_WAIT
+    while time.monotonic() < deadline:
+        await asyncio.sleep(LOCK_POLL_INTERVAL)
+        envelope = await cache.aget(key)
+        if _is_fresh(envelope, generations):
+            _record(prefix, 'wait')
+            return envelope['payload']
+
+    _record(prefix, 'recompute')
+    return await _astore(key, generations, compute, timeout)
@@ -0,0 +1,174 @@
+import json
+import platform
+import statistics
+import time
+from contextlib import contextmanager, nullcontext
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+from django.core.cache import DEFAULT_CACHE_ALIAS, cache, caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from CaffeRatings.models import Cafe, City, Rating
+
+
+# view -> builds the URL from the busiest city and cafe
+TARGETS: Dict[str, Callable[[City, Cafe], str]] = {
+    'getOrCreateCafes': lambda city, cafe: reverse('city-cafes', args=[city.slug]),
+    'getRating': lambda city, cafe: reverse('cafe-ratings', args=[city.slug, cafe.slug]),
+    'getCities': lambda city, cafe: reverse('cities'),
+    'city_load': lambda city, cafe: reverse('city', args=[city.slug]),
+    'index': lambda city, cafe: reverse('index'),
+}
+
+@contextmanager
+def isolated_cache() -> Iterator[None]:
+    """
+    Cold runs clear the cache before every request. Inside the block the
+    default cache of this thread is a fresh local one, the configured
+    instance is put back afterwards with its entries untouched.
+    """
+    configured = caches[DEFAULT_CACHE_ALIAS]
+    isolated = LocMemCache('benchmark', {'OPTIONS': {'MAX_ENTRIES': 100_000}})
+    caches[DEFAULT_CACHE_ALIAS] = isolated
+    try:
+        yield
+    finally:
+        caches[DEFAULT_CACHE_ALIAS] = configured
+        isolated.clear()
+
+
+def busiest() -> Tuple[City, Cafe]:
+    """
+    The city with the most approved cafes and its cafe with the most ratings.
+    """
+    city = City.objects.filter(display=True).order_by('-approved_cafes', 'pk').first()
+    if city is None:
+        raise CommandError('No city with approved cafes, run seed_data first.')
+    cafe = Cafe.objects.filter(city=city).order_by('-rating_count', 'pk').first()
+    return city, cafe
+
+
+def percentile(values: List[float], share: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(share * len(ordered)))]
+
+
+class Command(BaseCommand):
+    help = (
+        'Measures latency and query counts of the main API and HTML views with a cold and a warm cache, '
+        'optionally failing when a run is slower than a saved baseline.'
+    )
+
+    def add_arguments(self, parser) -> None:
+        parser.add_argument('views', nargs='*', metavar='view', help=f'Only run these views: {", ".join(TARGETS)}.')
+        parser.add_argument('--iterations', type=int, default=50, help='Warm requests per view.')
+        parser.add_argument('--cold-iterations', type=int, default=5, help='Requests per view after clearing the cache.')
+        parser.add_argument('--host', default='localhost', help='Host header, must be in ALLOWED_HOSTS.')
+        parser.add_argument('--output', type=Path, help='Write the results as JSON to this file.')
+        parser.add_argument('--baseline', type=Path, help='Compare with the results in this file.')
+        parser.add_argument(
+            '--threshold',
+            type=float,
+            default=0.25,
+            help='Allowed relative slowdown of the median latency versus the baseline.',
+        )
+        parser.add_argument('--save-baseline', action='store_true', help='Write the results to --baseline.')
+        parser.add_argument(
+            '--shared-cache',
+            action='store_true',
+            help='Measure against the configured cache instead of a local one. Cold runs clear it.',
+        )
+
+    def handle(self, *args, **options) -> None:
+        city, cafe = busiest()
+        client = Client(SERVER_NAME=options['host'])
+        views = options['views'] or list(TARGETS)
+        unknown = set(views) - set(TARGETS)
+        if unknown:
+            raise CommandError(f'Unknown view(s): {", ".join(sorted(unknown))}.')
+
+        results: Dict[str, Any] = {}
+        with nullcontext() if options['shared_cache'] else isolated_cache():
+            for view in views:
+                url = TARGETS[view](city, cafe)
+                results[view] = {
+                    'url': url,
+                    'cold': self.measure(client, url, options['cold_iterations'], clear=True),
+                    'warm': self.measure(client, url, options['iterations'], clear=False),
+                }
+                for mode in ('cold', 'warm'):
+                    run = results[view][mode]
+                    self.stdout.write(
+                        f"{view} {mode}: p50 {run['p50_ms']:.2f}ms, p95 {run['p95_ms']:.2f}ms, "
+                        f"{run['queries']} queries, status {run['status']}"
+                    )
+
+        report = {
+            'time': datetime.now(timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'database': connection.vendor,
+            'cache': 'shared' if options['shared_cache'] else 'isolated',
+            'dataset': {
+                'cities': City.objects.count(),
+                'cafes': Cafe.objects.count(),
+                'ratings': Rating.objects.count(),
+            },
+            'results': results,
+        }
+        if options['output']:
+            options['output'].write_text(json.dumps(report, indent=2))
+
+        if options['baseline'] and options['save_baseline']:
+            options['baseline'].write_text(json.dumps(report, indent=2))
+            self.stdout.write(self.style.SUCCESS(f"Baseline saved to {options['baseline']}."))
+        elif options['baseline']:
+            self.compare(results, json.loads(options['baseline'].read_text())['results'], options['threshold'])
+
+    def measure(self, client: Client, url: str, iterations: int, clear: bool) -> Dict[str, Any]:
+        if not clear:
+            # the first request fills the cache and is not counted
+            client.get(url)
+
+        durations, queries, status = [], [], None
+        for _ in range(max(1, iterations)):
+            if clear:
+                cache.clear()
+            with CaptureQueriesContext(connection) as captured:
+                started = time.perf_counter()
+                response = client.get(url)
+                durations.append((time.perf_counter() - started) * 1000)
+            queries.append(len(captured.captured_queries))
+            status = response.status_code
+
+        return {
+            'iterations': len(durations),
+            'status': status,
+            'p50_ms': statistics.median(durations),
+            'p95_ms': percentile(durations, 0.95),
+            'mean_ms': statistics.fmean(durations),
+            'queries': max(queries),
+        }
+
+    def compare(self, results: Dict[str, Any], baseline: Dict[str, Any], threshold: float) -> None:
+        regressions = []
+        for view, modes in results.items():
+            for mode, run in modes.items():
+                previous: Optional[Dict[str, Any]] = baseline.get(view, {}).get(mode) if mode != 'url' else None
+                if not previous:
+                    continue
+                limit = previous['p50_ms'] * (1 + threshold)
+                if run['p50_ms'] > limit:
+                    regressions.append(f"{view} {mode}: p50 {run['p50_ms']:.2f}ms, baseline {previous['p50_ms']:.2f}ms")
+                if run['queries'] > previous['queries']:
+                    regressions.append(f"{view} {mode}: {run['queries']} queries, baseline {previous['queries']}")
+
+        for regression in regressions:
+            self.stderr.write(regression)
+        if regressions:
+            raise CommandError(f'{len(regressions)} regression(s) versus the baseline.')
+        self.stdout.write(self.style.SUCCESS('No regressions versus the baseline.'))
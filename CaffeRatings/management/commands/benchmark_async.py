@@ -0,0 +1,178 @@
+import asyncio
+import contextvars
+import json
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Tuple
+from asgiref.sync import async_to_sync
+from django.core.cache import cache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import AsyncRequestFactory, RequestFactory, override_settings
+from django.urls import resolve
+from API import async_views, views as sync_views
+from . import benchmark
+from .benchmark import busiest, percentile
+
+
+# views with an async variant -> builds the URL from the busiest city and cafe
+TARGETS = {name: build for name, build in benchmark.TARGETS.items() if hasattr(async_views, name)}
+
+# set while a SlowCache call is running, so the calls it makes to itself
+# (get_many calling get) do not wait again
+_waiting = contextvars.ContextVar('waiting', default=False)
+
+
+def _slowed(name: str) -> Tuple[Callable, Callable]:
+    method = getattr(LocMemCache, name)
+
+    def call(self, *args, **kwargs):
+        token = _waiting.set(True)
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            _waiting.reset(token)
+
+    def blocking(self, *args, **kwargs):
+        if not _waiting.get():
+            time.sleep(self.delay)
+        return call(self, *args, **kwargs)
+
+    async def awaiting(self, *args, **kwargs):
+        await asyncio.sleep(self.delay)
+        return call(self, *args, **kwargs)
+
+    return blocking, awaiting
+
+
+class SlowCache(LocMemCache):
+    """
+    Stand-in for a remote cache: LocMemCache that takes OPTIONS['DELAY']
+    seconds per call, blocking the thread in the sync methods and only the
+    calling task in the async ones.
+    """
+    def __init__(self, name: str, params: Dict[str, Any]) -> None:
+        super().__init__(name, params)
+        self.delay = params.get('OPTIONS', {}).get('DELAY', 0.002)
+
+
+for _name in ('add', 'get', 'set', 'touch', 'delete', 'has_key', 'incr', 'get_many', 'set_many', 'delete_many'):
+    _blocking, _awaiting = _slowed(_name)
+    setattr(SlowCache, _name, _blocking)
+    setattr(SlowCache, f'a{_name}', _awaiting)
+
+
+def summary(durations: List[float], seconds: float, statuses: List[int]) -> Dict[str, Any]:
+    return {
+        'requests': len(durations),
+        'statuses': sorted(set(statuses)),
+        'requests_per_second': len(durations) / seconds if seconds else 0,
+        'p50_ms': statistics.median(durations),
+        'p95_ms': percentile(durations, 0.95),
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        'Compares the throughput of the sync and async read views under concurrency, '
+        'with a cache that answers after a fixed delay.'
+    )
+
+    def add_arguments(self, parser) -> None:
+        parser.add_argument('views', nargs='*', metavar='view', help=f'Only run these views: {", ".join(TARGETS)}.')
+        parser.add_argument('--requests', type=int, default=500, help='Requests per view and mode.')
+        parser.add_argument('--concurrency', type=int, default=100, help='Requests in flight at once.')
+        parser.add_argument(
+            '--threads', type=int, default=8, help='Worker threads of the sync run, like a threaded WSGI server.'
+        )
+        parser.add_argument('--cache-delay', type=float, default=2.0, help='Milliseconds per cache call.')
+        parser.add_argument('--host', default='localhost', help='Host header, must be in ALLOWED_HOSTS.')
+        parser.add_argument('--output', type=Path, help='Write the results as JSON to this file.')
+
+    def handle(self, *args, **options) -> None:
+        names = options['views'] or list(TARGETS)
+        unknown = set(names) - set(TARGETS)
+        if unknown:
+            raise CommandError(f'Unknown view(s): {", ".join(sorted(unknown))}.')
+
+        city, cafe = busiest()
+        caches = {
+            'default': {
+                'BACKEND': f'{__name__}.SlowCache',
+                'LOCATION': 'benchmark-async',
+                'OPTIONS': {'DELAY': options['cache_delay'] / 1000, 'MAX_ENTRIES': 100_000},
+            }
+        }
+        results: Dict[str, Any] = {}
+        with override_settings(CACHES=caches):
+            for name in names:
+                url = TARGETS[name](city, cafe)
+                cache.clear()
+                results[name] = {
+                    'url': url,
+                    'sync': self.run_sync(name, url, options),
+                    'async': async_to_sync(self.run_async)(name, url, options),
+                }
+                for mode in ('sync', 'async'):
+                    run = results[name][mode]
+                    self.stdout.write(
+                        f"{name} {mode}: {run['requests_per_second']:.0f} req/s, "
+                        f"p50 {run['p50_ms']:.2f}ms, p95 {run['p95_ms']:.2f}ms, status {run['statuses']}"
+                    )
+            cache.clear()
+
+        if options['output']:
+            options['output'].write_text(json.dumps({'options': {
+                key: options[key] for key in ('requests', 'concurrency', 'threads', 'cache_delay')
+            }, 'results': results}, indent=2))
+
+    def run_sync(self, name: str, url: str, options: Dict[str, Any]) -> Dict[str, Any]:
+        view, kwargs = getattr(sync_views, name), resolve(url).kwargs
+        factory = RequestFactory(SERVER_NAME=options['host'])
+        threads = max(1, options['threads'])
+
+        def worker(count: int) -> List[Tuple[float, int]]:
+            timings = []
+            try:
+                for _ in range(count):
+                    started = time.perf_counter()
+                    response = view(factory.get(url), **kwargs).render()
+                    timings.append(((time.perf_counter() - started) * 1000, response.status_code))
+            finally:
+                # every worker thread opened its own connection
+                connection.close()
+            return timings
+
+        # the first request fills the cache and is not counted
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            executor.submit(worker, 1).result()
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            shares = [len(range(i, options['requests'], threads)) for i in range(threads)]
+            timings = [timing for part in executor.map(worker, shares) for timing in part]
+        seconds = time.perf_counter() - started
+        return summary([duration for duration, _ in timings], seconds, [code for _, code in timings])
+
+    async def run_async(self, name: str, url: str, options: Dict[str, Any]) -> Dict[str, Any]:
+        view, kwargs = getattr(async_views, name), resolve(url).kwargs
+        factory = AsyncRequestFactory()
+        limit = asyncio.Semaphore(max(1, options['concurrency']))
+
+        async def request() -> Tuple[float, int]:
+            async with limit:
+                started = time.perf_counter()
+                http_request = factory.get(url)
+                # AsyncRequestFactory always sends Host: testserver
+                http_request.META['HTTP_HOST'] = options['host']
+                response = await view(http_request, **kwargs)
+                return (time.perf_counter() - started) * 1000, response.status_code
+
+        await request()
+        started = time.perf_counter()
+        timings = await asyncio.gather(*(request() for _ in range(options['requests'])))
+        seconds = time.perf_counter() - started
+        return summary([duration for duration, _ in timings], seconds, [code for _, code in timings])
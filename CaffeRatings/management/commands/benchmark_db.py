@@ -0,0 +1,202 @@
+import json
+import random
+import sqlite3
+import statistics
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connection, connections
+from API import payloads
+from CaffeReviewer import databases
+from CaffeRatings.models import Cafe, Category, MineUser, Rating
+from .benchmark import busiest, percentile
+
+
+class Worker(threading.Thread):
+    def __init__(self, operation: Callable[[], None], stop: threading.Event) -> None:
+        super().__init__(daemon=True)
+        self.operation = operation
+        self.stop = stop
+        self.durations: List[float] = []
+        self.errors = 0
+
+    def run(self) -> None:
+        try:
+            while not self.stop.is_set():
+                started = time.perf_counter()
+                try:
+                    self.operation()
+                except DatabaseError:
+                    # e.g. "database is locked" once busy_timeout ran out
+                    self.errors += 1
+                    continue
+                self.durations.append((time.perf_counter() - started) * 1000)
+        finally:
+            # every worker thread opened its own connection
+            connection.close()
+
+
+def copy_sqlite(path: Path) -> None:
+    """
+    Copies the configured SQLite database to path, in rollback journal mode
+    so that every profile starts from the same file.
+    """
+    connection.ensure_connection()
+    target = sqlite3.connect(path)
+    try:
+        connection.connection.backup(target)
+        target.execute('PRAGMA journal_mode=DELETE')
+    finally:
+        target.close()
+
+
+@contextmanager
+def default_database(database: Dict[str, Any]) -> Iterator[None]:
+    """
+    Points the default alias at database inside the block, in this thread
+    and in the worker threads, which connect with the handler's settings.
+    """
+    configured = connections.settings[DEFAULT_DB_ALIAS]
+    original = connections[DEFAULT_DB_ALIAS]
+    connections.settings[DEFAULT_DB_ALIAS] = connections.configure_settings({DEFAULT_DB_ALIAS: database})[DEFAULT_DB_ALIAS]
+    del connections[DEFAULT_DB_ALIAS]
+    try:
+        yield
+    finally:
+        connections[DEFAULT_DB_ALIAS].close()
+        connections.settings[DEFAULT_DB_ALIAS] = configured
+        connections[DEFAULT_DB_ALIAS] = original
+
+
+def summary(workers: List[Worker], seconds: float) -> Dict[str, Any]:
+    durations = [duration for worker in workers for duration in worker.durations]
+    result: Dict[str, Any] = {
+        'count': len(durations),
+        'errors': sum(worker.errors for worker in workers),
+        'per_second': len(durations) / seconds,
+    }
+    if durations:
+        result.update({
+            'p50_ms': statistics.median(durations),
+            'p95_ms': percentile(durations, 0.95),
+            'p99_ms': percentile(durations, 0.99),
+        })
+    return result
+
+
+class Command(BaseCommand):
+    help = (
+        'Measures read latency of the ratings and cafe list queries alone and while rating submissions and '
+        'cafe updates write concurrently, once per database profile, each on its own copy of the database.'
+    )
+
+    def add_arguments(self, parser) -> None:
+        parser.add_argument(
+            'profiles', nargs='*', metavar='profile', help=f'Only run these profiles: {", ".join(databases.PROFILES)}.'
+        )
+        parser.add_argument('--readers', type=int, default=8, help='Reading threads.')
+        parser.add_argument('--writers', type=int, default=2, help='Writing threads.')
+        parser.add_argument('--duration', type=float, default=10.0, help='Seconds per phase.')
+        parser.add_argument('--output', type=Path, help='Write the results as JSON to this file.')
+
+    def handle(self, *args, **options) -> None:
+        names = options['profiles'] or list(databases.PROFILES)
+        unknown = set(names) - set(databases.PROFILES)
+        if unknown:
+            raise CommandError(f'Unknown profile(s): {", ".join(sorted(unknown))}.')
+
+        report: Dict[str, Any] = {
+            'configured': getattr(settings, 'DATABASE_PROFILE', None),
+            'options': {key: options[key] for key in ('readers', 'writers', 'duration')},
+            'profiles': {},
+        }
+        for name in names:
+            if name == 'postgres':
+                # a server database can not be copied to a temporary file,
+                # it is measured in place when it is the configured one
+                if report['configured'] != 'postgres':
+                    self.stdout.write('postgres: skipped, only measured as the configured DATABASE_PROFILE')
+                    continue
+                report['profiles'][name] = self.measure(options)
+                continue
+            if connection.vendor != 'sqlite':
+                self.stdout.write(f'{name}: skipped, measured on a copy of a SQLite database')
+                continue
+            with tempfile.TemporaryDirectory() as directory:
+                copy_sqlite(Path(directory) / 'db.sqlite3')
+                with default_database(databases.profile(name, Path(directory), {})):
+                    report['profiles'][name] = self.measure(options)
+
+        # one row per profile and phase, side by side
+        self.stdout.write(
+            f"{'profile':<12}{'phase':<11}{'reads/s':>9}{'failed':>8}"
+            f"{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'writes/s':>10}{'failed':>8}"
+        )
+        for name, result in report['profiles'].items():
+            for phase in ('idle', 'contended'):
+                reads, writes = result[phase]['reads'], result[phase]['writes']
+                latencies = ''.join(f"{reads.get(key, float('nan')):>9.2f}" for key in ('p50_ms', 'p95_ms', 'p99_ms'))
+                self.stdout.write(
+                    f"{name:<12}{phase:<11}{reads['per_second']:>9.0f}{reads['errors']:>8}{latencies}"
+                    f"{writes['per_second']:>10.0f}{writes['errors']:>8}"
+                )
+
+        if options['output']:
+            options['output'].write_text(json.dumps(report, indent=2))
+
+    def measure(self, options: Dict[str, Any]) -> Dict[str, Any]:
+        city, cafe = busiest()
+        users = list(MineUser.objects.order_by('pk').values_list('pk', flat=True)[:100])
+        categories = list(Category.objects.values_list('pk', flat=True))
+        if not users or not categories:
+            raise CommandError('No users or categories, run seed_data first.')
+
+        def read() -> None:
+            # the payloads' queries without the cache in front of them
+            if random.random() < 0.5:
+                payloads.ratings(city.name, cafe.name).build()
+            else:
+                payloads.cafes(city.name).build()
+
+        def write() -> None:
+            if random.random() < 0.5:
+                # what a rating POST does, ratings are replaced, not added
+                author = MineUser(pk=random.choice(users))
+                Rating.objects.submit(author, cafe, {random.choice(categories): (random.randint(1, 5), 'star')})
+            else:
+                # what a cafe PUT does, the row is written with its own values
+                Cafe.objects.get(pk=cafe.pk).save(update_fields=['location'])
+
+        return {
+            'database': connection.vendor,
+            'journal_mode': self.journal_mode(),
+            'idle': self.phase(read, write, options['readers'], 0, options['duration']),
+            'contended': self.phase(read, write, options['readers'], options['writers'], options['duration']),
+        }
+    def phase(
+        self, read: Callable[[], None], write: Callable[[], None], readers: int, writers: int, duration: float
+    ) -> Dict[str, Any]:
+        stop = threading.Event()
+        reading = [Worker(read, stop) for _ in range(max(1, readers))]
+        writing = [Worker(write, stop) for _ in range(writers)]
+        started = time.perf_counter()
+        for worker in reading + writing:
+            worker.start()
+        time.sleep(duration)
+        stop.set()
+        for worker in reading + writing:
+            worker.join()
+        seconds = time.perf_counter() - started
+        return {'reads': summary(reading, seconds), 'writes': summary(writing, seconds)}
+
+    def journal_mode(self) -> Any:
+        if connection.vendor != 'sqlite':
+            return None
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            return cursor.fetchone()[0]
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from CaffeRatings import caching
+
+
+class Command(BaseCommand):
+    help = 'Shows how cached payloads were served: hits, stale responses and recomputations.'
+
+    def add_arguments(self, parser) -> None:
+        parser.add_argument(
+            'prefixes',
+            nargs='*',
+            default=['cafes', 'ratings', 'scores', 'cities'],
+            help='Payload prefixes to report on.',
+        )
+
+    def handle(self, *args, **options) -> None:
+        stats = caching.get_stats(options['prefixes'])
+        for prefix, outcomes in stats.items():
+            total = sum(outcomes.values())
+            line = ', '.join(f'{outcome} {count}' for outcome, count in outcomes.items())
+            stale_ratio = outcomes['stale'] / total if total else 0
+            self.stdout.write(f'{prefix}: {line} (stale {stale_ratio:.1%} of {total})')
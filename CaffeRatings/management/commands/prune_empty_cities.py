@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from CaffeRatings.models import Cafe, City
+
+
+class Command(BaseCommand):
+    help = 'Deletes cities that have no cafes left.'
+
+    def add_arguments(self, parser) -> None:
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Only report the cities that would be deleted.',
+        )
+
+    def handle(self, *args, **options) -> None:
+        empty = City.objects.filter(~Exists(Cafe.objects.filter(city=OuterRef('pk'))))
+
+        if options['dry_run']:
+            names = list(empty.order_by('name').values_list('name', flat=True))
+            for name in names:
+                self.stdout.write(name)
+            self.stdout.write(self.style.SUCCESS(f'{len(names)} empty city(ies) found.'))
+            return
+
+        deleted = 0
+        last_pk = 0
+        while True:
+            with transaction.atomic():
+                # rows locked by another run are skipped, and the condition is
+                # checked again under the lock, so a cafe added meanwhile keeps its city
+                batch = list(
+                    empty.filter(pk__gt=last_pk)
+                    .order_by('pk')
+                    .select_for_update(skip_locked=True)
+                    .values_list('pk', flat=True)[:options['batch_size']]
+                )
+                if not batch:
+                    break
+                last_pk = batch[-1]
+                # post_delete still runs per city and invalidates its caches
+                _, per_model = empty.filter(pk__in=batch).delete()
+                deleted += per_model.get(City._meta.label, 0)
+
+        self.stdout.write(self.style.SUCCESS(f'{deleted} empty city(ies) deleted.'))
@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand, CommandError
+from CaffeRatings.aggregates import find_category_score_drift, find_rating_drift, rebuild_rating_aggregates
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds denormalized rating aggregates on cafes and category scores and reports drift.'
+
+    def add_arguments(self, parser) -> None:
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='Only report drift, exit with an error if any is found.',
+        )
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options) -> None:
+        if options['check']:
+            cafe_drift, score_drift = find_rating_drift(), find_category_score_drift()
+        else:
+            cafe_drift, score_drift = rebuild_rating_aggregates(batch_size=options['batch_size'])
+
+        for pk, (stored_sum, stored_count), (actual_sum, actual_count) in cafe_drift:
+            self.stdout.write(
+                f'cafe {pk}: stored {stored_sum}/{stored_count}, actual {actual_sum}/{actual_count}'
+            )
+        for (cafe, category), (stored_sum, stored_count), (actual_sum, actual_count) in score_drift:
+            self.stdout.write(
+                f'cafe {cafe} category {category}: stored {stored_sum}/{stored_count}, actual {actual_sum}/{actual_count}'
+            )
+
+        drifted = len(cafe_drift) + len(score_drift)
+        if options['check'] and drifted:
+            raise CommandError(f'{drifted} aggregate(s) have drifted.')
+
+        verb = 'found' if options['check'] else 'fixed'
+        self.stdout.write(self.style.SUCCESS(f'{drifted} drifted aggregate(s) {verb}.'))
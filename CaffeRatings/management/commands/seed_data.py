@@ -0,0 +1,183 @@
+import random
+import time
+from typing import Iterator, List
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from CaffeRatings import caching
+from CaffeRatings.models import Cafe, CafeCategoryScore, Category, City, Comments, MineUser, Rating
+
+
+CITY_PREFIX = 'Seed City'
+USER_PREFIX = 'seed-user-'
+CATEGORIES = ['Coffee', 'Service', 'Atmosphere', 'Price', 'Food', 'Wifi', 'Music', 'Seating']
+# most ratings are good, a few are harsh
+RATING_WEIGHTS = [2, 3, 8, 20, 37, 30]
+
+
+def zipf_weights(count: int, exponent: float) -> List[float]:
+    return [1 / rank ** exponent for rank in range(1, count + 1)]
+
+
+def spread(total: int, weights: List[float], rng: random.Random, cap: int) -> List[int]:
+    """
+    Splits total over len(weights) buckets proportionally to weights, each
+    bucket gets at least one and at most cap items.
+    """
+    scale = sum(weights)
+    counts = [max(1, min(cap, round(total * weight / scale))) for weight in weights]
+    rng.shuffle(counts)
+    return counts
+
+
+class Command(BaseCommand):
+    help = 'Generates a skewed synthetic dataset of cities, cafes, users and ratings for benchmarks.'
+
+    def add_arguments(self, parser) -> None:
+        parser.add_argument('--cities', type=int, default=1000)
+        parser.add_argument('--cafes', type=int, default=100_000)
+        parser.add_argument('--ratings', type=int, default=10_000_000)
+        parser.add_argument('--users', type=int, default=20_000)
+        parser.add_argument('--categories', type=int, default=5, choices=range(1, len(CATEGORIES) + 1))
+        parser.add_argument('--skew', type=float, default=1.1, help='Zipf exponent of cafes per city and ratings per cafe.')
+        parser.add_argument('--unapproved', type=float, default=0.1, help='Share of cafes that are not approved.')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=0, help='Random seed, the same seed gives the same dataset.')
+        parser.add_argument('--clear', action='store_true', help='Delete previously seeded data first.')
+
+    def handle(self, *args, **options) -> None:
+        if options['cafes'] < options['cities']:
+            raise CommandError('Every city needs at least one cafe, use more cafes than cities.')
+        if options['clear']:
+            self.clear(options['batch_size'])
+        elif City.objects.filter(name__startswith=CITY_PREFIX).exists():
+            raise CommandError('Seeded data already exists, use --clear to replace it.')
+
+        rng = random.Random(options['seed'])
+        batch_size = options['batch_size']
+        started = time.monotonic()
+
+        categories = self.categories(options['categories'])
+        users = self.users(options['users'], batch_size)
+        cities = City.objects.bulk_create(
+            [City(name=f'{CITY_PREFIX} {index:05}') for index in range(options['cities'])], batch_size=batch_size
+        )
+        self.stdout.write(f'{len(cities)} cities, {len(users)} users, {len(categories)} categories')
+
+        per_city = spread(options['cafes'], zipf_weights(len(cities), options['skew']), rng, options['cafes'])
+        cafes = Cafe.objects.bulk_create(
+            [
+                Cafe(
+                    name=f'Cafe {index}',
+                    location=f'{index} Seed Street',
+                    city=city,
+                    approved=rng.random() >= options['unapproved'],
+                )
+                for city, count in zip(cities, per_city)
+                for index in range(count)
+            ],
+            batch_size=batch_size,
+        )
+        self.stdout.write(f'{len(cafes)} cafes')
+
+        # an author rates a category of a cafe at most once
+        cap = len(users) * len(categories)
+        per_cafe = spread(options['ratings'], zipf_weights(len(cafes), options['skew']), rng, cap)
+        created = 0
+        for batch in self.batches(self.ratings(cafes, per_cafe, users, categories, rng), batch_size):
+            with transaction.atomic():
+                Rating.objects.bulk_create(batch)
+            created += len(batch)
+        self.stdout.write(f'{created} ratings')
+
+        self.write_aggregates(cafes, batch_size)
+        caching.invalidate_cities()
+        for city in cities:
+            caching.invalidate_city(city.slug)
+
+        self.stdout.write(self.style.SUCCESS(f'Seeded in {time.monotonic() - started:.1f}s.'))
+
+    def clear(self, batch_size: int) -> None:
+        # a cascading delete would load every seeded rating and cafe, their
+        # post_delete receivers rule out fast deletes; plain DELETEs per batch
+        # of cafes skip the receivers, the caches are invalidated once below
+        cities = dict(City.objects.filter(name__startswith=CITY_PREFIX).values_list('pk', 'slug'))
+        cafes = list(Cafe.objects.filter(city_id__in=cities).values_list('pk', 'city_id', 'slug'))
+        deleted = 0
+        for start in range(0, len(cafes), batch_size):
+            ids = [pk for pk, _, _ in cafes[start:start + batch_size]]
+            with transaction.atomic():
+                for queryset in (
+                    Rating.objects.filter(cafe_id__in=ids),
+                    Comments.objects.filter(cafe_id__in=ids),
+                    CafeCategoryScore.objects.filter(cafe_id__in=ids),
+                    Cafe.objects.filter(pk__in=ids),
+                ):
+                    deleted += queryset._raw_delete(queryset.db)
+        queryset = City.objects.filter(pk__in=cities)
+        deleted += queryset._raw_delete(queryset.db)
+
+        caching.bump_generations(
+            caching.CITIES_GENERATION,
+            *(caching.city_generation(slug) for slug in cities.values()),
+            *(caching.cafe_generation(cities[city_id], slug) for _, city_id, slug in cafes),
+        )
+        MineUser.objects.filter(username__startswith=USER_PREFIX).delete()
+        self.stdout.write(f'{deleted} seeded rows deleted')
+
+    def categories(self, count: int) -> List[Category]:
+        return [Category.objects.get_or_create(name=name)[0] for name in CATEGORIES[:count]]
+
+    def users(self, count: int, batch_size: int) -> List[MineUser]:
+        existing = list(MineUser.objects.filter(username__startswith=USER_PREFIX).order_by('pk')[:count])
+        # seeded users can not log in, hashing a password per user would dominate the run
+        password = make_password(None)
+        missing = [
+            MineUser(username=f'{USER_PREFIX}{index}', password=password) for index in range(len(existing), count)
+        ]
+        return existing + MineUser.objects.bulk_create(missing, batch_size=batch_size)
+
+    def ratings(
+        self,
+        cafes: List[Cafe],
+        per_cafe: List[int],
+        users: List[MineUser],
+        categories: List[Category],
+        rng: random.Random,
+    ) -> Iterator[Rating]:
+        values = range(len(RATING_WEIGHTS))
+        for cafe, count in zip(cafes, per_cafe):
+            # cafes have a quality of their own, ratings scatter around it
+            bias = rng.choice([-1, 0, 0, 1])
+            offset = rng.randrange(len(users))
+            cafe.rating_sum, cafe.rating_count, cafe.scores = 0, count, {}
+            for index in range(count):
+                category = categories[index % len(categories)]
+                author = users[(offset + index // len(categories)) % len(users)]
+                value = min(5, max(0, rng.choices(values, RATING_WEIGHTS)[0] + bias))
+                cafe.rating_sum += value
+                total, number = cafe.scores.get(category.pk, (0, 0))
+                cafe.scores[category.pk] = (total + value, number + 1)
+                yield Rating(cafe=cafe, author=author, category=category, rating=value, icon='star')
+
+    def batches(self, items: Iterator[Rating], size: int) -> Iterator[List[Rating]]:
+        batch = []
+        for item in items:
+            batch.append(item)
+            if len(batch) == size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def write_aggregates(self, cafes: List[Cafe], batch_size: int) -> None:
+        # bulk_create skips Rating.save, the totals were collected while generating
+        Cafe.objects.bulk_update(cafes, ['rating_sum', 'rating_count'], batch_size=batch_size)
+        CafeCategoryScore.objects.bulk_create(
+            [
+                CafeCategoryScore(cafe=cafe, category_id=category, rating_sum=total, rating_count=count)
+                for cafe in cafes
+                for category, (total, count) in cafe.scores.items()
+            ],
+            batch_size=batch_size,
+        )
@@ -0,0 +1,41 @@
+from collections import defaultdict
+from pathlib import Path
+from django.core.management.base import BaseCommand
+from CaffeReviewer.slow_queries import read_log
+
+
+class Command(BaseCommand):
+    help = 'Summarizes the slow query log, grouped by normalized SQL, slowest in total first.'
+
+    def add_arguments(self, parser) -> None:
+        parser.add_argument('--limit', type=int, default=10, help='Number of query groups to show.')
+        parser.add_argument('--plans', action='store_true', help='Show the plan of the slowest sample of each group.')
+        parser.add_argument('--log', type=Path, help='Log file, defaults to SLOW_QUERY_LOG.')
+
+    def handle(self, *args, **options) -> None:
+        groups = defaultdict(list)
+        for entry in read_log(options['log']):
+            groups[entry['fingerprint']].append(entry)
+
+        if not groups:
+            self.stdout.write('No slow queries logged.')
+            return
+
+        ranked = sorted(groups.items(), key=lambda item: sum(entry['duration_ms'] for entry in item[1]), reverse=True)
+        for fingerprint, entries in ranked[:options['limit']]:
+            durations = sorted(entry['duration_ms'] for entry in entries)
+            slowest = max(entries, key=lambda entry: entry['duration_ms'])
+            views = sorted({entry['view'] for entry in entries})
+            self.stdout.write(
+                f'{fingerprint}: {len(entries)}x, total {sum(durations):.1f}ms, '
+                f'median {durations[len(durations) // 2]:.1f}ms, max {durations[-1]:.1f}ms'
+            )
+            self.stdout.write(f"  views: {', '.join(views)}")
+            self.stdout.write(f"  {slowest['sql']}")
+            if options['plans'] and slowest.get('plan'):
+                for row in slowest['plan']:
+                    self.stdout.write(f'    {row}')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'{sum(len(entries) for entries in groups.values())} slow queries in {len(groups)} group(s).'
+        ))
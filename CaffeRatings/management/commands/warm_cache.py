@@ -0,0 +1,94 @@
+import pickle
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterator, List, Tuple
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.http import Http404
+from API import payloads
+from CaffeRatings.models import Cafe, City
+
+
+class Command(BaseCommand):
+    help = 'Precomputes cached API payloads for every displayed city and its cafes.'
+
+    def add_arguments(self, parser) -> None:
+        parser.add_argument('--batch-size', type=int, default=100, help='Cafes loaded and warmed per batch.')
+        parser.add_argument('--workers', type=int, default=1, help='Number of cities warmed in parallel.')
+        parser.add_argument('cities', nargs='*', help='Only warm these cities.')
+
+    def handle(self, *args, **options) -> None:
+        cities = City.objects.filter(display=True).order_by('name')
+        if options['cities']:
+            cities = cities.filter(name__in=options['cities'])
+        names = dict(cities.values_list('slug', 'name'))
+
+        started = time.monotonic()
+        totals = self.warm_pages(payloads.cities)
+
+        if options['workers'] > 1:
+            executor = ThreadPoolExecutor(max_workers=options['workers'])
+            results = executor.map(lambda slug: self.warm_city_in_thread(slug, options['batch_size']), names)
+        else:
+            executor = None
+            results = (self.warm_city(slug, options['batch_size']) for slug in names)
+
+        for slug, report in zip(names, results):
+            self.stdout.write(
+                f"{names[slug]}: {report['keys']} keys, {report['bytes']} bytes in {report['seconds']:.3f}s"
+            )
+            for field in ('keys', 'bytes', 'empty'):
+                totals[field] += report[field]
+        if executor:
+            executor.shutdown()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Warmed {totals['keys']} keys ({totals['bytes']} bytes, {totals['empty']} empty) "
+            f"for {len(names)} cities in {time.monotonic() - started:.3f}s."
+        ))
+
+    def warm(self, payload: payloads.Payload) -> Tuple[Dict[str, int], Any]:
+        try:
+            data = payload.refresh()
+        except Http404:
+            return {'keys': 0, 'bytes': 0, 'empty': 1}, None
+        return {'keys': 1, 'bytes': len(pickle.dumps(data, pickle.HIGHEST_PROTOCOL)), 'empty': 0}, data
+
+    def warm_pages(self, make_payload: Callable[..., payloads.Payload], *args: str) -> Dict[str, int]:
+        # default sized pages, following the cursor like a client would
+        report, page = self.warm(make_payload(*args))
+        while page and page['next'] is not None:
+            page_report, page = self.warm(make_payload(*args, after=page['next']))
+            for field, value in page_report.items():
+                report[field] += value
+        return report
+
+    def warm_city(self, city: str, batch_size: int) -> Dict[str, float]:
+        started = time.monotonic()
+        report = self.warm_pages(payloads.cafes, city)
+        for batch in self.batches(city, batch_size):
+            for cafe_name in batch:
+                for cafe_report in (self.warm_pages(payloads.ratings, city, cafe_name), self.warm(payloads.scores(city, cafe_name))[0]):
+                    for field, value in cafe_report.items():
+                        report[field] += value
+        report['seconds'] = time.monotonic() - started
+        return report
+
+    def warm_city_in_thread(self, city: str, batch_size: int) -> Dict[str, float]:
+        try:
+            return self.warm_city(city, batch_size)
+        finally:
+            # every worker thread opens its own connection
+            connection.close()
+
+    def batches(self, city: str, batch_size: int) -> Iterator[List[str]]:
+        # keyset over primary keys, so every batch is one bounded indexed query
+        last = 0
+        while True:
+            batch = list(
+                Cafe.objects.filter(city__slug=city, pk__gt=last).order_by('pk').values_list('pk', 'slug')[:batch_size]
+            )
+            if not batch:
+                return
+            last = batch[-1][0]
+            yield [slug for _, slug in batch]
@@ -0,0 +1,34 @@
+# Generated by Django 5.1.15 on 2026-10-18 13:32
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def backfill_rating_aggregates(apps, schema_editor):
+    Cafe = apps.get_model('CaffeRatings', 'Cafe')
+    Rating = apps.get_model('CaffeRatings', 'Rating')
+
+    totals = Rating.objects.values('cafe').annotate(total=Sum('rating'), count=Count('id')).order_by()
+    cafes = [Cafe(pk=row['cafe'], rating_sum=row['total'], rating_count=row['count']) for row in totals]
+    Cafe.objects.bulk_update(cafes, ['rating_sum', 'rating_count'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('CaffeRatings', '0004_city_display'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cafe',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='cafe',
+            name='rating_sum',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_rating_aggregates, migrations.RunPython.noop),
+    ]
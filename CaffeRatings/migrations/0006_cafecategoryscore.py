@@ -0,0 +1,41 @@
+# Generated by Django 5.1.15 on 2026-10-18 13:33
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def backfill_category_scores(apps, schema_editor):
+    CafeCategoryScore = apps.get_model('CaffeRatings', 'CafeCategoryScore')
+    Rating = apps.get_model('CaffeRatings', 'Rating')
+
+    totals = Rating.objects.values('cafe', 'category').annotate(total=Sum('rating'), count=Count('id')).order_by()
+    scores = [
+        CafeCategoryScore(cafe_id=row['cafe'], category_id=row['category'], rating_sum=row['total'], rating_count=row['count'])
+        for row in totals
+    ]
+    CafeCategoryScore.objects.bulk_create(scores, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('CaffeRatings', '0005_cafe_rating_aggregates'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CafeCategoryScore',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rating_sum', models.IntegerField(default=0)),
+                ('rating_count', models.PositiveIntegerField(default=0)),
+                ('cafe', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='category_scores', to='CaffeRatings.cafe')),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='CaffeRatings.category')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('cafe', 'category'), name='unique_category_score')],
+            },
+        ),
+        migrations.RunPython(backfill_category_scores, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 5.1.15 on 2026-10-18 13:44
+
+from django.db import migrations, models
+from django.db.models import Count, Max, Sum
+
+
+def remove_duplicate_ratings(apps, schema_editor):
+    Cafe = apps.get_model('CaffeRatings', 'Cafe')
+    CafeCategoryScore = apps.get_model('CaffeRatings', 'CafeCategoryScore')
+    Rating = apps.get_model('CaffeRatings', 'Rating')
+
+    duplicates = (
+        Rating.objects.values('author', 'cafe', 'category')
+        .annotate(latest=Max('id'), count=Count('id'))
+        .filter(count__gt=1)
+        .order_by()
+    )
+    cafes = set()
+    for row in duplicates:
+        # the latest rating wins, like the upsert on the API does
+        Rating.objects.filter(author=row['author'], cafe=row['cafe'], category=row['category']).exclude(pk=row['latest']).delete()
+        cafes.add(row['cafe'])
+
+    # historical models fire no signals, recount the aggregates of touched cafes
+    for cafe_id in cafes:
+        totals = Rating.objects.filter(cafe=cafe_id).aggregate(total=Sum('rating'), count=Count('id'))
+        Cafe.objects.filter(pk=cafe_id).update(rating_sum=totals['total'] or 0, rating_count=totals['count'])
+        for row in Rating.objects.filter(cafe=cafe_id).values('category').annotate(total=Sum('rating'), count=Count('id')).order_by():
+            CafeCategoryScore.objects.filter(cafe=cafe_id, category=row['category']).update(
+                rating_sum=row['total'], rating_count=row['count']
+            )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('CaffeRatings', '0006_cafecategoryscore'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_ratings, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='rating',
+            constraint=models.UniqueConstraint(fields=('author', 'cafe', 'category'), name='unique_rating_per_author'),
+        ),
+    ]
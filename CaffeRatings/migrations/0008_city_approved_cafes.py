@@ -0,0 +1,31 @@
+# Generated by Django 5.1.15 on 2026-10-18 13:46
+
+from django.db import migrations, models
+from django.db.models import Count, Exists, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_approved_cafes(apps, schema_editor):
+    Cafe = apps.get_model('CaffeRatings', 'Cafe')
+    City = apps.get_model('CaffeRatings', 'City')
+
+    # display was not updated on deletes before, so it is recomputed as well
+    approved = Cafe.objects.filter(city=OuterRef('pk'), approved=True)
+    count = approved.order_by().values('city').annotate(count=Count('pk')).values('count')
+    City.objects.update(approved_cafes=Coalesce(Subquery(count), 0), display=Exists(approved))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('CaffeRatings', '0007_rating_unique_rating_per_author'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='city',
+            name='approved_cafes',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_approved_cafes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,73 @@
+# Generated by Django 5.1.15 on 2026-10-18 14:02
+
+from django.db import migrations, models
+from django.utils.text import slugify
+
+
+def _unique(base, taken, max_length):
+    slug, number = base, 2
+    while slug in taken:
+        suffix = f'-{number}'
+        slug = f'{base[:max_length - len(suffix)]}{suffix}'
+        number += 1
+    taken.add(slug)
+    return slug
+
+
+def backfill_slugs(apps, schema_editor):
+    Cafe = apps.get_model('CaffeRatings', 'Cafe')
+    City = apps.get_model('CaffeRatings', 'City')
+
+    # names differing only in case or punctuation get -2, -3, ... in id order
+    taken = set()
+    cities = list(City.objects.order_by('pk'))
+    for city in cities:
+        city.slug = _unique(slugify(city.name)[:100].strip('-') or 'city', taken, 100)
+    City.objects.bulk_update(cities, ['slug'], batch_size=500)
+
+    taken_in_city = {}
+    cafes = list(Cafe.objects.order_by('pk'))
+    for cafe in cafes:
+        taken = taken_in_city.setdefault(cafe.city_id, set())
+        cafe.slug = _unique(slugify(cafe.name)[:32].strip('-') or 'cafe', taken, 32)
+    Cafe.objects.bulk_update(cafes, ['slug'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('CaffeRatings', '0008_city_approved_cafes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cafe',
+            name='slug',
+            field=models.SlugField(default='', editable=False, max_length=32),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='city',
+            name='slug',
+            field=models.SlugField(default='', editable=False, max_length=100),
+            preserve_default=False,
+        ),
+        migrations.RunPython(backfill_slugs, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='city',
+            name='slug',
+            field=models.SlugField(editable=False, max_length=100, unique=True),
+        ),
+        migrations.AddConstraint(
+            model_name='cafe',
+            constraint=models.UniqueConstraint(fields=('city', 'slug'), name='unique_cafe_slug_in_city'),
+        ),
+        migrations.AddIndex(
+            model_name='cafe',
+            index=models.Index(fields=['city', 'approved'], name='cafe_city_approved_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='rating',
+            index=models.Index(fields=['cafe', 'category'], name='rating_cafe_category_idx'),
+        ),
+    ]
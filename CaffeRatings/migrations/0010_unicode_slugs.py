@@ -0,0 +1,63 @@
+# Generated by Django 5.1.15 on 2026-10-18 18:40
+
+import re
+from django.db import migrations, models
+from CaffeRatings.slugs import normalize
+
+
+def _reslug(rows, taken, max_length):
+    # rows whose slug still belongs to their name keep it, the others (non-Latin
+    # names stored under the 'city'/'cafe' fallback, "Straße" as "strae") get
+    # the slug the lookups compute now, with -2, -3, ... in id order
+    pending = []
+    for row in rows:
+        base = normalize(row.name)[:max_length].strip('-')
+        if not base or re.fullmatch(rf'{re.escape(base)}(-\d+)?', row.slug):
+            taken.add(row.slug)
+        else:
+            pending.append((row, base))
+    for row, base in pending:
+        slug, number = base, 2
+        while slug in taken:
+            suffix = f'-{number}'
+            slug = f'{base[:max_length - len(suffix)]}{suffix}'
+            number += 1
+        taken.add(slug)
+        row.slug = slug
+    return [row for row, _ in pending]
+
+
+def unicode_slugs(apps, schema_editor):
+    Cafe = apps.get_model('CaffeRatings', 'Cafe')
+    City = apps.get_model('CaffeRatings', 'City')
+
+    cities = _reslug(City.objects.order_by('pk'), set(), 100)
+    City.objects.bulk_update(cities, ['slug'], batch_size=500)
+
+    cafes, by_city = [], {}
+    for cafe in Cafe.objects.order_by('pk'):
+        by_city.setdefault(cafe.city_id, []).append(cafe)
+    for rows in by_city.values():
+        cafes += _reslug(rows, set(), 32)
+    Cafe.objects.bulk_update(cafes, ['slug'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('CaffeRatings', '0009_slugs_and_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='cafe',
+            name='slug',
+            field=models.SlugField(allow_unicode=True, editable=False, max_length=32),
+        ),
+        migrations.AlterField(
+            model_name='city',
+            name='slug',
+            field=models.SlugField(allow_unicode=True, editable=False, max_length=100, unique=True),
+        ),
+        migrations.RunPython(unicode_slugs, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.1.15 on 2026-10-18 19:30
+
+from django.db import migrations, models
+
+
+def rename_duplicates(apps, schema_editor):
+    Category = apps.get_model('CaffeRatings', 'Category')
+
+    # the first category keeps its name, later ones become "Coffee (2)", ...
+    # so their ratings stay where they are
+    taken = set()
+    renamed = []
+    for category in Category.objects.order_by('pk'):
+        name, number = category.name, 2
+        while name in taken:
+            suffix = f' ({number})'
+            name = f'{category.name[:32 - len(suffix)]}{suffix}'
+            number += 1
+        taken.add(name)
+        if name != category.name:
+            category.name = name
+            renamed.append(category)
+    Category.objects.bulk_update(renamed, ['name'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('CaffeRatings', '0010_unicode_slugs'),
+    ]
+
+    operations = [
+        migrations.RunPython(rename_duplicates, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='category',
+            name='name',
+            field=models.CharField(max_length=32, unique=True),
+        ),
+    ]
@@ -1,49 +1,224 @@
-from django.db import models
-# from django.db.models import Avg
+import re
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, Iterator, Tuple
+from django.db import IntegrityError, models, transaction
+from django.db.models import Case, Count, Exists, F, FloatField, IntegerField, OuterRef, Subquery, Value, When
+from django.db.models.functions import Cast, Coalesce, NullIf
 from django.contrib.auth.models import AbstractUser
+from django.core.exceptions import ValidationError
+from . import caching
+from .slugs import normalize
+
+
+CITY_SLUG_LENGTH = 100
+CAFE_SLUG_LENGTH = 32
+
+
+def base_slug(value: str, max_length: int) -> str:
+    # same normalization as the lookups and cache keys, so "Kraków" and
+    # "krakow" share all of them
+    slug = normalize(value)[:max_length].strip('-')
+    if not slug:
+        # no URL could reach it
+        raise ValidationError(f'{value!r} has no letters or digits.', code='no_slug')
+    return slug
+
+
+def unique_slug(value: str, current: str, taken: models.QuerySet, max_length: int) -> str:
+    """
+    Returns the slug for value, keeping current if it still belongs to value
+    and suffixing -2, -3, ... when another row in taken already uses it.
+    """
+    base = base_slug(value, max_length)
+    if current and re.fullmatch(rf'{re.escape(base)}(-\d+)?', current) and not taken.filter(slug=current).exists():
+        return current
+
+    slug, number = base, 2
+    while taken.filter(slug=slug).exists():
+        suffix = f'-{number}'
+        slug = f'{base[:max_length - len(suffix)]}{suffix}'
+        number += 1
+    return slug
+
+
+class CityQuerySet(models.QuerySet):
+    def add_approved_cafes(self, delta: int) -> int:
+        # single UPDATE, display is listed first so that every database
+        # (MySQL included) derives it from the counter before the change
+        updated = self.update(
+            display=Case(When(approved_cafes__gt=-delta, then=Value(True)), default=Value(False)),
+            approved_cafes=F('approved_cafes') + delta,
+        )
+        if updated:
+            caching.invalidate_cities()
+        return updated
+
+    def recount_approved_cafes(self) -> int:
+        # for bulk paths where the individual transitions are unknown
+        approved = Cafe.objects.filter(city=OuterRef('pk'), approved=True)
+        count = approved.order_by().values('city').annotate(count=Count('pk')).values('count')
+        updated = self.update(
+            approved_cafes=Coalesce(Subquery(count), 0),
+            display=Exists(approved),
+        )
+        if updated:
+            caching.invalidate_cities()
+        return updated
+
+    def bulk_create(self, objs: Iterable['City'], *args: Any, **kwargs: Any) -> list:
+        # bulk_create skips City.save, collisions surface as IntegrityError
+        objs = list(objs)
+        for city in objs:
+            city.slug = city.slug or base_slug(city.name, CITY_SLUG_LENGTH)
+        return super().bulk_create(objs, *args, **kwargs)
 
 
 # Create your models here.
 class City(models.Model):
     # cafes are related to this model
     name = models.CharField(max_length=100, unique=True)  # Unique city names
+    # normalized name used by URL lookups and cache keys, set in save
+    slug = models.SlugField(max_length=CITY_SLUG_LENGTH, unique=True, editable=False, allow_unicode=True)
     display = models.BooleanField(default=False)
 
+    # denormalized from Cafe.approved, display is derived from it,
+    # kept up to date by Cafe.save, CafeQuerySet and signals.py
+    approved_cafes = models.PositiveIntegerField(default=0)
+
+    objects = CityQuerySet.as_manager()
+
+    def clean(self) -> None:
+        # reported on the form instead of failing in save
+        if not normalize(self.name):
+            raise ValidationError({'name': 'City name needs at least one letter or digit.'})
+
+    def save(self, *args, **kwargs) -> None:
+        self.slug = unique_slug(self.name, self.slug, City.objects.exclude(pk=self.pk), CITY_SLUG_LENGTH)
+        super().save(*args, **kwargs)
+
     def __str__(self):
         return self.name
 
 
+class CafeQuerySet(models.QuerySet):
+    def with_average_rating(self) -> 'CafeQuerySet':
+        # same value as Cast(Avg('rating__rating'), IntegerField()) but read
+        # from the stored aggregates, so no join or group by is needed
+        average = Cast('rating_sum', FloatField()) / NullIf('rating_count', 0)
+        return self.annotate(average_rating=Cast(average, IntegerField()))
+
+    def add_rating(self, rating_delta: int, count_delta: int) -> int:
+        # single UPDATE, safe against concurrent writers; the callers
+        # invalidate the caches, so the update override is skipped
+        return super().update(
+            rating_sum=F('rating_sum') + rating_delta,
+            rating_count=F('rating_count') + count_delta,
+        )
+
+    @contextmanager
+    def _invalidating(self, cafes: models.QuerySet, recount: bool) -> Iterator[None]:
+        """
+        For bulk writes that skip Cafe.save and its signals: bumps the
+        generations of the cafes and cities before and after the write, and
+        recounts the cities' approved cafes when recount is set.
+        """
+        with transaction.atomic():
+            before = list(cafes.select_for_update().values_list('pk', 'slug', 'city_id'))
+            yield
+            after = self.model.objects.filter(pk__in=[pk for pk, _, _ in before]).values_list('pk', 'slug', 'city_id')
+            touched = {(slug, city_id) for _, slug, city_id in [*before, *after]}
+            cities = City.objects.filter(pk__in={city_id for _, city_id in touched})
+            if recount:
+                cities.recount_approved_cafes()
+            city_slugs = dict(cities.values_list('pk', 'slug'))
+            keys = set()
+            for slug, city_id in touched:
+                keys.update((
+                    caching.city_generation(city_slugs[city_id]),
+                    caching.cafe_generation(city_slugs[city_id], slug),
+                ))
+            if keys:
+                caching.bump_generations(*keys)
+
+    def update(self, **kwargs: Any) -> int:
+        # bulk_update writes its batches through update() too
+        with self._invalidating(self, recount=bool({'approved', 'city', 'city_id'} & kwargs.keys())):
+            updated = super().update(**kwargs)
+        return updated
+
+    def bulk_create(self, objs: Iterable['Cafe'], *args: Any, **kwargs: Any) -> list:
+        objs = list(objs)
+        for cafe in objs:
+            cafe.slug = cafe.slug or base_slug(cafe.name, CAFE_SLUG_LENGTH)
+        with transaction.atomic():
+            created = super().bulk_create(objs, *args, **kwargs)
+            # conflicts may have been ignored, so count what is stored
+            City.objects.filter(pk__in={cafe.city_id for cafe in created}).recount_approved_cafes()
+        return created
+
+
 class Cafe(models.Model):
     # ratings are related to this model
     # comments are related to this model
     name = models.CharField(max_length=16, unique=False)
+    # normalized name, unique within the city, set in save
+    slug = models.SlugField(max_length=CAFE_SLUG_LENGTH, editable=False, allow_unicode=True)
     location = models.CharField(max_length=75)
     image = models.CharField(max_length=120, default=None, blank=True, null=True)
     city = models.ForeignKey(City, related_name='cafes', on_delete=models.CASCADE)
     approved = models.BooleanField(default=False)
 
+    # denormalized from Rating, kept up to date by Rating.save and
+    # the post_delete handler in signals.py
+    rating_sum = models.IntegerField(default=0)
+    rating_count = models.PositiveIntegerField(default=0)
+
+    objects = CafeQuerySet.as_manager()
+
+    def clean(self) -> None:
+        if not normalize(self.name):
+            raise ValidationError({'name': 'Cafe name needs at least one letter or digit.'})
+
     def save(self, *args, **kwargs) -> None:
-        super().save(*args, **kwargs)
+        with transaction.atomic():
+            previous = None
+            if self.pk is not None:
+                previous = Cafe.objects.select_for_update().filter(pk=self.pk).values('city_id', 'approved').first()
 
-        # changes display status of related city
-        if self.city.cafes.filter(approved=True).exists():
-            self.city.display = True
-        else:
-            self.city.display = False
-        self.city.save()
+            taken = Cafe.objects.filter(city_id=self.city_id).exclude(pk=self.pk)
+            self.slug = unique_slug(self.name, self.slug, taken, CAFE_SLUG_LENGTH)
+            super().save(*args, **kwargs)
+
+            # keeps approved_cafes and display of the related cities in sync
+            if previous and previous['approved'] and (not self.approved or previous['city_id'] != self.city_id):
+                City.objects.filter(pk=previous['city_id']).add_approved_cafes(-1)
+            if self.approved and not (previous and previous['approved'] and previous['city_id'] == self.city_id):
+                City.objects.filter(pk=self.city_id).add_approved_cafes(1)
 
     class Meta:
         constraints = [
-            models.UniqueConstraint(fields=['name', 'city'], name='unique_cafe_in_city')
+            models.UniqueConstraint(fields=['name', 'city'], name='unique_cafe_in_city'),
+            models.UniqueConstraint(fields=['city', 'slug'], name='unique_cafe_slug_in_city'),
+        ]
+        indexes = [
+            # approved cafes of a city, used by the city page
+            models.Index(fields=['city', 'approved'], name='cafe_city_approved_idx'),
         ]
 
+    @property
+    def rating_average(self) -> float | None:
+        if not self.rating_count:
+            return None
+        return self.rating_sum / self.rating_count
+
     def __str__(self):
         return f'{self.name} - {self.location}'
 
 
 class Category(models.Model):
     # rating is related to this model
-    name = models.CharField(max_length=32)
+    # unique, rating submissions name their categories
+    name = models.CharField(max_length=32, unique=True)
 
     def __str__(self) -> str:
         return f'{self.name}'
@@ -65,6 +240,44 @@ class Comments(models.Model):
         return f'{self.comment}\n-{self.author} ({self.cafe})'
 
 
+class RatingQuerySet(models.QuerySet):
+    def submit(self, author: 'MineUser', cafe: Cafe, scores: Dict[int, Tuple[int, str]]) -> Tuple[int, int]:
+        """
+        Creates or replaces the author's ratings of a cafe in one upsert.
+        scores maps category ids to (rating, icon). Aggregates and caches are
+        updated once for the whole submission. Returns (created, updated).
+        """
+        with transaction.atomic():
+            previous = dict(
+                self.select_for_update()
+                .filter(author=author, cafe=cafe, category_id__in=scores.keys())
+                .values_list('category_id', 'rating')
+            )
+            self.bulk_create(
+                [
+                    Rating(author=author, cafe=cafe, category_id=category_id, rating=rating, icon=icon)
+                    for category_id, (rating, icon) in scores.items()
+                ],
+                update_conflicts=True,
+                unique_fields=['author', 'cafe', 'category'],
+                update_fields=['rating', 'icon'],
+            )
+
+            created = len(scores) - len(previous)
+            rating_delta = sum(rating for rating, _ in scores.values()) - sum(previous.values())
+            Cafe.objects.filter(pk=cafe.pk).add_rating(rating_delta, created)
+            CafeCategoryScore.objects.add_ratings(
+                cafe.pk,
+                {
+                    category_id: (rating - previous.get(category_id, 0), int(category_id not in previous))
+                    for category_id, (rating, _) in scores.items()
+                },
+            )
+
+            caching.invalidate_cafe(cafe.city.slug, cafe.slug)
+        return created, len(previous)
+
+
 class Rating(models.Model):
     category = models.ForeignKey(Category, on_delete=models.CASCADE)
     author = models.ForeignKey(MineUser, on_delete=models.CASCADE)
@@ -73,6 +286,109 @@ class Rating(models.Model):
     icon = models.CharField(max_length=10)
     rating = models.IntegerField(default=0)
 
+    objects = RatingQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            # one rating per author and category of a cafe, duplicates would skew averages
+            models.UniqueConstraint(fields=['author', 'cafe', 'category'], name='unique_rating_per_author')
+        ]
+        indexes = [
+            models.Index(fields=['cafe', 'category'], name='rating_cafe_category_idx'),
+        ]
+
+    def save(self, *args, **kwargs) -> None:
+        with transaction.atomic():
+            previous = None
+            if self.pk is not None:
+                previous = Rating.objects.select_for_update().filter(pk=self.pk).values('cafe_id', 'category_id', 'rating').first()
+
+            super().save(*args, **kwargs)
+
+            # keeps aggregates on Cafe and CafeCategoryScore in sync with this row
+            if previous and (previous['cafe_id'], previous['category_id']) == (self.cafe_id, self.category_id):
+                update_rating_aggregates(self.cafe_id, self.category_id, self.rating - previous['rating'], 0)
+            else:
+                if previous:
+                    update_rating_aggregates(previous['cafe_id'], previous['category_id'], -previous['rating'], -1)
+                update_rating_aggregates(self.cafe_id, self.category_id, self.rating, 1)
+
     def __str__(self) -> str:
         return f'{self.cafe} {self.category}{self.icon}- {self.rating}/{self.author}'
-     
\ No newline at end of file
+     
+
+class CafeCategoryScoreQuerySet(models.QuerySet):
+    def add_rating(self, cafe_id: int, category_id: int, rating_delta: int, count_delta: int) -> None:
+        lookup = self.filter(cafe_id=cafe_id, category_id=category_id)
+        values = {
+            'rating_sum': F('rating_sum') + rating_delta,
+            'rating_count': F('rating_count') + count_delta,
+        }
+        # nothing to create when removing, the row may already be gone in a cascade delete
+        if lookup.update(**values) or count_delta <= 0:
+            return
+
+        # first rating of this category, a concurrent writer may create the row first
+        try:
+            with transaction.atomic():
+                self.create(cafe_id=cafe_id, category_id=category_id, rating_sum=rating_delta, rating_count=count_delta)
+        except IntegrityError:
+            lookup.update(**values)
+
+
+    def add_ratings(self, cafe_id: int, deltas: Dict[int, Tuple[int, int]]) -> None:
+        """
+        add_rating for several categories of a cafe in two queries, deltas maps
+        category ids to (rating_delta, count_delta). Missing rows are created
+        empty first, so a concurrent writer can not make the update miss them.
+        """
+        missing = [category_id for category_id, (_, count_delta) in deltas.items() if count_delta > 0]
+        if missing:
+            self.bulk_create(
+                [CafeCategoryScore(cafe_id=cafe_id, category_id=category_id) for category_id in missing],
+                ignore_conflicts=True,
+            )
+
+        def per_category(index: int) -> Case:
+            whens = [When(category_id=category_id, then=Value(delta[index])) for category_id, delta in deltas.items()]
+            return Case(*whens, default=Value(0), output_field=IntegerField())
+
+        self.filter(cafe_id=cafe_id, category_id__in=deltas.keys()).update(
+            rating_sum=F('rating_sum') + per_category(0),
+            rating_count=F('rating_count') + per_category(1),
+        )
+
+
+class CafeCategoryScore(models.Model):
+    # denormalized from Rating, one row per rated category of a cafe
+    cafe = models.ForeignKey(Cafe, related_name='category_scores', on_delete=models.CASCADE)
+    category = models.ForeignKey(Category, on_delete=models.CASCADE)
+
+    rating_sum = models.IntegerField(default=0)
+    rating_count = models.PositiveIntegerField(default=0)
+
+    objects = CafeCategoryScoreQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['cafe', 'category'], name='unique_category_score')
+        ]
+
+    @property
+    def rating_average(self) -> float | None:
+        if not self.rating_count:
+            return None
+        return self.rating_sum / self.rating_count
+
+    def __str__(self) -> str:
+        return f'{self.cafe} {self.category} - {self.rating_sum}/{self.rating_count}'
+
+
+def update_rating_aggregates(cafe_id: int, category_id: int, rating_delta: int, count_delta: int) -> None:
+    Cafe.objects.filter(pk=cafe_id).add_rating(rating_delta, count_delta)
+    CafeCategoryScore.objects.add_rating(cafe_id, category_id, rating_delta, count_delta)
+
+    # city listings show the average, so both generations move
+    slugs = Cafe.objects.filter(pk=cafe_id).values_list('city__slug', 'slug').first()
+    if slugs:
+        caching.invalidate_cafe(*slugs)
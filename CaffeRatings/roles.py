@@ -0,0 +1,36 @@
+"""
+Roles derived from group membership: admin, cafe_owner or basic.
+
+A role is resolved with one query over all group names of the user and
+cached under a generation per user, which the signals bump whenever the
+user's groups or the name of one of them change.
+"""
+from typing import Iterable, Optional
+from . import caching
+
+
+ADMIN = 'admin'
+CAFE_OWNER = 'cafe_owner'
+BASIC = 'basic'
+
+# groups granting a role, the first one the user is in wins
+ROLE_GROUPS = (ADMIN, CAFE_OWNER)
+
+
+def resolve(group_names: Iterable[str]) -> str:
+    names = set(group_names)
+    return next((role for role in ROLE_GROUPS if role in names), BASIC)
+
+
+def get_role(user) -> Optional[str]:
+    """
+    Role of an authenticated user, None for anonymous users.
+    """
+    if user is None or not user.is_authenticated:
+        return None
+    return caching.get_or_compute(
+        'role',
+        [user.pk],
+        [caching.role_generation(user.pk)],
+        lambda: resolve(user.groups.values_list('name', flat=True)),
+    )
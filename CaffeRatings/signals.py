@@ -0,0 +1,86 @@
+from django.contrib.auth.models import Group
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+from . import caching
+from .models import Cafe, City, MineUser, Rating, update_rating_aggregates
+
+
+# covers instance, queryset and cascade deletes; creation and updates
+# are handled in Rating.save
+@receiver(post_delete, sender=Rating)
+def remove_rating_from_aggregates(sender, instance: Rating, origin=None, **kwargs) -> None:
+    # the aggregates are deleted along with a cafe or city, one update per rating would be wasted
+    if getattr(origin, 'model', type(origin)) in (Cafe, City):
+        return
+    update_rating_aggregates(instance.cafe_id, instance.category_id, -instance.rating, -1)
+
+
+# same for approved cafes counted on City, updates are handled in Cafe.save
+@receiver(post_delete, sender=Cafe)
+def remove_cafe_from_city(sender, instance: Cafe, **kwargs) -> None:
+    if instance.approved:
+        City.objects.filter(pk=instance.city_id).add_approved_cafes(-1)
+
+
+# renames have to invalidate the keys of the old slug as well
+@receiver(pre_save, sender=City)
+def remember_city_slug(sender, instance: City, **kwargs) -> None:
+    instance._previous_slug = None
+    if instance.pk is not None:
+        instance._previous_slug = City.objects.filter(pk=instance.pk).values_list('slug', flat=True).first()
+
+
+@receiver(pre_save, sender=Cafe)
+def remember_cafe_slug(sender, instance: Cafe, **kwargs) -> None:
+    instance._previous_slugs = None
+    if instance.pk is not None:
+        instance._previous_slugs = Cafe.objects.filter(pk=instance.pk).values_list('city__slug', 'slug').first()
+
+
+@receiver(post_save, sender=City)
+@receiver(post_delete, sender=City)
+def invalidate_city(sender, instance: City, **kwargs) -> None:
+    caching.invalidate_city(instance.slug)
+    previous = getattr(instance, '_previous_slug', None)
+    if previous and previous != instance.slug:
+        caching.invalidate_city(previous)
+
+
+@receiver(post_save, sender=Cafe)
+@receiver(post_delete, sender=Cafe)
+def invalidate_cafe(sender, instance: Cafe, **kwargs) -> None:
+    city = City.objects.filter(pk=instance.city_id).values_list('slug', flat=True).first()
+    if city:
+        caching.invalidate_cafe(city, instance.slug)
+    previous = getattr(instance, '_previous_slugs', None)
+    if previous and previous != (city, instance.slug):
+        caching.invalidate_cafe(*previous)
+
+
+# roles are cached per user, see roles.get_role
+@receiver(m2m_changed, sender=MineUser.groups.through)
+def invalidate_roles_on_membership(sender, instance, action: str, reverse: bool, pk_set, **kwargs) -> None:
+    # reverse: the group's user_set changed, pk_set holds user ids
+    if action == 'pre_clear' and reverse:
+        instance._cleared_members = list(instance.user_set.values_list('pk', flat=True))
+    elif action in ('post_add', 'post_remove'):
+        caching.invalidate_roles(pk_set if reverse else [instance.pk])
+    elif action == 'post_clear':
+        caching.invalidate_roles(getattr(instance, '_cleared_members', []) if reverse else [instance.pk])
+
+
+@receiver(post_save, sender=Group)
+def invalidate_roles_on_rename(sender, instance: Group, created: bool, **kwargs) -> None:
+    if not created:
+        caching.invalidate_roles(instance.user_set.values_list('pk', flat=True))
+
+
+# a cascade removes the memberships without m2m_changed
+@receiver(pre_delete, sender=Group)
+def remember_group_members(sender, instance: Group, **kwargs) -> None:
+    instance._members = list(instance.user_set.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Group)
+def invalidate_roles_on_delete(sender, instance: Group, **kwargs) -> None:
+    caching.invalidate_roles(getattr(instance, '_members', []))
@@ -0,0 +1,22 @@
+"""
+The one normalization of city and cafe names, used for the stored slugs, the
+URL lookups and the cache keys alike, so every stored name can be looked up.
+
+Latin accents are folded ("Kraków" -> "krakow"), other scripts are kept
+("Москва" -> "москва"). Names without letters or digits ("!!!") normalize
+to an empty string and are rejected when they would be stored.
+"""
+import unicodedata
+from typing import Any
+from django.utils.text import slugify
+
+
+def _fold(char: str) -> str:
+    # the ASCII letters of a decomposed character, or the character itself
+    # when it has none (Cyrillic, CJK, ...)
+    return unicodedata.normalize('NFKD', char).encode('ascii', 'ignore').decode('ascii') or char
+
+
+def normalize(value: Any) -> str:
+    composed = unicodedata.normalize('NFC', str(value))
+    return slugify(''.join(_fold(char) for char in composed), allow_unicode=True)
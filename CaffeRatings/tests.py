@@ -1,6 +1,30 @@
-from django.test import TestCase
+import json
+import tempfile
+import time
+from io import StringIO
+from pathlib import Path
+from unittest import mock
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.core.cache import cache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.cache.utils import make_template_fragment_key
+from django.core.exceptions import ValidationError
+from django.db.utils import ConnectionHandler
 from django.contrib.auth import get_user_model
-from django.urls import reverse
+from django.contrib.auth.models import AnonymousUser, Group
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db.models import Avg, IntegerField
+from django.db.models.functions import Cast
+from django.http import HttpRequest, HttpResponse
+from django.urls import resolve, reverse
+from API import payloads
+from CaffeReviewer import databases, replicas
+from CaffeReviewer.cache_backends import TwoTierCache
+from CaffeReviewer.replicas import STICKY_COOKIE, ReplicaMiddleware, ReplicaRouter
+from CaffeReviewer.slow_queries import fingerprint, read_log
+from CaffeReviewer.testing import QueryBudgetMixin
+from . import caching, roles
 from .models import *
 
 
@@ -132,3 +156,859 @@ class OverallTestCase(TestCase):
         self.assertNotContains(response, 'Test 2 cafe 2')
         self.assertNotContains(response, 'Test 3 cafe 3')
 
+
+
+class SlugTestCase(TestCase):
+    def test_slugs_are_unique(self) -> None:
+        city = City.objects.create(name='Kraków')
+        other = City.objects.create(name='KRAKOW')
+        self.assertEqual((city.slug, other.slug), ('krakow', 'krakow-2'))
+
+        first = Cafe.objects.create(name='Cafe Nero', location='here', city=city)
+        second = Cafe.objects.create(name='cafe nero!', location='there', city=city)
+        moved = Cafe.objects.create(name='Cafe nero', location='there', city=other)
+        self.assertEqual((first.slug, second.slug, moved.slug), ('cafe-nero', 'cafe-nero-2', 'cafe-nero'))
+
+        # kept on unrelated saves, follows renames
+        second.save()
+        self.assertEqual(second.slug, 'cafe-nero-2')
+        first.name = 'Nero'
+        first.save()
+        self.assertEqual(first.slug, 'nero')
+
+    def test_slugs_are_reachable(self) -> None:
+        # other scripts are kept, the lookups normalize the same way
+        city = City.objects.create(name='Москва')
+        self.assertEqual(city.slug, 'москва')
+        self.assertEqual(caching.city_generation('МОСКВА'), 'generation:city:москва')
+        self.assertNotEqual(caching.city_generation('Киев'), caching.city_generation('Москва'))
+
+        # no fallback slug that no URL could produce
+        with self.assertRaises(ValidationError):
+            City.objects.create(name='!!!')
+        with self.assertRaises(ValidationError):
+            Cafe.objects.create(name='???', location='here', city=city)
+        with self.assertRaises(ValidationError):
+            City(name='!!!').full_clean()
+
+    def test_other_models_validate(self) -> None:
+        # only City and Cafe have names to check, the rest clean as before
+        city = City.objects.create(name='Clean City')
+        cafe = Cafe.objects.create(name='Clean Cafe', location='here', city=city)
+        author = get_user_model().objects.create_user(username='cleaner', password='password')
+        rating = Rating(cafe=cafe, author=author, category=Category.objects.create(name='Clean'), rating=4, icon='star')
+        rating.full_clean()
+        cafe.full_clean()
+
+
+class CityDisplayTestCase(TestCase):
+    def setUp(self) -> None:
+        self.city = City.objects.create(name='Display City')
+        self.other_city = City.objects.create(name='Other Display City')
+
+    def assertDisplay(self, city: City, approved_cafes: int) -> None:
+        city.refresh_from_db()
+        self.assertEqual((city.approved_cafes, city.display), (approved_cafes, approved_cafes > 0))
+
+    def test_save_and_delete(self) -> None:
+        cafe = Cafe.objects.create(name='Display cafe', location='here', city=self.city)
+        self.assertDisplay(self.city, 0)
+
+        cafe.approved = True
+        cafe.save()
+        cafe.save()
+        self.assertDisplay(self.city, 1)
+
+        cafe.city = self.other_city
+        cafe.save()
+        self.assertDisplay(self.city, 0)
+        self.assertDisplay(self.other_city, 1)
+
+        cafe.delete()
+        self.assertDisplay(self.other_city, 0)
+
+    def test_bulk_paths(self) -> None:
+        Cafe.objects.bulk_create([
+            Cafe(name=f'Bulk {i}', location='here', city=self.city, approved=i % 2 == 0) for i in range(4)
+        ])
+        self.assertDisplay(self.city, 2)
+
+        Cafe.objects.filter(approved=False).update(approved=True)
+        self.assertDisplay(self.city, 4)
+
+        Cafe.objects.filter(name__in=['Bulk 0', 'Bulk 1']).update(city=self.other_city)
+        self.assertDisplay(self.city, 2)
+        self.assertDisplay(self.other_city, 2)
+
+        Cafe.objects.filter(city=self.city).delete()
+        self.assertDisplay(self.city, 0)
+
+    def test_bulk_updates_invalidate_pages(self) -> None:
+        cache.clear()
+        kept = Cafe.objects.create(name='Kept cafe', location='here', city=self.city, approved=True)
+        hidden = Cafe.objects.create(name='Hidden cafe', location='here', city=self.city, approved=True)
+        page, api = reverse('city', args=[self.city.name]), reverse('city-cafes', args=[self.city.name])
+        self.assertContains(self.client.get(page), 'Hidden cafe')
+        self.assertContains(self.client.get(api), 'Hidden cafe')
+
+        Cafe.objects.filter(pk=hidden.pk).update(approved=False)
+        self.assertNotContains(self.client.get(page), 'Hidden cafe')
+        self.assertContains(self.client.get(api), '"approved":false')
+
+        Cafe.objects.filter(pk=kept.pk).update(location='moved')
+        self.assertContains(self.client.get(api), 'moved')
+
+        kept.location = 'moved again'
+        Cafe.objects.bulk_update([kept], ['location'])
+        self.assertContains(self.client.get(api), 'moved again')
+
+
+class EmptyCityTestCase(TestCase):
+    def setUp(self) -> None:
+        cache.clear()
+        self.city = City.objects.create(name='Empty City')
+
+    def test_city_load_serves_marker(self) -> None:
+        url = reverse('city', args=[self.city.name])
+        self.assertEqual(self.client.get(url).status_code, 404)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(url).status_code, 404)
+        self.assertTrue(City.objects.filter(pk=self.city.pk).exists())
+
+        Cafe.objects.create(name='New cafe', location='here', city=self.city, approved=True)
+        self.assertContains(self.client.get(url), 'New cafe')
+
+    def test_prune_empty_cities(self) -> None:
+        kept = City.objects.create(name='Kept City')
+        Cafe.objects.create(name='Unapproved', location='here', city=kept)
+
+        out = StringIO()
+        call_command('prune_empty_cities', '--dry-run', stdout=out)
+        self.assertIn('Empty City', out.getvalue())
+        self.assertTrue(City.objects.filter(pk=self.city.pk).exists())
+
+        out = StringIO()
+        call_command('prune_empty_cities', '--batch-size', '1', stdout=out)
+        self.assertIn('1 empty city(ies) deleted.', out.getvalue())
+        self.assertEqual(list(City.objects.values_list('name', flat=True)), ['Kept City'])
+
+
+class HTMLCacheTestCase(TestCase):
+    def setUp(self) -> None:
+        cache.clear()
+        self.city = City.objects.create(name='Html City')
+        self.cafe = Cafe.objects.create(name='Html cafe', location='here', city=self.city, approved=True)
+        self.other_cafe = Cafe.objects.create(name='Other html cafe', location='there', city=self.city, approved=True)
+        self.user = get_user_model().objects.create_user(username='htmluser', password='securepassword')
+        self.url = reverse('city', args=[self.city.name])
+
+    def card_key(self, cafe: Cafe) -> str:
+        version = caching.get_generations([caching.cafe_generation(self.city.name, cafe.name)])[0]
+        return make_template_fragment_key('cafe-card', [cafe.pk, version])
+
+    def test_anonymous_page_cached(self) -> None:
+        self.assertContains(self.client.get(self.url), 'Html cafe')
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url)
+        self.assertContains(response, 'Login')
+
+        self.client.get(reverse('index'))
+        with self.assertNumQueries(0):
+            self.assertContains(self.client.get(reverse('index')), 'Html City')
+
+    def test_title_is_the_stored_name(self) -> None:
+        # another spelling of the same slug fills the shared page first
+        self.client.get(reverse('city', args=['HTML CITY!!!']))
+        response = self.client.get(self.url)
+        self.assertContains(response, '<title>Html City')
+        self.assertNotContains(response, 'HTML CITY!!!')
+
+    def test_rating_rebuilds_only_its_card(self) -> None:
+        self.client.get(self.url)
+        other_card = cache.get(self.card_key(self.other_cafe))
+        self.assertIsNotNone(other_card)
+
+        category = Category.objects.create(name='Coffee')
+        Rating.objects.create(category=category, author=self.user, cafe=self.cafe, icon='star', rating=3)
+        self.assertIsNone(cache.get(self.card_key(self.cafe)))
+
+        with mock.patch.object(cache, 'set', wraps=cache.set) as cache_set:
+            response = self.client.get(self.url)
+        written = [call.args[0] for call in cache_set.call_args_list]
+        self.assertIn(self.card_key(self.cafe), written)
+        self.assertNotIn(self.card_key(self.other_cafe), written)
+        self.assertEqual(response.content.decode().count('bi-star-fill'), 3)
+
+    def test_logged_in_navigation(self) -> None:
+        self.client.get(self.url)
+        self.client.force_login(self.user)
+        response = self.client.get(self.url)
+
+        self.assertContains(response, 'Logout')
+        self.assertNotContains(response, 'Register')
+        self.assertContains(response, 'Other html cafe')
+
+
+class QueryBudgetTestCase(QueryBudgetMixin, TestCase):
+    urlconf = 'CaffeRatings.urls'
+    budgets = {
+        # logged in users add the session and user lookups
+        'index': 3,
+        'city': 3,
+        'login': 9,
+        'registration': 2,
+        'account_settings': 0,
+        'logout': 4,
+    }
+
+    def setUp(self) -> None:
+        self.city = City.objects.create(name='Budget City')
+        self.user = get_user_model().objects.create_user(username='budgetuser', password='securepassword')
+        self.created = 0
+
+    def add_cafes(self, count: int) -> None:
+        category = Category.objects.get_or_create(name='Coffee')[0]
+        start = Cafe.objects.count()
+        for index in range(count):
+            cafe = Cafe.objects.create(name=f'Cafe {start + index}', location='here', city=self.city, approved=True)
+            Rating.objects.create(category=category, author=self.user, cafe=cafe, icon='star', rating=4)
+
+    def add_cities(self, count: int) -> None:
+        start = City.objects.count()
+        for index in range(count):
+            city = City.objects.create(name=f'City {start + index}')
+            Cafe.objects.create(name='Cafe', location='here', city=city, approved=True)
+
+    def test_index(self) -> None:
+        self.assertQueryBudget('index', lambda: self.client.get(reverse('index')), self.add_cities)
+        self.client.force_login(self.user)
+        self.assertQueryBudget('index', lambda: self.client.get(reverse('index')), self.add_cities)
+
+    def test_city(self) -> None:
+        url = reverse('city', args=[self.city.name])
+        self.assertQueryBudget('city', lambda: self.client.get(url), self.add_cafes)
+        self.client.force_login(self.user)
+        self.assertQueryBudget('city', lambda: self.client.get(url), self.add_cafes)
+
+    def test_login(self) -> None:
+        self.assertQueryBudget('login', lambda: self.client.get(reverse('login')))
+        credentials = {'username': 'budgetuser', 'password': 'securepassword'}
+        self.assertQueryBudget(
+            'login', lambda: self.client.post(reverse('login'), credentials), lambda count: self.client.logout()
+        )
+
+    def test_registration(self) -> None:
+        self.assertQueryBudget('registration', lambda: self.client.get(reverse('registration')))
+        def register():
+            self.created += 1
+            data = {'username': f'new{self.created}', 'email': 'new@example.com', 'password1': 'pass', 'password2': 'pass'}
+            return self.client.post(reverse('registration'), data)
+        self.assertQueryBudget('registration', register)
+
+    def test_account_and_logout(self) -> None:
+        # the account page has no content yet, only the redirect of anonymous users is measured
+        self.assertQueryBudget('account_settings', lambda: self.client.get(reverse('account_settings')))
+        self.assertQueryBudget(
+            'logout', lambda: self.client.get(reverse('logout')), lambda count: self.client.force_login(self.user)
+        )
+
+
+class RoleTestCase(TestCase):
+    def setUp(self) -> None:
+        cache.clear()
+        self.user = get_user_model().objects.create_user(username='roleuser', password='securepassword')
+        self.admin = Group.objects.create(name='admin')
+        self.owner = Group.objects.create(name='cafe_owner')
+
+    def test_resolved_once(self) -> None:
+        self.user.groups.add(self.owner, Group.objects.create(name='other'))
+        with self.assertNumQueries(1):
+            self.assertEqual(roles.get_role(self.user), roles.CAFE_OWNER)
+        with self.assertNumQueries(0):
+            self.assertEqual(roles.get_role(self.user), roles.CAFE_OWNER)
+        self.assertIsNone(roles.get_role(AnonymousUser()))
+
+    def test_invalidated_by_membership(self) -> None:
+        self.assertEqual(roles.get_role(self.user), roles.BASIC)
+        self.user.groups.add(self.owner)
+        self.assertEqual(roles.get_role(self.user), roles.CAFE_OWNER)
+        self.admin.user_set.add(self.user)
+        self.assertEqual(roles.get_role(self.user), roles.ADMIN)
+        self.admin.user_set.remove(self.user)
+        self.assertEqual(roles.get_role(self.user), roles.CAFE_OWNER)
+        self.owner.user_set.clear()
+        self.assertEqual(roles.get_role(self.user), roles.BASIC)
+
+        self.user.groups.set([self.admin])
+        self.assertEqual(roles.get_role(self.user), roles.ADMIN)
+        self.user.groups.clear()
+        self.assertEqual(roles.get_role(self.user), roles.BASIC)
+
+    def test_invalidated_by_group_changes(self) -> None:
+        self.user.groups.add(self.admin)
+        self.assertEqual(roles.get_role(self.user), roles.ADMIN)
+        self.admin.name = 'former admin'
+        self.admin.save()
+        self.assertEqual(roles.get_role(self.user), roles.BASIC)
+
+        self.user.groups.add(self.owner)
+        self.assertEqual(roles.get_role(self.user), roles.CAFE_OWNER)
+        self.owner.delete()
+        self.assertEqual(roles.get_role(self.user), roles.BASIC)
+
+
+class SlowQueryTestCase(TestCase):
+    def test_fingerprint(self) -> None:
+        self.assertEqual(
+            fingerprint("SELECT * FROM cafe WHERE id IN (1, 2, 3) AND name = 'a'"),
+            fingerprint("select *  from cafe where id in (%s, %s) and name = %s"),
+        )
+
+    def test_log_and_command(self) -> None:
+        cache.clear()
+        city = City.objects.create(name='Slow City')
+        Cafe.objects.create(name='Slow cafe', location='here', city=city, approved=True)
+
+        with tempfile.TemporaryDirectory() as directory:
+            log = Path(directory) / 'slow.jsonl'
+            with self.settings(SLOW_QUERY_THRESHOLD_MS=0, SLOW_QUERY_SAMPLE_RATE=1.0, SLOW_QUERY_LOG=log):
+                # middleware is loaded on the first request of a client
+                self.client_class().get(reverse('city', args=[city.name]))
+
+            entries = read_log(log)
+            out = StringIO()
+            call_command('slow_queries', '--plans', '--log', str(log), stdout=out)
+
+        self.assertEqual(len(entries), 1)
+        self.assertEqual(entries[0]['view'], 'city')
+        self.assertIn('slow-city', entries[0]['params'])
+        self.assertTrue(entries[0]['plan'])
+        self.assertIn(f"{entries[0]['fingerprint']}: 1x", out.getvalue())
+        self.assertIn('1 slow queries in 1 group(s).', out.getvalue())
+
+
+class RatingAggregateTestCase(TestCase):
+    def setUp(self) -> None:
+        self.city = City.objects.create(name='Aggregate City')
+        self.cafe = Cafe.objects.create(name='Aggregate cafe', location='here', city=self.city, approved=True)
+        self.other_cafe = Cafe.objects.create(name='Other cafe', location='there', city=self.city, approved=True)
+        self.category = Category.objects.create(name='Coffee')
+        self.user = get_user_model().objects.create_user(username='aggregateuser', password='securepassword')
+        self.raters = 0
+
+    def rate(self, value: int, cafe: Cafe = None) -> Rating:
+        # a new author every time, authors rate a category of a cafe only once
+        self.raters += 1
+        author = get_user_model().objects.create_user(username=f'rater{self.raters}')
+        return Rating.objects.create(category=self.category, author=author, cafe=cafe or self.cafe, icon='star', rating=value)
+
+    def assertAggregates(self, cafe: Cafe, rating_sum: int, rating_count: int) -> None:
+        cafe.refresh_from_db()
+        self.assertEqual((cafe.rating_sum, cafe.rating_count), (rating_sum, rating_count))
+
+    def test_create_update_delete(self) -> None:
+        rating = self.rate(4)
+        self.rate(3)
+        self.assertAggregates(self.cafe, 7, 2)
+        self.assertEqual(self.cafe.rating_average, 3.5)
+
+        rating.rating = 1
+        rating.save()
+        self.assertAggregates(self.cafe, 4, 2)
+
+        rating.cafe = self.other_cafe
+        rating.save()
+        self.assertAggregates(self.cafe, 3, 1)
+        self.assertAggregates(self.other_cafe, 1, 1)
+
+        rating.delete()
+        self.assertAggregates(self.other_cafe, 0, 0)
+        self.assertIsNone(self.other_cafe.rating_average)
+
+        Rating.objects.filter(cafe=self.cafe).delete()
+        self.assertAggregates(self.cafe, 0, 0)
+
+    def test_category_scores(self) -> None:
+        service = Category.objects.create(name='Service')
+        rating = self.rate(4)
+        self.rate(2)
+        Rating.objects.create(category=service, author=self.user, cafe=self.cafe, icon='star', rating=5)
+
+        coffee = CafeCategoryScore.objects.get(cafe=self.cafe, category=self.category)
+        self.assertEqual((coffee.rating_sum, coffee.rating_count), (6, 2))
+
+        rating.category = service
+        rating.save()
+        scores = {score.category_id: (score.rating_sum, score.rating_count) for score in self.cafe.category_scores.all()}
+        self.assertEqual(scores, {self.category.pk: (2, 1), service.pk: (9, 2)})
+
+        # cascades remove ratings and scores together
+        self.cafe.delete()
+        self.assertFalse(CafeCategoryScore.objects.exists())
+
+    def test_matches_annotated_average(self) -> None:
+        self.rate(5)
+        self.rate(2)
+        self.rate(3, cafe=self.other_cafe)
+
+        expected = Cafe.objects.annotate(expected=Cast(Avg('rating__rating'), IntegerField())).order_by('pk')
+        stored = Cafe.objects.with_average_rating().order_by('pk')
+        self.assertEqual(
+            [cafe.expected for cafe in expected],
+            [cafe.average_rating for cafe in stored],
+        )
+
+    def test_rebuild_command(self) -> None:
+        self.rate(5)
+        Cafe.objects.filter(pk=self.cafe.pk).update(rating_sum=100, rating_count=7)
+        CafeCategoryScore.objects.all().delete()
+
+        with self.assertRaises(CommandError):
+            call_command('rebuild_rating_aggregates', '--check', stdout=StringIO())
+
+        out = StringIO()
+        call_command('rebuild_rating_aggregates', stdout=out)
+        self.assertIn('2 drifted aggregate(s) fixed.', out.getvalue())
+        self.assertAggregates(self.cafe, 5, 1)
+        self.assertEqual(CafeCategoryScore.objects.get(cafe=self.cafe).rating_sum, 5)
+
+        call_command('rebuild_rating_aggregates', '--check', stdout=StringIO())
+
+
+class PayloadCacheTestCase(TestCase):
+    def setUp(self) -> None:
+        caching.flush_stats()
+        cache.clear()
+        self.generations = [caching.city_generation('Cache City')]
+        self.calls = 0
+
+    def compute(self) -> str:
+        self.calls += 1
+        return f'payload {self.calls}'
+
+    def get(self, **kwargs) -> str:
+        return caching.get_or_compute('test', ['Cache City'], self.generations, self.compute, **kwargs)
+
+    def test_hit_and_invalidation(self) -> None:
+        self.assertEqual(self.get(), 'payload 1')
+        self.assertEqual(self.get(), 'payload 1')
+
+        caching.invalidate_city('Cache City')
+        self.assertEqual(self.get(), 'payload 2')
+
+        stats = caching.get_stats(['test'])['test']
+        self.assertEqual((stats['hit'], stats['recompute']), (1, 2))
+
+    def test_serves_stale_while_rebuilding(self) -> None:
+        self.get()
+        caching.invalidate_city('Cache City')
+        # another worker holds the recompute lock
+        cache.add(f'lock:{caching.make_key("test", "Cache City")}', 1)
+
+        self.assertEqual(self.get(serve_stale=True), 'payload 1')
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(caching.get_stats(['test'])['test']['stale'], 1)
+
+        # without stale serving it waits for the rebuild and finally computes itself
+        with mock.patch.object(caching, 'LOCK_WAIT', 0.1):
+            self.assertEqual(self.get(), 'payload 2')
+
+    def test_early_refresh(self) -> None:
+        self.get()
+        key = caching.make_key('test', 'Cache City')
+        envelope = cache.get(key)
+        # built slowly and about to expire, so the next read refreshes it
+        envelope.update(expires=time.time() + 1, delta=60)
+        cache.set(key, envelope)
+
+        self.assertEqual(self.get(), 'payload 2')
+        self.assertEqual(caching.get_stats(['test'])['test']['early'], 1)
+
+    def test_generation_keys_expire(self) -> None:
+        # checked on the calls, backends keep their own clocks
+        key = caching.city_generation('random0')
+        with mock.patch.object(caching, 'cache', wraps=cache) as spy:
+            caching.get_versions([key])
+        self.assertEqual(
+            {call.args[0]: call.kwargs['timeout'] for call in spy.add.call_args_list},
+            {key: caching.GENERATION_TIMEOUT, f'{key}:modified': caching.GENERATION_TIMEOUT},
+        )
+
+        # a bump starts the timeout again, incr alone keeps the old expiry
+        with mock.patch.object(caching, 'cache', wraps=cache) as spy:
+            caching.bump_generations(key)
+        spy.touch.assert_called_once_with(key, caching.GENERATION_TIMEOUT)
+        spy.set_many.assert_called_once_with(mock.ANY, timeout=caching.GENERATION_TIMEOUT)
+        self.assertEqual(list(spy.set_many.call_args.args[0]), [f'{key}:modified'])
+
+
+class FakeRedisCache(LocMemCache):
+    # shared between instances with the same location, like a Redis server
+    down = False
+
+    def _check(self) -> None:
+        if FakeRedisCache.down:
+            raise ConnectionError('fake redis is down')
+
+    def get(self, *args, **kwargs):
+        self._check()
+        return super().get(*args, **kwargs)
+
+    def get_many(self, *args, **kwargs):
+        self._check()
+        return super().get_many(*args, **kwargs)
+
+    def set(self, *args, **kwargs):
+        self._check()
+        return super().set(*args, **kwargs)
+
+    def add(self, *args, **kwargs):
+        self._check()
+        return super().add(*args, **kwargs)
+
+    def incr(self, *args, **kwargs):
+        self._check()
+        return super().incr(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        self._check()
+        return super().delete(*args, **kwargs)
+
+
+class TwoTierCacheTestCase(SimpleTestCase):
+    def setUp(self) -> None:
+        FakeRedisCache.down = False
+        self.worker1 = self.make_worker()
+        self.worker2 = self.make_worker()
+        self.worker1.clear()
+
+    def tearDown(self) -> None:
+        FakeRedisCache.down = False
+
+    def make_worker(self, **options) -> TwoTierCache:
+        options = {
+            'REMOTE_BACKEND': 'CaffeRatings.tests.FakeRedisCache',
+            'VERSION_CHECK_INTERVAL': 0,
+            'RETRY_INTERVAL': 0,
+            **options,
+        }
+        return TwoTierCache('two-tier-tests', {'OPTIONS': options})
+
+    def test_reads_from_local_tier(self) -> None:
+        self.worker1.set('key', 'value')
+        with mock.patch.object(FakeRedisCache, 'get_many', side_effect=AssertionError) as remote_get_many:
+            self.assertEqual(self.worker1.get_many(['key']), {'key': 'value'})
+        remote_get_many.assert_not_called()
+
+    def test_cross_worker_invalidation(self) -> None:
+        self.worker1.set('key', 'value')
+        self.assertEqual(self.worker2.get('key'), 'value')
+
+        self.worker1.delete('key')
+        self.assertIsNone(self.worker2.get('key'))
+
+        self.worker2.set('counter', 1)
+        self.assertEqual(self.worker1.get('counter'), 1)
+        self.worker2.incr('counter')
+        self.assertEqual(self.worker1.get('counter'), 2)
+
+    def test_falls_back_to_local_tier(self) -> None:
+        self.worker1.set('counter', 1)
+        FakeRedisCache.down = True
+
+        with self.assertLogs('CaffeReviewer.cache_backends', 'WARNING'):
+            self.assertEqual(self.worker1.get('counter'), 1)
+            self.assertEqual(self.worker1.incr('counter'), 2)
+            self.assertTrue(self.worker1.add('lock:key', 1))
+            self.assertFalse(self.worker1.add('lock:key', 1))
+            self.assertEqual(self.worker1.get_many(['lock:key', 'counter']), {'lock:key': 1, 'counter': 2})
+            self.assertIsNone(self.worker2.get('missing'))
+
+        # once the shared cache is back the local tier is discarded
+        FakeRedisCache.down = False
+        self.assertEqual(self.worker1.get('counter'), 1)
+
+    def test_degraded_entries_expire_soon(self) -> None:
+        worker = self.make_worker(LOCAL_TIMEOUT=5, DEGRADED_TIMEOUT=2)
+        FakeRedisCache.down = True
+        with self.assertLogs('CaffeReviewer.cache_backends', 'WARNING'):
+            worker.set('payload', 'stale', timeout=4200)
+            worker.set('generation', 1, timeout=None)
+            self.assertEqual(worker.get('payload'), 'stale')
+
+        later = time.monotonic() + 3
+        with mock.patch('time.monotonic', return_value=later):
+            self.assertIsNone(worker._local_get(worker.make_key('payload'))[1])
+            self.assertIsNone(worker._local_get(worker.make_key('generation'))[1])
+
+    def test_local_tier_is_bounded(self) -> None:
+        worker = self.make_worker(MAX_ENTRIES=2)
+        for key in ('a', 'b', 'c'):
+            worker.set(key, key)
+        self.assertEqual(list(worker._local), [worker.make_key('b'), worker.make_key('c')])
+
+
+class WarmCacheTestCase(TestCase):
+    def setUp(self) -> None:
+        cache.clear()
+        city = City.objects.create(name='Warm City')
+        self.cafe = Cafe.objects.create(name='Warm cafe', location='here', city=city, approved=True)
+        Cafe.objects.create(name='Cold cafe', location='there', city=city, approved=True)
+        user = get_user_model().objects.create_user(username='warmuser', password='securepassword')
+        Rating.objects.create(category=Category.objects.create(name='Coffee'), author=user, cafe=self.cafe, icon='star', rating=4)
+
+    def test_warm_cache(self) -> None:
+        out = StringIO()
+        call_command('warm_cache', '--batch-size', '1', stdout=out)
+
+        # cities and cafe lists, ratings and scores of the rated cafe
+        self.assertIn('Warm City: 3 keys', out.getvalue())
+        self.assertIn('Warmed 4 keys', out.getvalue())
+        self.assertIn('2 empty', out.getvalue())
+
+        self.assertIsNotNone(cache.get(payloads.cafes('Warm City').key))
+        self.assertIsNotNone(cache.get(payloads.ratings('Warm City', 'Warm cafe').key))
+
+
+class BenchmarkTestCase(TestCase):
+    def test_seed_data(self) -> None:
+        call_command(
+            'seed_data', '--cities', '3', '--cafes', '12', '--ratings', '200', '--users', '20',
+            '--categories', '2', '--batch-size', '50', stdout=StringIO(),
+        )
+
+        self.assertEqual(City.objects.count(), 3)
+        self.assertEqual(Cafe.objects.count(), 12)
+        # aggregates match the generated ratings
+        for cafe in Cafe.objects.all():
+            self.assertEqual(cafe.rating_count, Rating.objects.filter(cafe=cafe).count())
+        call_command('rebuild_rating_aggregates', '--check', stdout=StringIO())
+        for city in City.objects.all():
+            self.assertEqual(city.approved_cafes, Cafe.objects.filter(city=city, approved=True).count())
+
+        with self.assertRaises(CommandError):
+            call_command('seed_data', '--cities', '1', '--cafes', '1', '--ratings', '1', '--users', '1', stdout=StringIO())
+        cafe = Cafe.objects.select_related('city').first()
+        key = caching.cafe_generation(cafe.city.slug, cafe.slug)
+        generation = caching.get_generations([key])
+        # rows are deleted without the per-row receivers
+        with mock.patch.object(caching, 'invalidate_cafe') as invalidate_cafe:
+            call_command(
+                'seed_data', '--cities', '1', '--cafes', '1', '--ratings', '1', '--users', '1', '--clear',
+                stdout=StringIO(),
+            )
+        invalidate_cafe.assert_not_called()
+        self.assertNotEqual(caching.get_generations([key]), generation)
+        self.assertEqual(City.objects.count(), 1)
+        self.assertEqual((Rating.objects.count(), CafeCategoryScore.objects.count()), (1, 1))
+
+    def test_benchmark(self) -> None:
+        call_command('seed_data', '--cities', '2', '--cafes', '4', '--ratings', '20', '--users', '5', stdout=StringIO())
+
+        with tempfile.TemporaryDirectory() as directory:
+            baseline = Path(directory) / 'baseline.json'
+            out = StringIO()
+            call_command(
+                'benchmark', '--iterations', '2', '--cold-iterations', '1', '--host', 'testserver',
+                '--baseline', str(baseline), '--save-baseline', stdout=out,
+            )
+            self.assertIn('index warm:', out.getvalue())
+
+            # a baseline with fewer queries than the current run
+            report = json.loads(baseline.read_text())
+            self.assertEqual(report['dataset']['ratings'], Rating.objects.count())
+            for modes in report['results'].values():
+                self.assertEqual(modes['warm']['status'], 200)
+                modes['cold']['queries'] -= 1
+            baseline.write_text(json.dumps(report))
+            with self.assertRaises(CommandError):
+                call_command(
+                    'benchmark', 'getCities', '--iterations', '1', '--cold-iterations', '1', '--host', 'testserver',
+                    '--baseline', str(baseline), '--threshold', '1000', stdout=StringIO(), stderr=StringIO(),
+                )
+
+    def test_benchmark_keeps_the_shared_cache(self) -> None:
+        call_command('seed_data', '--cities', '1', '--cafes', '1', '--ratings', '1', '--users', '1', stdout=StringIO())
+        cache.set('unrelated', 'kept')
+
+        call_command('benchmark', 'getCities', '--iterations', '1', '--host', 'testserver', stdout=StringIO())
+        self.assertEqual(cache.get('unrelated'), 'kept')
+
+        call_command(
+            'benchmark', 'getCities', '--iterations', '1', '--host', 'testserver', '--shared-cache', stdout=StringIO()
+        )
+        self.assertIsNone(cache.get('unrelated'))
+
+
+# 'replica' is not in DATABASES, so connecting to it fails
+@override_settings(DATABASE_REPLICAS=['replica'])
+class ReplicaTestCase(TestCase):
+    def setUp(self) -> None:
+        replicas._down.clear()
+        self.router = ReplicaRouter()
+
+    def request(self, method: str, url_name: str, args=(), cookies=None, write=False):
+        """
+        Runs a request through ReplicaMiddleware and returns the response and
+        where the view's reads went before and after its (optional) write.
+        """
+        request = getattr(RequestFactory(), method)(reverse(url_name, args=args))
+        request.resolver_match = resolve(request.path)
+        request.COOKIES.update(cookies or {})
+        seen = []
+
+        def view(request: HttpRequest) -> HttpResponse:
+            middleware.process_view(request, view, (), {})
+            seen.append(self.router.db_for_read(Cafe))
+            if write:
+                self.router.db_for_write(Cafe)
+            seen.append(self.router.db_for_read(Cafe))
+            return HttpResponse()
+
+        middleware = ReplicaMiddleware(view)
+        return middleware(request), seen
+
+    def test_routing(self) -> None:
+        with mock.patch.object(replicas, 'healthy_replica', return_value='replica'):
+            self.assertEqual(self.request('get', 'cities')[1], ['replica', 'replica'])
+            self.assertEqual(self.request('get', 'city', ['Krakow'])[1], ['replica', 'replica'])
+            # reads after a write see it
+            self.assertEqual(self.request('get', 'cities', write=True)[1], ['replica', None])
+
+            # other views, writes and clients that just wrote read from the primary
+            self.assertEqual(self.request('get', 'account_settings')[1], [None, None])
+            response, seen = self.request('post', 'city-cafes', ['Krakow'])
+            self.assertEqual(seen, [None, None])
+            self.assertEqual(response.cookies[STICKY_COOKIE]['max-age'], 5)
+            self.assertEqual(self.request('get', 'cities', cookies={STICKY_COOKIE: '1'})[1], [None, None])
+            self.assertNotIn(STICKY_COOKIE, self.request('get', 'cities')[0].cookies)
+
+        # outside of requests
+        self.assertIsNone(self.router.db_for_read(Cafe))
+        self.assertEqual(self.router.db_for_write(Cafe), 'default')
+        self.assertFalse(self.router.allow_migrate('replica', 'CaffeRatings'))
+        self.assertIsNone(self.router.allow_migrate('default', 'CaffeRatings'))
+
+    def test_unavailable_replica(self) -> None:
+        self.assertIsNone(replicas.healthy_replica())
+        self.assertEqual(self.request('get', 'cities')[1], [None, None])
+        # not tried again until REPLICA_RETRY passed
+        with mock.patch.object(replicas, 'connections') as connections:
+            self.assertIsNone(replicas.healthy_replica())
+        connections.__getitem__.assert_not_called()
+
+        with override_settings(DATABASE_REPLICAS=['default']):
+            self.assertEqual(replicas.healthy_replica(), 'default')
+
+        City.objects.create(name='Replica City')
+        self.assertEqual(self.client.get(reverse('cities')).status_code, 200)
+
+    def test_payloads_rebuilt_after_write_read_from_primary(self) -> None:
+        seen = []
+
+        def compute() -> None:
+            seen.append(self.router.db_for_read(Cafe))
+
+        with replicas.use('replica'):
+            caching.store('test', ['replica'], ['generation:replica'], compute)
+            caching.bump_generations('generation:replica')
+            caching.get_or_compute('test', ['replica'], ['generation:replica'], compute)
+            with override_settings(REPLICA_LAG=0):
+                caching.store('test', ['replica'], ['generation:replica'], compute)
+        self.assertEqual(seen, ['replica', None, 'replica'])
+
+# these benchmarks query from worker threads, which only see committed rows
+class ConcurrencyBenchmarkTestCase(TransactionTestCase):
+    def test_benchmark_async(self) -> None:
+        call_command('seed_data', '--cities', '2', '--cafes', '4', '--ratings', '20', '--users', '5', stdout=StringIO())
+
+        with tempfile.TemporaryDirectory() as directory:
+            output = Path(directory) / 'async.json'
+            out = StringIO()
+            call_command(
+                'benchmark_async', '--requests', '20', '--concurrency', '5', '--threads', '2', '--cache-delay', '1',
+                '--host', 'testserver', '--output', str(output), stdout=out,
+            )
+            self.assertIn('getCities async:', out.getvalue())
+            results = json.loads(output.read_text())['results']
+
+        self.assertEqual(set(results), {'getOrCreateCafes', 'getRating', 'getCities'})
+        for modes in results.values():
+            for mode in ('sync', 'async'):
+                self.assertEqual(modes[mode]['requests'], 20)
+                self.assertEqual(modes[mode]['statuses'], [200])
+
+        with self.assertRaises(CommandError):
+            call_command('benchmark_async', 'index', stdout=StringIO())
+
+    def test_benchmark_db(self) -> None:
+        call_command('seed_data', '--cities', '2', '--cafes', '4', '--ratings', '20', '--users', '5', stdout=StringIO())
+
+        with tempfile.TemporaryDirectory() as directory:
+            output = Path(directory) / 'db.json'
+            out = StringIO()
+            call_command(
+                'benchmark_db', '--readers', '2', '--writers', '1', '--duration', '0.2', '--output', str(output),
+                stdout=out,
+            )
+            report = json.loads(output.read_text())
+
+        # both SQLite profiles on their own copy, postgres is not configured
+        self.assertIn('postgres: skipped', out.getvalue())
+        self.assertEqual(list(report['profiles']), ['sqlite-wal', 'sqlite'])
+        self.assertEqual(
+            [result['journal_mode'] for result in report['profiles'].values()], ['wal', 'delete']
+        )
+        for result in report['profiles'].values():
+            self.assertEqual(result['database'], 'sqlite')
+            self.assertGreater(result['idle']['reads']['count'], 0)
+            self.assertEqual(result['idle']['writes']['count'], 0)
+            self.assertIn('p95_ms', result['contended']['reads'])
+        # the seeded rows were written to the copies only
+        self.assertEqual(Rating.objects.count(), 20)
+
+
+class DatabaseProfileTestCase(SimpleTestCase):
+    def test_sqlite_pragmas(self) -> None:
+        with tempfile.TemporaryDirectory() as directory:
+            # not as 'default', which SimpleTestCase keeps from connecting
+            handler = ConnectionHandler({
+                'default': {'ENGINE': 'django.db.backends.dummy'},
+                'profile': databases.profile('sqlite-wal', Path(directory), {}),
+            })
+            try:
+                with handler['profile'].cursor() as cursor:
+                    pragmas = {}
+                    for pragma in ('journal_mode', 'synchronous', 'busy_timeout', 'mmap_size'):
+                        cursor.execute(f'PRAGMA {pragma}')
+                        pragmas[pragma] = cursor.fetchone()[0]
+            finally:
+                handler.close_all()
+
+        # synchronous 1 is NORMAL
+        self.assertEqual(
+            pragmas,
+            {
+                'journal_mode': 'wal',
+                'synchronous': 1,
+                'busy_timeout': databases.SQLITE_BUSY_TIMEOUT,
+                'mmap_size': databases.SQLITE_MMAP_SIZE,
+            },
+        )
+        self.assertNotIn('OPTIONS', databases.profile('sqlite', Path('/tmp'), {}))
+        read_only = databases.sqlite('replica.sqlite3', read_only=True)['OPTIONS']
+        self.assertNotIn('journal_mode', read_only['init_command'])
+        self.assertNotIn('transaction_mode', read_only)
+
+    def test_postgres(self) -> None:
+        persistent = databases.profile('postgres', Path('/tmp'), {'POSTGRES_DB': 'cafes', 'CONN_MAX_AGE': '30'})
+        self.assertEqual(persistent['NAME'], 'cafes')
+        self.assertEqual(persistent['CONN_MAX_AGE'], 30)
+        self.assertTrue(persistent['CONN_HEALTH_CHECKS'])
+
+        pooled = databases.profile('postgres', Path('/tmp'), {'POSTGRES_POOL_SIZE': '10'})
+        self.assertEqual(pooled['CONN_MAX_AGE'], 0)
+        self.assertEqual(pooled['OPTIONS']['pool']['max_size'], 10)
+
+        with self.assertRaises(ValueError):
+            databases.profile('mysql', Path('/tmp'), {})
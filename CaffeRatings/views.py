@@ -1,40 +1,75 @@
+from typing import Any, Callable, Dict, Sequence
 from django.shortcuts import render, redirect
-from django.http import Http404
+from django.http import Http404, HttpRequest, HttpResponse
+from django.template.loader import render_to_string
 from django.contrib import messages
 from django.contrib.auth import views as auth_views, logout
 from django.contrib.auth.decorators import login_required
-from django.db.models import Avg, IntegerField
-from django.db.models.functions import Cast
+from . import caching
 from .models import Cafe, City
+from .slugs import normalize
 from .forms import RegistrationForm
 
 
 # cities could be case insensitive
 # also what to do when city name repeats?
 def index(request):
-    data = City.objects.all()
-    context = {
-        'data': data,
-        # 'logged_in': request.user.is_authenticated,
-    }
-    return render(request=request, template_name='CaffeRatings/index.html', context=context)
+    def body():
+        data = City.objects.all()
+        return {'body': render_to_string('CaffeRatings/city_cards.html', {'data': data}, request)}
+
+    return render_cached(request, 'CaffeRatings/index.html', 'index', [], [caching.CITIES_GENERATION], body)
 
 
 # Create your views here.
 def city_load(request, city):
-    data = Cafe.objects.filter(city__name=city, approved=True).annotate(average_rating=Cast(Avg('rating__rating'), IntegerField()))
-    
-    if not data.exists():
-        # if there are not approved cafes the city will not be deleted
-        if not Cafe.objects.filter(city__name=city).exists():
-            City.objects.get(name=city).delete()
+    # cities left without cafes are removed by the prune_empty_cities command
+    if caching.is_empty_city(city):
         raise Http404('No cafes found in this city.')
 
-    context = {
-        'data': data,
-        'city': city,
-    }
-    return render(request=request, template_name='CaffeRatings/cafe_list.html', context=context)
+    def body():
+        data = list(
+            Cafe.objects.filter(city__slug=normalize(city), approved=True).select_related('city').with_average_rating()
+        )
+        if not data:
+            caching.mark_empty_city(city)
+            raise Http404('No cafes found in this city.')
+
+        # one cache round trip for the card versions, unchanged cards are not rendered again
+        versions = caching.get_generations([caching.cafe_generation(city, cafe.slug) for cafe in data])
+        for cafe, version in zip(data, versions):
+            cafe.version = version
+        context = {'data': data, 'timeout': caching.PAYLOAD_TIMEOUT}
+        # the stored name, the page is shared by every spelling of the URL
+        return {
+            'city': data[0].city.name,
+            'body': render_to_string('CaffeRatings/cafe_cards.html', context, request),
+        }
+
+    return render_cached(request, 'CaffeRatings/cafe_list.html', 'city', [city], [caching.city_generation(city)], body)
+
+
+def render_cached(
+    request: HttpRequest,
+    template_name: str,
+    prefix: str,
+    parts: Sequence[Any],
+    generation_keys: Sequence[str],
+    body: Callable[[], Dict[str, Any]],
+) -> HttpResponse:
+    """
+    Renders template_name with the context returned by body (the 'body'
+    fragment and anything else the page shows), cached under the generations.
+    Anonymous users all see the same page, so it is cached whole for them,
+    logged in users get the cached context with their own navigation.
+    """
+    def page() -> str:
+        context = caching.get_or_compute(f'{prefix}-context', parts, generation_keys, body)
+        return render_to_string(template_name, context, request)
+
+    if request.user.is_authenticated:
+        return HttpResponse(page())
+    return HttpResponse(caching.get_or_compute(f'{prefix}-page', parts, generation_keys, page))
 
 
 def register(request):
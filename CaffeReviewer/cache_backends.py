@@ -0,0 +1,319 @@
+"""
+Two tier cache backend: a bounded in-process LRU in front of a shared
+(Redis) cache.
+
+Reads are served from process memory when possible. Any write that
+invalidates data (delete, incr/decr, clear) increments a version key in the
+shared cache and every worker drops its local tier when it notices the new
+version, which it checks at most once per VERSION_CHECK_INTERVAL. Local
+entries also expire after LOCAL_TIMEOUT, which bounds how long a plain
+set() from another worker can go unnoticed.
+
+When the shared cache is unreachable the backend keeps working on the
+local tier alone and retries the shared cache after RETRY_INTERVAL. Entries
+written meanwhile expire after DEGRADED_TIMEOUT (LOCAL_TIMEOUT by default),
+as other workers' invalidations cannot reach this one.
+
+    CACHES = {
+        'default': {
+            'BACKEND': 'CaffeReviewer.cache_backends.TwoTierCache',
+            'LOCATION': 'redis://127.0.0.1:6379',
+            'OPTIONS': {
+                'MAX_ENTRIES': 1000,
+                'LOCAL_TIMEOUT': 5,
+                'REMOTE_BACKEND': 'django.core.cache.backends.redis.RedisCache',
+                'REMOTE_OPTIONS': {'socket_timeout': 0.5},
+            },
+        }
+    }
+"""
+import logging
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Optional, Tuple
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+from django.utils.module_loading import import_string
+from . import instrumentation
+
+
+logger = logging.getLogger(__name__)
+
+VERSION_KEY = 'two-tier:version'
+
+_MISSING = object()
+
+
+def _remote_errors() -> Tuple[type, ...]:
+    errors = [ConnectionError, TimeoutError, OSError]
+    try:
+        from redis.exceptions import RedisError
+        errors.append(RedisError)
+    except ImportError:
+        pass
+    return tuple(errors)
+
+
+REMOTE_ERRORS = _remote_errors()
+
+
+class TwoTierCache(BaseCache):
+    pickle_protocol = pickle.HIGHEST_PROTOCOL
+
+    def __init__(self, server: Optional[str], params: Dict[str, Any]) -> None:
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self._local_timeout = options.get('LOCAL_TIMEOUT', 5)
+        self._degraded_timeout = options.get('DEGRADED_TIMEOUT', self._local_timeout)
+        self._version_check_interval = options.get('VERSION_CHECK_INTERVAL', 1)
+        self._retry_interval = options.get('RETRY_INTERVAL', 5)
+        # keys that must stay consistent across workers (locks, counters)
+        self._remote_only = tuple(options.get('REMOTE_ONLY_PREFIXES', ('lock:', 'stats:')))
+
+        self._local: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self._known_version = None
+        self._checked_at = 0.0
+        self._down_until = 0.0
+        self._degraded = False
+
+        self._remote = None
+        if server:
+            backend = import_string(options.get('REMOTE_BACKEND', 'django.core.cache.backends.redis.RedisCache'))
+            self._remote = backend(server, {
+                'TIMEOUT': params.get('TIMEOUT', 300),
+                'KEY_PREFIX': params.get('KEY_PREFIX', ''),
+                'VERSION': params.get('VERSION', 1),
+                'KEY_FUNCTION': params.get('KEY_FUNCTION'),
+                'OPTIONS': options.get('REMOTE_OPTIONS', {}),
+            })
+        else:
+            logger.warning('TwoTierCache has no shared cache location, running on the local tier only.')
+
+    # shared tier
+
+    @property
+    def remote_available(self) -> bool:
+        return self._remote is not None and time.monotonic() >= self._down_until
+
+    def _call_remote(self, method: str, *args, **kwargs) -> Tuple[bool, Any]:
+        if not self.remote_available:
+            return False, None
+        instrumentation.record_cache_call()
+        try:
+            result = getattr(self._remote, method)(*args, **kwargs)
+        except REMOTE_ERRORS as error:
+            logger.warning('Shared cache unavailable, using the local tier only: %s', error)
+            self._down_until = time.monotonic() + self._retry_interval
+            self._degraded = True
+            return False, None
+
+        if self._degraded:
+            # whatever was cached locally during the outage is not shared, start over
+            self._degraded = False
+            self._clear_local()
+        return True, result
+
+    def _check_version(self) -> None:
+        now = time.monotonic()
+        if now - self._checked_at < self._version_check_interval:
+            return
+        self._checked_at = now
+        available, version = self._call_remote('get', VERSION_KEY)
+        if available and version != self._known_version:
+            self._clear_local()
+            self._known_version = version
+
+    def _publish(self) -> None:
+        # tells the other workers to drop their local tier
+        try:
+            available, version = self._call_remote('incr', VERSION_KEY)
+        except ValueError:
+            available, added = self._call_remote('add', VERSION_KEY, 1, None)
+            version = 1 if added else None
+        if not available:
+            return
+        if version is None or self._known_version is None or version != self._known_version + 1:
+            # somebody else published since the last check
+            self._clear_local()
+        self._known_version = version
+
+    def _is_remote_only(self, key: str) -> bool:
+        return key.startswith(self._remote_only)
+
+    # local tier
+
+    def _clear_local(self) -> None:
+        with self._lock:
+            self._local.clear()
+
+    def _local_get(self, local_key: str) -> Tuple[bool, Any]:
+        with self._lock:
+            entry = self._local.get(local_key)
+            if entry is None:
+                return False, None
+            expires, pickled = entry
+            if expires is not None and expires <= time.monotonic():
+                del self._local[local_key]
+                return False, None
+            self._local.move_to_end(local_key)
+        return True, pickle.loads(pickled)
+
+    def _local_set(self, local_key: str, value: Any, timeout: Optional[float]) -> None:
+        pickled = pickle.dumps(value, self.pickle_protocol)
+        expires = None if timeout is None else time.monotonic() + timeout
+        with self._lock:
+            self._local[local_key] = (expires, pickled)
+            self._local.move_to_end(local_key)
+            while len(self._local) > self._max_entries:
+                self._local.popitem(last=False)
+
+    def _local_delete(self, local_key: str) -> bool:
+        with self._lock:
+            return self._local.pop(local_key, None) is not None
+
+    def _local_timeout_for(self, timeout: Any, shared: bool) -> Optional[float]:
+        timeout = self.get_backend_timeout(timeout)
+        if timeout is not None:
+            timeout = max(timeout - time.time(), 0)
+        if self._remote is None:
+            # the local tier is all there is, keep the requested timeout
+            return timeout
+        # while the shared cache is down other workers' writes and version
+        # bumps are invisible, so entries must not outlive the outage by much
+        limit = self._local_timeout if shared else self._degraded_timeout
+        if timeout is None:
+            return limit
+        return min(timeout, limit)
+
+    # cache API
+
+    def get(self, key: str, default: Any = None, version: Optional[int] = None) -> Any:
+        local_key = self.make_and_validate_key(key, version=version)
+        if not self._is_remote_only(key):
+            self._check_version()
+            hit, value = self._local_get(local_key)
+            if hit:
+                return value
+
+        available, value = self._call_remote('get', key, _MISSING, version)
+        if not available:
+            hit, value = self._local_get(local_key)
+            return value if hit else default
+        if value is _MISSING:
+            return default
+        if not self._is_remote_only(key):
+            self._local_set(local_key, value, self._local_timeout)
+        return value
+
+    def set(self, key: str, value: Any, timeout: Any = DEFAULT_TIMEOUT, version: Optional[int] = None) -> None:
+        local_key = self.make_and_validate_key(key, version=version)
+        available, _ = self._call_remote('set', key, value, timeout, version)
+        if available and self._is_remote_only(key):
+            return
+        self._local_set(local_key, value, self._local_timeout_for(timeout, available))
+
+    def add(self, key: str, value: Any, timeout: Any = DEFAULT_TIMEOUT, version: Optional[int] = None) -> bool:
+        local_key = self.make_and_validate_key(key, version=version)
+        available, added = self._call_remote('add', key, value, timeout, version)
+        if not available:
+            hit, _ = self._local_get(local_key)
+            added = not hit
+        if added and not (available and self._is_remote_only(key)):
+            self._local_set(local_key, value, self._local_timeout_for(timeout, available))
+        return added
+
+    def touch(self, key: str, timeout: Any = DEFAULT_TIMEOUT, version: Optional[int] = None) -> bool:
+        local_key = self.make_and_validate_key(key, version=version)
+        available, touched = self._call_remote('touch', key, timeout, version)
+        hit, value = self._local_get(local_key)
+        if hit:
+            self._local_set(local_key, value, self._local_timeout_for(timeout, available))
+        return touched if available else hit
+
+    def delete(self, key: str, version: Optional[int] = None) -> bool:
+        local_key = self.make_and_validate_key(key, version=version)
+        deleted_locally = self._local_delete(local_key)
+        available, deleted = self._call_remote('delete', key, version)
+        if not available:
+            return deleted_locally
+        if not self._is_remote_only(key):
+            self._publish()
+        return deleted
+
+    def has_key(self, key: str, version: Optional[int] = None) -> bool:
+        return self.get(key, _MISSING, version=version) is not _MISSING
+
+    def incr(self, key: str, delta: int = 1, version: Optional[int] = None) -> int:
+        local_key = self.make_and_validate_key(key, version=version)
+        available, value = self._call_remote('incr', key, delta, version)
+        if not available:
+            with self._lock:
+                entry = self._local.get(local_key)
+                if entry is None:
+                    raise ValueError(f"Key '{key}' not found")
+                expires, pickled = entry
+                value = pickle.loads(pickled) + delta
+                self._local[local_key] = (expires, pickle.dumps(value, self.pickle_protocol))
+            return value
+
+        if not self._is_remote_only(key):
+            self._local_set(local_key, value, self._local_timeout)
+            self._publish()
+        return value
+
+    def get_many(self, keys: Iterable[str], version: Optional[int] = None) -> Dict[str, Any]:
+        keys = list(keys)
+        found = {}
+        wanted = []
+        self._check_version()
+        for key in keys:
+            hit, value = (False, None)
+            if not self._is_remote_only(key):
+                hit, value = self._local_get(self.make_and_validate_key(key, version=version))
+            if hit:
+                found[key] = value
+            else:
+                wanted.append(key)
+        if not wanted:
+            return found
+
+        available, values = self._call_remote('get_many', wanted, version)
+        if not available:
+            for key in wanted:
+                hit, value = self._local_get(self.make_and_validate_key(key, version=version))
+                if hit:
+                    found[key] = value
+            return found
+        for key, value in values.items():
+            found[key] = value
+            if not self._is_remote_only(key):
+                self._local_set(self.make_and_validate_key(key, version=version), value, self._local_timeout)
+        return found
+
+    def set_many(self, data: Dict[str, Any], timeout: Any = DEFAULT_TIMEOUT, version: Optional[int] = None) -> list:
+        available, failed = self._call_remote('set_many', data, timeout, version)
+        for key, value in data.items():
+            if not (available and self._is_remote_only(key)):
+                local_key = self.make_and_validate_key(key, version=version)
+                self._local_set(local_key, value, self._local_timeout_for(timeout, available))
+        return failed if available else []
+
+    def delete_many(self, keys: Iterable[str], version: Optional[int] = None) -> None:
+        keys = list(keys)
+        for key in keys:
+            self._local_delete(self.make_and_validate_key(key, version=version))
+        available, _ = self._call_remote('delete_many', keys, version)
+        if available:
+            self._publish()
+
+    def clear(self) -> None:
+        self._clear_local()
+        available, _ = self._call_remote('clear')
+        if available:
+            self._known_version = None
+
+    def close(self, **kwargs) -> None:
+        if self._remote is not None:
+            self._remote.close(**kwargs)
@@ -0,0 +1,85 @@
+"""
+Database profiles, picked with the DATABASE_PROFILE environment variable.
+
+sqlite-wal (default): SQLite tuned for concurrent requests. WAL lets readers
+run while a writer commits; writers wait for each other for busy_timeout
+instead of failing with "database is locked", and take the write lock when
+their transaction starts, so two transactions that read first cannot
+deadlock when both try to write.
+
+sqlite: Django's SQLite defaults, rollback journal, for comparison.
+
+postgres: persistent connections checked before reuse, or a psycopg pool
+(needs psycopg[pool]) when POSTGRES_POOL_SIZE is set. Configured with
+POSTGRES_DB, POSTGRES_USER, POSTGRES_PASSWORD, POSTGRES_HOST and
+POSTGRES_PORT.
+
+The benchmark_db command measures read latency while writers run, for
+every SQLite profile on a copy of the database.
+"""
+from pathlib import Path
+from typing import Any, Dict, Mapping
+
+try:
+    from psycopg_pool import ConnectionPool
+except ImportError:
+    ConnectionPool = None
+
+
+PROFILES = ('sqlite-wal', 'sqlite', 'postgres')
+
+# milliseconds a connection waits for a lock before failing
+SQLITE_BUSY_TIMEOUT = 5000
+SQLITE_MMAP_SIZE = 256 * 1024 * 1024
+
+
+def sqlite_pragmas(read_only: bool = False) -> str:
+    pragmas = [f'PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT}', f'PRAGMA mmap_size={SQLITE_MMAP_SIZE}']
+    if not read_only:
+        # journal_mode is stored in the file, synchronous is per connection
+        pragmas += ['PRAGMA journal_mode=WAL', 'PRAGMA synchronous=NORMAL']
+    return '; '.join(pragmas)
+
+
+def sqlite(name: Any, tuned: bool = True, read_only: bool = False) -> Dict[str, Any]:
+    database: Dict[str, Any] = {'ENGINE': 'django.db.backends.sqlite3', 'NAME': name}
+    if tuned:
+        database['OPTIONS'] = {
+            'init_command': sqlite_pragmas(read_only),
+            'timeout': SQLITE_BUSY_TIMEOUT / 1000,
+        }
+        if not read_only:
+            database['OPTIONS']['transaction_mode'] = 'IMMEDIATE'
+    return database
+
+
+def postgres(environ: Mapping[str, str]) -> Dict[str, Any]:
+    database: Dict[str, Any] = {
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': environ.get('POSTGRES_DB', 'caffereviewer'),
+        'USER': environ.get('POSTGRES_USER', ''),
+        'PASSWORD': environ.get('POSTGRES_PASSWORD', ''),
+        'HOST': environ.get('POSTGRES_HOST', ''),
+        'PORT': environ.get('POSTGRES_PORT', ''),
+        'OPTIONS': {},
+    }
+    pool_size = int(environ.get('POSTGRES_POOL_SIZE', 0))
+    if pool_size:
+        # the pool checks connections itself, Django must not keep them
+        database['CONN_MAX_AGE'] = 0
+        database['OPTIONS']['pool'] = {'min_size': 1, 'max_size': pool_size}
+        if ConnectionPool is not None:
+            # connections are checked when they are taken from the pool
+            database['OPTIONS']['pool']['check'] = ConnectionPool.check_connection
+    else:
+        database['CONN_MAX_AGE'] = int(environ.get('CONN_MAX_AGE', 60))
+        database['CONN_HEALTH_CHECKS'] = True
+    return database
+
+
+def profile(name: str, base_dir: Path, environ: Mapping[str, str]) -> Dict[str, Any]:
+    if name == 'postgres':
+        return postgres(environ)
+    if name in ('sqlite', 'sqlite-wal'):
+        return sqlite(base_dir / 'db.sqlite3', tuned=name == 'sqlite-wal')
+    raise ValueError(f'Unknown DATABASE_PROFILE {name!r}, use one of {", ".join(PROFILES)}.')
@@ -0,0 +1,177 @@
+"""
+Per-request instrumentation: database queries and time, cache hits, misses
+and round trips, and serializer time.
+
+Numbers are only collected while RequestMetricsMiddleware has a request
+open. Outside of it, or when REQUEST_METRICS is off and the middleware is
+not loaded, every hook returns after a single context variable lookup.
+"""
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar, Token
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
+
+
+# upper bounds of the histogram buckets, anything above lands in +Inf
+DURATION_BUCKETS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+METRIC_BUCKETS = {
+    'duration_ms': DURATION_BUCKETS,
+    'db_queries': COUNT_BUCKETS,
+    'db_ms': DURATION_BUCKETS,
+    'cache_hits': COUNT_BUCKETS,
+    'cache_misses': COUNT_BUCKETS,
+    'cache_calls': COUNT_BUCKETS,
+    'serialize_ms': DURATION_BUCKETS,
+}
+
+
+class RequestStats:
+    __slots__ = ('queries', 'db_time', 'cache_hits', 'cache_misses', 'cache_calls', 'serialize_time')
+
+    def __init__(self) -> None:
+        self.queries = 0
+        self.db_time = 0.0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.cache_calls = 0
+        self.serialize_time = 0.0
+
+    def execute_wrapper(self, execute: Callable, sql: str, params: Any, many: bool, context: Dict[str, Any]) -> Any:
+        # installed with connection.execute_wrapper() for the request
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.db_time += time.perf_counter() - started
+
+    def metrics(self, duration: float) -> Dict[str, float]:
+        return {
+            'duration_ms': duration * 1000,
+            'db_queries': self.queries,
+            'db_ms': self.db_time * 1000,
+            'cache_hits': self.cache_hits,
+            'cache_misses': self.cache_misses,
+            'cache_calls': self.cache_calls,
+            'serialize_ms': self.serialize_time * 1000,
+        }
+
+    def server_timing(self, duration: float) -> str:
+        return ', '.join([
+            f'db;dur={self.db_time * 1000:.2f};desc="{self.queries} queries"',
+            f'cache;desc="{self.cache_hits} hits, {self.cache_misses} misses, {self.cache_calls} calls"',
+            f'serialize;dur={self.serialize_time * 1000:.2f}',
+            f'total;dur={duration * 1000:.2f}',
+        ])
+
+
+_current: ContextVar[Optional[RequestStats]] = ContextVar('request_stats', default=None)
+
+
+def start(stats: RequestStats) -> Token:
+    return _current.set(stats)
+
+
+def stop(token: Token) -> None:
+    _current.reset(token)
+
+
+def record_cache(hit: bool) -> None:
+    stats = _current.get()
+    if stats is None:
+        return
+    if hit:
+        stats.cache_hits += 1
+    else:
+        stats.cache_misses += 1
+
+
+def record_cache_call() -> None:
+    stats = _current.get()
+    if stats is not None:
+        stats.cache_calls += 1
+
+
+@contextmanager
+def timed_serialization() -> Iterator[None]:
+    stats = _current.get()
+    if stats is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats.serialize_time += time.perf_counter() - started
+
+
+class Histogram:
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets: Tuple[float, ...]) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                break
+        else:
+            index = len(self.buckets)
+        self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {'buckets': list(self.buckets), 'counts': list(self.counts), 'sum': self.sum, 'count': self.count}
+
+
+# per process, histograms keyed by URL name and then metric,
+# event counters (e.g. JWT validations) keyed by (name, label)
+_histograms: Dict[str, Dict[str, Histogram]] = {}
+_counters: Counter = Counter()
+_lock = threading.Lock()
+
+
+def observe(url_name: str, stats: RequestStats, duration: float) -> None:
+    with _lock:
+        histograms = _histograms.get(url_name)
+        if histograms is None:
+            histograms = _histograms[url_name] = {
+                metric: Histogram(buckets) for metric, buckets in METRIC_BUCKETS.items()
+            }
+        for metric, value in stats.metrics(duration).items():
+            histograms[metric].observe(value)
+
+
+def increment(name: str, label: str) -> None:
+    with _lock:
+        _counters[(name, label)] += 1
+
+
+def get_histograms() -> Dict[str, Dict[str, Dict[str, Any]]]:
+    with _lock:
+        return {
+            url_name: {metric: histogram.snapshot() for metric, histogram in histograms.items()}
+            for url_name, histograms in _histograms.items()
+        }
+
+
+def get_counters() -> Dict[str, Dict[str, int]]:
+    counters: Dict[str, Dict[str, int]] = {}
+    with _lock:
+        for (name, label), value in _counters.items():
+            counters.setdefault(name, {})[label] = value
+    return counters
+
+
+def reset() -> None:
+    with _lock:
+        _histograms.clear()
+        _counters.clear()
@@ -0,0 +1,191 @@
+"""
+Prometheus text exposition of the request and data layer stats.
+
+Every worker process keeps its histograms and counters in memory (see
+CaffeReviewer.instrumentation) and writes them to METRICS_DIR/<pid>.json at
+most once per FLUSH_INTERVAL. The /_internal/metrics view sums the files of all
+workers, so any worker can answer the scrape. Files of workers that exited
+keep counting, as Prometheus counters should; empty the directory when the
+server is started.
+
+Payload cache outcomes are read from the shared cache (caching.get_stats).
+"""
+import json
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+from django.conf import settings
+from django.http import Http404, HttpRequest, HttpResponse
+from CaffeRatings import caching
+from . import instrumentation
+
+
+FLUSH_INTERVAL = 5
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+NAMESPACE = 'caffereviewer'
+
+# prefixes of the payloads cached through CaffeRatings.caching
+PAYLOAD_PREFIXES = (
+    'ratings', 'scores', 'cafes', 'cities', 'city-context', 'city-page', 'index-context', 'index-page', 'role',
+)
+
+# histogram metric -> (exported name, help, divisor turning the unit into seconds or 1)
+HISTOGRAMS = {
+    'duration_ms': ('request_duration_seconds', 'Request latency.', 1000),
+    'db_queries': ('request_db_queries', 'Database queries per request.', 1),
+    'db_ms': ('request_db_duration_seconds', 'Database time per request.', 1000),
+    'cache_calls': ('request_cache_calls', 'Shared cache round trips per request.', 1),
+    'serialize_ms': ('request_serialize_duration_seconds', 'Serializer time per request.', 1000),
+}
+
+_flush_lock = threading.Lock()
+_last_flush = 0.0
+
+
+def metrics_dir() -> Path:
+    return Path(getattr(settings, 'METRICS_DIR', None) or Path(tempfile.gettempdir()) / 'caffereviewer-metrics')
+
+
+def flush() -> None:
+    """
+    Writes the snapshot of this process, atomically so readers never see half a file.
+    """
+    global _last_flush
+    directory = metrics_dir()
+    directory.mkdir(parents=True, exist_ok=True)
+    snapshot = {'histograms': instrumentation.get_histograms(), 'counters': instrumentation.get_counters()}
+
+    path = directory / f'{os.getpid()}.json'
+    temporary = directory / f'.{os.getpid()}.json.tmp'
+    temporary.write_text(json.dumps(snapshot))
+    os.replace(temporary, path)
+    _last_flush = time.monotonic()
+
+
+def maybe_flush() -> None:
+    # metrics off, nothing is exported and nothing written
+    if not getattr(settings, 'REQUEST_METRICS', False):
+        return
+    if time.monotonic() - _last_flush < FLUSH_INTERVAL:
+        return
+    if not _flush_lock.acquire(blocking=False):
+        return
+    try:
+        flush()
+    except OSError:
+        # metrics must never break a request
+        pass
+    finally:
+        _flush_lock.release()
+
+
+def collect() -> Dict[str, Any]:
+    """
+    Sums the snapshots written by all worker processes.
+    """
+    histograms: Dict[str, Dict[str, Dict[str, Any]]] = {}
+    counters: Dict[str, Dict[str, int]] = {}
+    for path in metrics_dir().glob('*.json'):
+        try:
+            snapshot = json.loads(path.read_text())
+        except (OSError, ValueError):
+            continue
+
+        for url_name, metrics in snapshot['histograms'].items():
+            for metric, histogram in metrics.items():
+                total = histograms.setdefault(url_name, {}).get(metric)
+                if total is None:
+                    histograms[url_name][metric] = {**histogram, 'counts': list(histogram['counts'])}
+                    continue
+                if total['buckets'] != histogram['buckets']:
+                    # written by a worker running a different release
+                    continue
+                total['counts'] = [a + b for a, b in zip(total['counts'], histogram['counts'])]
+                total['sum'] += histogram['sum']
+                total['count'] += histogram['count']
+
+        for name, labels in snapshot['counters'].items():
+            total = counters.setdefault(name, {})
+            for label, value in labels.items():
+                total[label] = total.get(label, 0) + value
+    return {'histograms': histograms, 'counters': counters}
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(**labels: Any) -> str:
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + '}'
+
+
+def _number(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _header(name: str, kind: str, help_text: str) -> List[str]:
+    return [f'# HELP {NAMESPACE}_{name} {help_text}', f'# TYPE {NAMESPACE}_{name} {kind}']
+
+
+def _histogram_lines(name: str, histograms: Dict[str, Dict[str, Any]], metric: str, divisor: int) -> List[str]:
+    lines = []
+    for url_name, metrics in sorted(histograms.items()):
+        histogram = metrics.get(metric)
+        if histogram is None:
+            continue
+        cumulative = 0
+        for bound, count in zip([*histogram['buckets'], None], histogram['counts']):
+            cumulative += count
+            le = '+Inf' if bound is None else _number(bound / divisor)
+            lines.append(f'{NAMESPACE}_{name}_bucket{_labels(view=url_name, le=le)} {cumulative}')
+        lines.append(f'{NAMESPACE}_{name}_sum{_labels(view=url_name)} {_number(histogram["sum"] / divisor)}')
+        lines.append(f'{NAMESPACE}_{name}_count{_labels(view=url_name)} {histogram["count"]}')
+    return lines
+
+
+def render(collected: Dict[str, Any], payload_stats: Dict[str, Dict[str, int]]) -> str:
+    histograms, counters = collected['histograms'], collected['counters']
+    lines: List[str] = []
+
+    for metric, (name, help_text, divisor) in HISTOGRAMS.items():
+        lines += _header(name, 'histogram', help_text)
+        lines += _histogram_lines(name, histograms, metric, divisor)
+
+    for metric, name in (('cache_hits', 'request_cache_hits_total'), ('cache_misses', 'request_cache_misses_total')):
+        lines += _header(name, 'counter', f'Payload cache {metric.split("_")[1]} of requests.')
+        for url_name, metrics in sorted(histograms.items()):
+            if metric in metrics:
+                lines.append(f'{NAMESPACE}_{name}{_labels(view=url_name)} {_number(metrics[metric]["sum"])}')
+
+    lines += _header('payload_cache_total', 'counter', 'Payload cache lookups by outcome.')
+    for prefix, outcomes in sorted(payload_stats.items()):
+        for outcome, value in outcomes.items():
+            lines.append(f'{NAMESPACE}_payload_cache_total{_labels(prefix=prefix, outcome=outcome)} {value}')
+
+    lines += _header('payload_cache_hit_ratio', 'gauge', 'Share of payload lookups that did not rebuild the payload.')
+    for prefix, outcomes in sorted(payload_stats.items()):
+        total = sum(outcomes.values())
+        if total:
+            hits = sum(outcomes[outcome] for outcome in caching.HIT_OUTCOMES)
+            lines.append(f'{NAMESPACE}_payload_cache_hit_ratio{_labels(prefix=prefix)} {_number(hits / total)}')
+
+    lines += _header('jwt_validations_total', 'counter', 'JWT access token validations by result.')
+    for result, value in sorted(counters.get('jwt_validations', {}).items()):
+        lines.append(f'{NAMESPACE}_jwt_validations_total{_labels(result=result)} {value}')
+
+    return '\n'.join(lines) + '\n'
+
+
+def _is_internal(request: HttpRequest) -> bool:
+    return request.META.get('REMOTE_ADDR') in getattr(settings, 'INTERNAL_IPS', ())
+
+
+def metrics_view(request: HttpRequest) -> HttpResponse:
+    # internal only, everybody else gets the same 404 as any unknown URL
+    if not _is_internal(request):
+        raise Http404()
+    flush()
+    return HttpResponse(render(collect(), caching.get_stats(PAYLOAD_PREFIXES)), content_type=CONTENT_TYPE)
@@ -0,0 +1,43 @@
+import time
+from contextlib import ExitStack
+from typing import Callable
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.http import HttpRequest, HttpResponse
+from . import instrumentation, metrics
+
+
+class RequestMetricsMiddleware:
+    """
+    Counts queries, database time, cache hits and misses and serializer time
+    of every request, sends them in a Server-Timing header and adds them to
+    the per URL name histograms in CaffeReviewer.instrumentation, which
+    are exported by the /_internal/metrics view.
+
+    Switched on by the REQUEST_METRICS setting, otherwise Django drops the
+    middleware at startup and requests do not pay for it at all.
+    """
+    def __init__(self, get_response: Callable[[HttpRequest], HttpResponse]) -> None:
+        if not getattr(settings, 'REQUEST_METRICS', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request: HttpRequest) -> HttpResponse:
+        stats = instrumentation.RequestStats()
+        token = instrumentation.start(stats)
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for alias in connections:
+                    stack.enter_context(connections[alias].execute_wrapper(stats.execute_wrapper))
+                response = self.get_response(request)
+        finally:
+            instrumentation.stop(token)
+        duration = time.perf_counter() - started
+
+        response['Server-Timing'] = stats.server_timing(duration)
+        match = request.resolver_match
+        instrumentation.observe(match.view_name if match else 'unresolved', stats, duration)
+        metrics.maybe_flush()
+        return response
@@ -0,0 +1,138 @@
+"""
+Read replicas for the GET views.
+
+ReplicaMiddleware picks a replica for GET and HEAD requests to the URL names
+in REPLICA_URL_NAMES, and ReplicaRouter sends their reads to it. Everything
+else reads from and writes to default:
+- requests to other views
+- management commands
+- the rest of a request after its first write
+
+A write request sets a cookie that keeps the client's reads on the primary
+for REPLICA_LAG seconds, so users see their own writes. API clients that
+drop cookies only get this within one request. Cached payloads rebuilt
+within REPLICA_LAG of an invalidation are read from the primary (see
+CaffeRatings.caching), otherwise a lagging replica's rows would be cached
+under the new generation.
+
+A replica that cannot be connected to is skipped for REPLICA_RETRY seconds.
+
+    DATABASE_REPLICAS = ['replica1']    # aliases in DATABASES
+    REPLICA_URL_NAMES = ['index', 'city', 'cities', 'cafe-ratings', 'city-cafes']
+    REPLICA_LAG = 5
+    REPLICA_RETRY = 30
+"""
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, ContextManager, Dict, Iterator, Optional
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+from django.http import HttpRequest, HttpResponse
+from django.utils.connection import ConnectionDoesNotExist
+
+
+STICKY_COOKIE = 'read_primary'
+SAFE_METHODS = ('GET', 'HEAD')
+
+# alias reads of the current request go to, None is the primary
+_replica: ContextVar[Optional[str]] = ContextVar('replica', default=None)
+# replica alias -> time.monotonic() it may be tried again
+_down: Dict[str, float] = {}
+_down_lock = threading.Lock()
+
+
+def enabled() -> bool:
+    return bool(getattr(settings, 'DATABASE_REPLICAS', ()))
+
+
+@contextmanager
+def use(alias: Optional[str]) -> Iterator[None]:
+    """
+    Reads inside the block go to alias, or to the primary when it is None.
+    """
+    token = _replica.set(alias)
+    try:
+        yield
+    finally:
+        _replica.reset(token)
+
+
+def primary() -> ContextManager[None]:
+    return use(None)
+
+
+def healthy_replica() -> Optional[str]:
+    """
+    A connected replica in random order, None when all of them are down.
+    """
+    now = time.monotonic()
+    candidates = [alias for alias in settings.DATABASE_REPLICAS if _down.get(alias, 0) <= now]
+    random.shuffle(candidates)
+    for alias in candidates:
+        try:
+            connections[alias].ensure_connection()
+        except (ConnectionDoesNotExist, DatabaseError):
+            with _down_lock:
+                _down[alias] = now + getattr(settings, 'REPLICA_RETRY', 30)
+            continue
+        return alias
+    return None
+
+
+class ReplicaRouter:
+    def db_for_read(self, model: type, **hints: Any) -> Optional[str]:
+        return _replica.get()
+
+    def db_for_write(self, model: type, **hints: Any) -> str:
+        # the rest of the request reads its own writes, and instances read
+        # from a replica are saved to the primary
+        _replica.set(None)
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1: Any, obj2: Any, **hints: Any) -> Optional[bool]:
+        # replicas hold the same rows as the primary
+        aliases = {DEFAULT_DB_ALIAS, *getattr(settings, 'DATABASE_REPLICAS', ())}
+        if obj1._state.db in aliases and obj2._state.db in aliases:
+            return True
+        return None
+
+    def allow_migrate(self, db: str, app_label: str, **hints: Any) -> Optional[bool]:
+        # replicas get their schema from the primary
+        if db in getattr(settings, 'DATABASE_REPLICAS', ()):
+            return False
+        return None
+
+
+class ReplicaMiddleware:
+    """
+    Routes the reads of GET views to a replica and keeps clients that just
+    wrote on the primary. Dropped at startup when there are no replicas.
+    """
+    def __init__(self, get_response: Callable[[HttpRequest], HttpResponse]) -> None:
+        if not enabled():
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request: HttpRequest) -> HttpResponse:
+        with primary():
+            response = self.get_response(request)
+
+        if request.method not in SAFE_METHODS and response.status_code < 400:
+            response.set_cookie(
+                STICKY_COOKIE, '1', max_age=getattr(settings, 'REPLICA_LAG', 5), httponly=True, samesite='Lax'
+            )
+        return response
+
+    def process_view(self, request: HttpRequest, view_func: Callable, view_args: Any, view_kwargs: Any) -> None:
+        match = request.resolver_match
+        if (
+            request.method in SAFE_METHODS
+            and STICKY_COOKIE not in request.COOKIES
+            and match is not None
+            and match.url_name in getattr(settings, 'REPLICA_URL_NAMES', ())
+        ):
+            _replica.set(healthy_replica())
@@ -14,6 +14,7 @@ from pathlib import Path
 from dotenv import load_dotenv
 import os
 from datetime import timedelta
+from CaffeReviewer import databases
 
 
 
@@ -51,6 +52,11 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # first, so it measures everything below it; dropped unless REQUEST_METRICS is on
+    'CaffeReviewer.middleware.RequestMetricsMiddleware',
+    'CaffeReviewer.slow_queries.SlowQueryMiddleware',
+    # dropped unless DATABASE_REPLICAS is set
+    'CaffeReviewer.replicas.ReplicaMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -65,8 +71,13 @@ ROOT_URLCONF = 'CaffeReviewer.urls'
 REST_FRAMEWORK = {
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 10,
+    # same output as rest_framework.renderers.JSONRenderer, faster with orjson installed
+    'DEFAULT_RENDERER_CLASSES': (
+        'API.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'API.authentication.JWTAuthentication',
         'rest_framework.authentication.BasicAuthentication',
         'rest_framework.authentication.SessionAuthentication',
     ),
@@ -90,6 +101,9 @@ SIMPLE_JWT = {
     "TOKEN_OBTAIN_SERIALIZER": "API.serializers.GroupBasedTokenObtainPairSerializer",
 }
 
+# verified access tokens kept per process, see API.authentication
+JWT_VERIFIED_CACHE_SIZE = 1024
+
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
@@ -112,13 +126,31 @@ WSGI_APPLICATION = 'CaffeReviewer.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
+# sqlite-wal, sqlite or postgres (see CaffeReviewer/databases.py)
+DATABASE_PROFILE = os.environ.get('DATABASE_PROFILE', 'sqlite-wal')
 DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
-    }
+    'default': databases.profile(DATABASE_PROFILE, BASE_DIR, os.environ),
 }
 
+# read-only copies of the default database, comma separated SQLite files,
+# that the GET views in REPLICA_URL_NAMES read from (see CaffeReviewer/replicas.py)
+DATABASE_REPLICAS = []
+for index, path in enumerate(filter(None, os.environ.get('DATABASE_REPLICAS', '').split(',')), start=1):
+    DATABASE_REPLICAS.append(f'replica{index}')
+    # read only, and a missing file fails to connect instead of being created
+    DATABASES[f'replica{index}'] = databases.sqlite(
+        f'file:{path.strip()}?mode=ro', tuned=DATABASE_PROFILE == 'sqlite-wal', read_only=True
+    )
+    DATABASES[f'replica{index}']['TEST'] = {'MIRROR': 'default'}
+
+DATABASE_ROUTERS = ['CaffeReviewer.replicas.ReplicaRouter']
+REPLICA_URL_NAMES = ['index', 'city', 'cities', 'cafe-ratings', 'city-cafes']
+# seconds a replica may be behind: clients that wrote read from the primary
+# for this long, and so do payloads rebuilt this soon after a write
+REPLICA_LAG = 5
+# seconds a replica that failed to connect is skipped
+REPLICA_RETRY = 30
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -174,11 +206,43 @@ STATIC_ROOT = BASE_DIR / "staticfiles"
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# in-process LRU in front of Redis, falls back to the local tier alone
+# when Redis is unreachable (see CaffeReviewer/cache_backends.py)
 CACHES = {
     "default": {
-        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "BACKEND": "CaffeReviewer.cache_backends.TwoTierCache",
         # "LOCATION": "redis://127.0.0.1:6379",
         "LOCATION": os.environ.get('REDIS'),
+        "OPTIONS": {
+            "MAX_ENTRIES": 1000,
+            "LOCAL_TIMEOUT": 5,
+            "REMOTE_BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "REMOTE_OPTIONS": {
+                "socket_connect_timeout": 0.5,
+                "socket_timeout": 0.5,
+            },
+        },
     }
 }
 
+# serve the previous city cafe list while a single worker rebuilds it
+CAFE_LIST_SERVE_STALE = True
+
+# serve the ratings, cafe list and city list reads with the coroutines of
+# API/async_views.py, for ASGI servers (see CaffeReviewer/asgi.py)
+ASYNC_API = os.environ.get('ASYNC_API', '').lower() in ('1', 'true', 'yes')
+
+# per request query, cache and serializer counts in a Server-Timing header
+# and per URL name histograms (see CaffeReviewer/middleware.py)
+REQUEST_METRICS = os.environ.get('REQUEST_METRICS', '').lower() in ('1', 'true', 'yes')
+
+# /_internal/metrics is only served to these addresses, worker processes share their
+# numbers through files in METRICS_DIR (see CaffeReviewer/metrics.py)
+INTERNAL_IPS = ['127.0.0.1', '::1']
+METRICS_DIR = os.environ.get('METRICS_DIR')
+
+# queries slower than this many milliseconds are logged with their plan,
+# unset to turn the logger off (see CaffeReviewer/slow_queries.py)
+SLOW_QUERY_THRESHOLD_MS = float(os.environ['SLOW_QUERY_THRESHOLD_MS']) if os.environ.get('SLOW_QUERY_THRESHOLD_MS') else None
+SLOW_QUERY_SAMPLE_RATE = float(os.environ.get('SLOW_QUERY_SAMPLE_RATE', 1.0))
+SLOW_QUERY_LOG = BASE_DIR / 'logs' / 'slow_queries.jsonl'
@@ -0,0 +1,166 @@
+"""
+Slow query log: SQL, parameters, duration, the calling view and the query
+plan of queries slower than SLOW_QUERY_THRESHOLD_MS, one JSON object per
+line in a rotating file. Read it with `manage.py slow_queries`.
+
+    SLOW_QUERY_THRESHOLD_MS = 100     # None turns the logger off
+    SLOW_QUERY_SAMPLE_RATE = 1.0      # share of slow queries that are logged
+    SLOW_QUERY_LOG = 'logs/slow_queries.jsonl'
+"""
+import hashlib
+import json
+import logging
+import random
+import re
+import threading
+import time
+from contextlib import ExitStack
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import RotatingFileHandler
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import DatabaseError, connections
+from django.http import HttpRequest, HttpResponse
+
+
+MAX_BYTES = 10 * 1024 * 1024
+BACKUP_COUNT = 5
+
+# EXPLAIN prefix per database vendor, plans are only taken for reads
+EXPLAIN = {
+    'sqlite': 'EXPLAIN QUERY PLAN ',
+    'postgresql': 'EXPLAIN ',
+    'mysql': 'EXPLAIN ',
+}
+
+_explaining: ContextVar[bool] = ContextVar('explaining_slow_query', default=False)
+_logger: Optional[logging.Logger] = None
+_logger_lock = threading.Lock()
+
+
+def log_path() -> Path:
+    return Path(getattr(settings, 'SLOW_QUERY_LOG', None) or Path(settings.BASE_DIR) / 'logs' / 'slow_queries.jsonl')
+
+
+def _get_logger() -> logging.Logger:
+    # a dedicated logger, so the JSON lines never end up in the console log
+    global _logger
+    with _logger_lock:
+        if _logger is None or _logger.handlers[0].baseFilename != str(log_path().resolve()):
+            path = log_path()
+            path.parent.mkdir(parents=True, exist_ok=True)
+            logger = logging.getLogger(__name__)
+            logger.propagate = False
+            logger.setLevel(logging.INFO)
+            for handler in list(logger.handlers):
+                logger.removeHandler(handler)
+                handler.close()
+            handler = RotatingFileHandler(path, maxBytes=MAX_BYTES, backupCount=BACKUP_COUNT, encoding='utf-8')
+            handler.setFormatter(logging.Formatter('%(message)s'))
+            logger.addHandler(handler)
+            _logger = logger
+        return _logger
+
+
+def fingerprint(sql: str) -> str:
+    """
+    Normalizes literals, placeholders and IN lists away, so queries that only
+    differ in their parameters group together.
+    """
+    normalized = re.sub(r"'(?:[^']|'')*'", '?', sql)
+    normalized = re.sub(r'%s|\b\d+(?:\.\d+)?\b', '?', normalized)
+    normalized = re.sub(r'\(\s*\?(?:\s*,\s*\?)*\s*\)', '(...)', normalized)
+    normalized = re.sub(r'\s+', ' ', normalized).strip().lower()
+    return hashlib.md5(normalized.encode()).hexdigest()[:12]
+
+
+def explain(connection: Any, sql: str, params: Any) -> Optional[List[str]]:
+    prefix = EXPLAIN.get(connection.vendor)
+    if prefix is None or not sql.lstrip().lower().startswith('select'):
+        return None
+    token = _explaining.set(True)
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(prefix + sql, params)
+            return [' '.join(str(column) for column in row) for row in cursor.fetchall()]
+    except DatabaseError:
+        # e.g. the transaction is already aborted, the query itself is still logged
+        return None
+    finally:
+        _explaining.reset(token)
+
+
+class SlowQueryLogger:
+    def __init__(self, alias: str, request: HttpRequest, threshold: float, sample_rate: float) -> None:
+        self.alias = alias
+        self.request = request
+        self.threshold = threshold
+        self.sample_rate = sample_rate
+
+    def __call__(self, execute: Callable, sql: str, params: Any, many: bool, context: Dict[str, Any]) -> Any:
+        if _explaining.get():
+            return execute(sql, params, many, context)
+
+        started = time.perf_counter()
+        result = execute(sql, params, many, context)
+        duration = (time.perf_counter() - started) * 1000
+        if duration >= self.threshold and random.random() < self.sample_rate:
+            self.log(sql, params, many, duration, context)
+        return result
+
+    def log(self, sql: str, params: Any, many: bool, duration: float, context: Dict[str, Any]) -> None:
+        match = self.request.resolver_match
+        entry = {
+            'time': datetime.now(timezone.utc).isoformat(),
+            'duration_ms': round(duration, 3),
+            'fingerprint': fingerprint(sql),
+            'sql': sql,
+            'params': None if many else params,
+            'view': match.view_name if match else self.request.path,
+            'database': self.alias,
+            'plan': None if many else explain(context['connection'], sql, params),
+        }
+        _get_logger().info(json.dumps(entry, default=str))
+
+
+class SlowQueryMiddleware:
+    """
+    Wraps every query of a request with SlowQueryLogger. Dropped at startup
+    when SLOW_QUERY_THRESHOLD_MS is not set.
+    """
+    def __init__(self, get_response: Callable[[HttpRequest], HttpResponse]) -> None:
+        if getattr(settings, 'SLOW_QUERY_THRESHOLD_MS', None) is None:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request: HttpRequest) -> HttpResponse:
+        threshold = settings.SLOW_QUERY_THRESHOLD_MS
+        sample_rate = getattr(settings, 'SLOW_QUERY_SAMPLE_RATE', 1.0)
+        with ExitStack() as stack:
+            for alias in connections:
+                logger = SlowQueryLogger(alias, request, threshold, sample_rate)
+                stack.enter_context(connections[alias].execute_wrapper(logger))
+            return self.get_response(request)
+
+
+def read_log(path: Optional[Path] = None) -> List[Dict[str, Any]]:
+    """
+    Entries of the log and its rotated backups, oldest first.
+    """
+    path = path or log_path()
+    files = [path.with_name(f'{path.name}.{index}') for index in range(BACKUP_COUNT, 0, -1)] + [path]
+    entries = []
+    for file in files:
+        if not file.exists():
+            continue
+        with file.open(encoding='utf-8') as lines:
+            for line in lines:
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    # a line cut short by a crash or a concurrent rotation
+                    continue
+    return entries
@@ -0,0 +1,89 @@
+"""
+Query budgets for tests: every URL name gets a maximum number of queries,
+and its query count must not grow with the amount of data it serves.
+
+    class CafeBudgetTests(QueryBudgetMixin, TestCase):
+        budgets = {'city-cafes': 2}
+        urlconf = 'API.urls'
+
+        def test_city_cafes(self):
+            self.assertQueryBudget('city-cafes', lambda: self.client.get(url), grow=add_cafes)
+
+The request is made with an empty cache once per entry of `sizes`; before
+each request grow(count) adds rows so the dataset has that many. Cache
+hits would hide N+1 queries, so the cache is cleared before every request.
+"""
+from importlib import import_module
+from typing import Any, Callable, Dict, Iterable, List, Set, Tuple
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLPattern, URLResolver
+
+
+def url_names(urlconf: str) -> Set[str]:
+    """
+    Names of all routes in urlconf, including the included ones.
+    """
+    def walk(patterns: Iterable[Any]) -> Iterable[str]:
+        for pattern in patterns:
+            if isinstance(pattern, URLResolver):
+                yield from walk(pattern.url_patterns)
+            elif isinstance(pattern, URLPattern) and pattern.name:
+                yield pattern.name
+
+    return set(walk(import_module(urlconf).urlpatterns))
+
+
+class QueryBudgetMixin:
+    # url name -> maximum number of queries of one request
+    budgets: Dict[str, int] = {}
+    # every named route of this urlconf needs a budget
+    urlconf: str = ''
+    # dataset sizes the requests are made at, in increasing order
+    sizes: Tuple[int, ...] = (1, 5)
+
+    def test_budgets_cover_urlconf(self) -> None:
+        if not self.urlconf:
+            return
+        missing = url_names(self.urlconf) - self.budgets.keys()
+        self.assertFalse(missing, f'No query budget for {", ".join(sorted(missing))}.')
+
+    def count_queries(self, request: Callable[[], Any]) -> Tuple[Any, List[str]]:
+        cache.clear()
+        with CaptureQueriesContext(connection) as captured:
+            response = request()
+        return response, [query['sql'] for query in captured.captured_queries]
+
+    def assertQueryBudget(
+        self,
+        url_name: str,
+        request: Callable[[], Any],
+        grow: Callable[[int], None] = lambda count: None,
+        sizes: Tuple[int, ...] = (),
+    ) -> None:
+        budget = self.budgets[url_name]
+        counts: Dict[int, int] = {}
+        current = 0
+        for size in sizes or self.sizes:
+            grow(size - current)
+            current = size
+
+            response, queries = self.count_queries(request)
+            self.assertLess(
+                response.status_code, 400, f'{url_name} answered {response.status_code} with {size} row(s).'
+            )
+            self.assertLessEqual(
+                len(queries),
+                budget,
+                f'{url_name} made {len(queries)} queries with {size} row(s), the budget is {budget}:\n'
+                + '\n'.join(queries),
+            )
+            counts[size] = len(queries)
+
+        # fewer queries are fine, e.g. the first request created a shared row
+        smallest = min(counts)
+        self.assertFalse(
+            [size for size in counts if counts[size] > counts[smallest]],
+            f'{url_name} queries grow with the dataset, rows -> queries: {counts}',
+        )
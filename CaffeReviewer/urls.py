@@ -16,9 +16,13 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import path, include
+from .metrics import metrics_view
 
 
 urlpatterns = [
+    # under a prefix, a single segment would shadow the city page of that slug
+    path('_internal/metrics', metrics_view, name='metrics'),
+
     path("", include('CaffeRatings.urls')),
 
     path('api/', include('API.urls')),